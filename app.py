@@ -1,23 +1,32 @@
 # ---------- FastAPI endpoints here ----------
 
-from datetime import datetime
 from typing import Any, Dict, List, Optional
 
-from fastapi import Body, FastAPI, HTTPException, Query
+from fastapi import Body, FastAPI, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 
 from backend import pydantic_models as models  # (unused right now but kept)
+from backend.answer_cache import answer_cache
 from backend.model import dashboard_model as model
 from backend.model import triage_model as triage
 from backend.model_inference import inference
+from backend.speculative import speculator
+from backend.model_bundle import current_bundle, model_gate
+from backend.request_capture import CaptureLog, RequestCaptureMiddleware, capture_log_from_env
 from backend.queries import general_queries as gq
+from backend.queries.generate_fhir import build_referral_bundle
+from backend.queries.epic_outbox import EpicDispatcher, sink_from_env
+from backend.queries.archive import ArchiveWorker, archive_after_days_from_env
+from backend.queries.maintenance import RequestRateMiddleware, maintenance
+from backend.queries.triage_events import triage_bus
+from backend.queries.write_queue import write_queue
 from backend.queries.dashboard_query import (
-    q_total_triages,
-    q_cases_today,
-    q_cases_this_week,
-    q_search_triages,
+    q_dashboard_stats,
     q_search_triages,
+    q_triage_item,
+    TRIAGE_ITEM_FIELDS,
     q_mark_sent_to_epic,
     q_delete_triage,
 )
@@ -26,13 +35,58 @@ from backend.queries.dashboard_query import (
 
 from backend.db import init_db
 
+try:
+    import orjson  # noqa: F401
+    FastJSONResponse = ORJSONResponse
+except ImportError:  # orjson is optional; stdlib JSON still works, just slower
+    FastJSONResponse = JSONResponse
+
 # ---------------- App & CORS ----------------
 
 app = FastAPI()
+epic_dispatcher: Optional[EpicDispatcher] = None
+archive_worker: Optional[ArchiveWorker] = None
+# Triage API traffic capture for replay only runs when a directory is configured (LUNARA_CAPTURE_DIR)
+capture_log: Optional[CaptureLog] = capture_log_from_env()
 
 @app.on_event("startup")
 def on_startup():
+    global epic_dispatcher, archive_worker
     init_db()
+    write_queue.start()
+    # load the model now rather than on the first triage (LUNARA_KEYWORD_FALLBACK: keywords now, model behind them)
+    try:
+        current_bundle()
+    except Exception as e:
+        print(f"Model not loaded at startup (triage will retry): {e}")
+    if capture_log is not None:
+        capture_log.start()
+    gq.q_backfill_client_phonetic()
+    # Epic hand-off only runs when a sink is configured (LUNARA_EPIC_SINK)
+    sink = sink_from_env()
+    if sink is not None:
+        epic_dispatcher = EpicDispatcher(sink).start()
+    # Archival of closed triages only runs when a retention age is configured (LUNARA_ARCHIVE_AFTER_DAYS)
+    archive_after = archive_after_days_from_env()
+    if archive_after is not None:
+        archive_worker = ArchiveWorker(archive_after).start()
+    # optimize / ANALYZE / checkpoint / incremental vacuum when traffic is quiet (LUNARA_MAINTENANCE=0: off)
+    if maintenance is not None:
+        maintenance.start()
+
+@app.on_event("shutdown")
+def on_shutdown():
+    if epic_dispatcher is not None:
+        epic_dispatcher.stop()
+    if archive_worker is not None:
+        archive_worker.stop()
+    if maintenance is not None:
+        maintenance.stop()
+    speculator.shutdown()
+    if capture_log is not None:
+        capture_log.stop()
+    # last: the workers above may still be writing
+    write_queue.stop()
 
 app.add_middleware(
     CORSMiddleware,
@@ -44,6 +98,10 @@ app.add_middleware(
     allow_headers=["*"],
     allow_credentials=True,
 )
+if capture_log is not None:
+    app.add_middleware(RequestCaptureMiddleware, log=capture_log)
+if maintenance is not None:
+    app.add_middleware(RequestRateMiddleware, scheduler=maintenance)
 
 # ---------------- Utilities ----------------
 
@@ -129,101 +187,61 @@ def get_question(payload: AnswerIn):
 # ---------------- Dashboard APIs (keep as-is) ----------------
 
 @app.get("/api/dashboard/stats", response_model=model.DashboardStats)
-def dashboard_stats():
-    return {
-        "total": q_total_triages(),
-        "today": q_cases_today(),
-        "this_week": q_cases_this_week(),
-    }
+def dashboard_stats(include_archived: bool = Query(False, description="Count archived triages in the total")):
+    return q_dashboard_stats(include_archived)
+
+@app.get("/api/triages/stream")
+async def stream_triages(last_event_id: Optional[str] = Header(None)):
+    # SSE: triage.created / .updated / .ended / .deleted, each carrying the /api/triages item
+    # (and fresh stats on created/deleted), plus triage.archived with the ids of a moved batch.
+    # Listeners never hit the DB.
+    return StreamingResponse(
+        triage_bus.stream(last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+TRIAGE_INCLUDES = {"conversation"}
+
+def _parse_include(include: Optional[str]) -> bool:
+    """ Validates ?include=...; returns whether the conversation was requested. """
+    names = {x.strip() for x in (include or "").split(",") if x.strip()}
+    unknown = names - TRIAGE_INCLUDES
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown include: {', '.join(sorted(unknown))}")
+    return "conversation" in names
 
-@app.get("/api/triages", response_model=None)  # keep flexible to avoid coercion issues
+@app.get("/api/triages", response_class=FastJSONResponse)
 def list_triages(
     q: Optional[str] = Query(None, description="Search by patient name, agent id, or case number"),
     page: int = Query(1, ge=1),
     page_size: int = Query(20, ge=1, le=200),
+    fields: Optional[str] = Query(None, description="Comma-separated item fields to return, e.g. id,case_number,created_date"),
+    include: Optional[str] = Query(None, description="Comma-separated extras to load: conversation"),
+    include_archived: bool = Query(False, description="Also search triages moved to the archive"),
 ):
-    data = q_search_triages(q, page, page_size)
-
-    # If helper already returns the correct envelope, normalize dates and return.
-    if isinstance(data, dict) and "items" in data:
-        items = []
-        for it in data["items"]:
-            it = dict(it)
-            if "id" not in it:
-                if "triage_id" in it:
-                    it["id"] = str(it["triage_id"])
-                else:
-                    it["id"] = str(it.get("id", ""))
-            it.setdefault("case_number", f"TRG-{it['id'].zfill(3) if isinstance(it['id'], str) and it['id'].isdigit() else it['id']}")
-            if "created_date" in it and isinstance(it["created_date"], datetime):
-                it["created_date"] = it["created_date"].isoformat()
-            elif "date_time" in it and isinstance(it["date_time"], datetime):
-                it["created_date"] = it["date_time"].isoformat()
-            else:
-                it.setdefault("created_date", datetime.utcnow().isoformat())
-
-            # If some helper returns JSON in a string, try to parse; otherwise default to []
-            val = it.get("subspecialist_confidences")
-            if isinstance(val, str):
-                try:
-                    import json
-                    it["subspecialist_confidences"] = json.loads(val)
-                except Exception:
-                    it["subspecialist_confidences"] = []
-            elif not isinstance(val, list):
-                it["subspecialist_confidences"] = []
-
-            it["sent_to_epic"] = bool(it.get("sent_to_epic", False))
-            items.append(it)
-
-        total = data.get("total", len(items))
-        total_pages = data.get("total_pages", (total + page_size - 1) // page_size)
-        return {
-            "items": items,
-            "page": data.get("page", page),
-            "page_size": data.get("page_size", page_size),
-            "total": total,
-            "total_pages": total_pages,
-        }
-
-    # Legacy list → wrap
-    if isinstance(data, list):
-        items = []
-        for idx, it in enumerate(data, 1):
-            it = dict(it)
-            if "id" not in it:
-                if "triage_id" in it:
-                    it["id"] = str(it["triage_id"])
-                else:
-                    it["id"] = str(idx)
-            it.setdefault("case_number", f"TRG-{str(it['id']).zfill(3)}")
-            if "created_date" in it and isinstance(it["created_date"], datetime):
-                it["created_date"] = it["created_date"].isoformat()
-            elif "date_time" in it and isinstance(it["date_time"], datetime):
-                it["created_date"] = it["date_time"].isoformat()
-            else:
-                it.setdefault("created_date", datetime.utcnow().isoformat())
-            if not isinstance(it.get("subspecialist_confidences"), list):
-                it["subspecialist_confidences"] = []
-            it["sent_to_epic"] = bool(it.get("sent_to_epic", False))
-            items.append(it)
-
-        total = len(items)
-        return {
-            "items": items,
-            "page": page,
-            "page_size": page_size,
-            "total": total,
-            "total_pages": (total + page_size - 1) // page_size,
-        }
-
-    return {
-        "items": items,
-        "page": page,
-        "page_size": page_size,
-        "total": total,
-        "total_pages": (total + page_size - 1) // page_size,
-    }
+    with_conversation = _parse_include(include)
+    wanted = None
+    if fields:
+        wanted = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in wanted if f not in TRIAGE_ITEM_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+
+    # q_search_triages already returns the final envelope; hand it straight to the
+    # response class so FastAPI doesn't re-walk it through jsonable_encoder.
+    return FastJSONResponse(q_search_triages(q, page, page_size, wanted, with_conversation, include_archived))
+
+@app.get("/api/triages/{triage_id}", response_class=FastJSONResponse)
+def get_triage(
+    triage_id: int,
+    include: Optional[str] = Query("conversation", description="Comma-separated extras to load: conversation"),
+    include_archived: bool = Query(False, description="Also look in the archive"),
+):
+    item = q_triage_item(triage_id, _parse_include(include), include_archived)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Triage case not found")
+    return FastJSONResponse(item)
 
 @app.delete("/api/triages/{triage_id}")
 def delete_triage(triage_id: int):
@@ -232,6 +250,53 @@ def delete_triage(triage_id: int):
         raise HTTPException(status_code=404, detail="Triage case not found or could not be deleted")
     return {"ok": True, "deleted_id": triage_id}
 
+@app.get("/api/referrals")
+def export_referrals(ids: str = Query(..., description="Comma-separated triage ids")):
+    try:
+        triage_ids = [int(x) for x in ids.split(",") if x.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+    # One FHIR Appointment per line, fetched in batches
+    return StreamingResponse(build_referral_bundle(triage_ids), media_type="application/x-ndjson")
+
+@app.get("/api/epic/status")
+def epic_status():
+    if epic_dispatcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **epic_dispatcher.stats()}
+
+@app.get("/api/archive/status")
+def archive_status():
+    if archive_worker is None:
+        return {"enabled": False}
+    return {"enabled": True, **archive_worker.stats()}
+
+@app.get("/api/maintenance/status")
+def maintenance_status():
+    if maintenance is None:
+        return {"enabled": False}
+    return {"enabled": True, **maintenance.stats()}
+
+@app.get("/api/writes/status")
+def writes_status():
+    return write_queue.stats()
+
+@app.get("/api/capture/status")
+def capture_status():
+    if capture_log is None:
+        return {"enabled": False}
+    return {"enabled": True, **capture_log.stats()}
+
+@app.get("/api/model/status")
+def model_status():
+    bundle = current_bundle()
+    return {"bundle_id": bundle.bundle_id, "model_loaded": bundle.predictor is not None, **model_gate.stats()}
+
+@app.get("/api/triage/speculation")
+def speculation_status():
+    # Hit rate of the yes/no/skip branches precomputed while a question is read aloud
+    return speculator.stats()
+
 # ---------------- Triage lifecycle ----------------
 
 @app.post("/api/triage/start", response_model=triage.StartTriageResponse)
@@ -243,21 +308,62 @@ def api_start_triage(req: triage.StartTriageRequest):
     )
     triage_id = gq.q_start_triage(req.agent_id, client_id, req.timestamp)  # Pass timestamp
     
-    # Initialize the model for this triage
-    inference(user_text="", first_call=True)
+    # Initialize the model for this triage (a previous session's speculation is now stale);
+    # the caller's plan is looked up here once and kept with the conversation state
+    speculator.cancel()
+    inference(user_text="", first_call=True, ins_id=gq.q_client_insurance(client_id))
     
     return {"triage_id": triage_id, "client_id": client_id}
 
 # NOTE: drop response_model here so we can include `condition_results` exactly as model returns
 @app.post("/api/triage/answer")
-def api_answer(req: triage.AnswerRequest):
-    try:
-        # 1) persist Q/A
+def api_answer(req: triage.AnswerRequest, explain: bool = Query(False, description="Add the top contributing words / char n-grams per top condition")):
+    # Clients that don't send turn_number keep the old, non-idempotent behaviour
+    if req.turn_number is None:
         gq.q_insert_triage_question(req.triage_id, req.question, req.answer)
+        return _answer_turn(req, explain)
 
-        # 2) run model; it needs last_ans to advance
-        print(f"Calling inference with: user_text='{req.answer}', last_ans={req.last_ans}")
-        result = inference(user_text=req.answer, last_ans=(req.last_ans or -1)) or {}
+    # A retried turn replays the first response: no second Q/A row, no second model step
+    key = (req.triage_id, req.turn_number)
+    try:
+        owner, cached = answer_cache.begin(key)
+    except TimeoutError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if not owner:
+        return cached
+
+    claimed = False
+    progress: Dict[str, bool] = {}
+    try:
+        # 1) persist Q/A; the (triage_id, turn_number) unique index makes this the claim
+        claimed = gq.q_insert_triage_question(req.triage_id, req.question, req.answer, req.turn_number)
+        if not claimed:
+            # Logged before this cache entry existed (restart/expiry); re-running would advance the model twice
+            raise HTTPException(status_code=409, detail=f"Turn {req.turn_number} of triage {req.triage_id} was already answered")
+        response = _answer_turn(req, explain, progress)
+    except BaseException as e:
+        if claimed and progress.get("inferred"):
+            # The model state already moved past this turn: keep the claim so a retry can't apply
+            # the answer twice, and replay this failure to it instead
+            status = e.status_code if isinstance(e, HTTPException) else 500
+            detail = e.detail if isinstance(e, HTTPException) else f"Error processing answer: {e}"
+            answer_cache.finish(key, JSONResponse(status_code=status, content={"detail": detail}))
+            raise
+        if claimed:
+            gq.q_delete_triage_question(req.triage_id, req.turn_number)
+        answer_cache.abort(key)
+        raise
+    answer_cache.finish(key, response)
+    return response
+
+def _answer_turn(req: triage.AnswerRequest, explain: bool = False, progress: Optional[Dict[str, bool]] = None) -> Dict[str, Any]:
+    try:
+        # 2) run model; it needs last_ans to advance (0 is "no", only a missing answer is a skip)
+        last_ans = req.last_ans if req.last_ans is not None else -1
+        print(f"Calling inference with: user_text='{req.answer}', last_ans={last_ans}")
+        result = speculator.answer(user_text=req.answer, last_ans=last_ans, explain=explain) or {}
+        if progress is not None:
+            progress["inferred"] = True  # conversation state is saved: this turn can't be re-run
         print(f"Inference result: {result}")
 
         subs = result.get("subspecialty_results") or []
@@ -315,6 +421,11 @@ def api_answer(req: triage.AnswerRequest):
             "subspecialty_results": subs_out,
             "condition_results": conds,
             "doctor_results": docs_out,  # Use formatted version for frontend
+            # stopping policy (LUNARA_STOP_*) or question bank ran out: the rankings above are final
+            "done": bool(result.get("done")),
+            "stop_reason": result.get("stop_reason"),
+            "source": result.get("source", "model"),
+            **({"explanation": result["explanation"]} if "explanation" in result else {}),
         }
     
     except Exception as e:
@@ -327,4 +438,5 @@ def api_answer(req: triage.AnswerRequest):
 @app.post("/api/triage/end")
 def api_end_triage(req: triage.EndTriageRequest):
     gq.q_end_triage(req.triage_id, req.agent_notes)
+    speculator.cancel()
     return {"ok": True}
\ No newline at end of file
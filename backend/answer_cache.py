@@ -0,0 +1,59 @@
+# backend/answer_cache.py
+''' Short-lived, in-process response cache that makes /api/triage/answer retries idempotent '''
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+TTL_S = 600.0
+MAX_ENTRIES = 4096
+WAIT_S = 120.0  # how long a duplicate waits for the in-flight original
+
+class AnswerCache:
+    """
+    Keyed by (triage_id, turn_number). The first request for a key owns it and computes
+    the response; duplicates that arrive meanwhile block until it finishes and get the same
+    response, and later duplicates are served from the cache until the entry expires.
+    """
+
+    def __init__(self, ttl_s: float = TTL_S, max_entries: int = MAX_ENTRIES):
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._done: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, threading.Event] = {}
+        self.hits = 0
+
+    def begin(self, key: Hashable, wait_s: float = WAIT_S) -> Tuple[bool, Optional[Any]]:
+        """ (True, None) -> caller owns the key and must finish()/abort(); (False, response) -> replay it. """
+        while True:
+            with self._lock:
+                entry = self._done.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self.hits += 1
+                    return False, entry[1]
+                ev = self._inflight.get(key)
+                if ev is None:
+                    self._inflight[key] = threading.Event()
+                    return True, None
+            if not ev.wait(wait_s):
+                raise TimeoutError(f"request {key} is still being processed")
+            # Original finished (or aborted): loop to read its response or take ownership
+
+    def finish(self, key: Hashable, response: Any) -> None:
+        with self._lock:
+            self._done[key] = (time.monotonic() + self.ttl_s, response)
+            self._done.move_to_end(key)
+            while len(self._done) > self.max_entries:
+                self._done.popitem(last=False)
+            ev = self._inflight.pop(key, None)
+        if ev is not None:
+            ev.set()
+
+    def abort(self, key: Hashable) -> None:
+        with self._lock:
+            ev = self._inflight.pop(key, None)
+        if ev is not None:
+            ev.set()
+
+answer_cache = AnswerCache()
@@ -0,0 +1,173 @@
+# backend/calibration.py
+''' Fitted subspecialty calibration: replaces the hand-tuned class_imbalance / exp(iter_cnt) sharpening '''
+# Fit (repo root, needs sgd_softmax_best.joblib): python -m backend.calibration
+import hashlib
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Union
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parent
+MODEL_DIR = BACKEND_DIR / "model"
+DATA_DIR = BACKEND_DIR / "data"
+CALIBRATION_FILE = "calibration.json"
+CALIBRATION_VERSION = 1
+N_SSPEC = 6
+TEMPERATURE_RANGE = (0.05, 20.0)  # keeps a degenerate fit from collapsing to a hard argmax
+
+# The constants inference() used before a calibration was fitted; dividing by the class
+# share is the same as adding -log(share) to the log-score, so this is the fallback bias.
+LEGACY_CLASS_IMBALANCE = np.asarray([0.3088, 0.2683, 0.1244, 0.0874, 0.107, 0.104])
+
+class SubspecialtyCalibration:
+    """
+    Temperature scaling with a per-subspecialty bias over the summed condition probabilities:
+        p = softmax((log(sspec_sum) + bias) / temperature)
+    One vectorized transform; stable at any confidence (no power of a power).
+    """
+
+    def __init__(self, bias: np.ndarray, temperature: float, meta: Dict[str, Any] = None):
+        self.bias = np.asarray(bias, dtype=np.float64)
+        self.temperature = float(temperature)
+        self.meta = meta or {}
+
+    def __call__(self, sspec_sum: np.ndarray) -> np.ndarray:
+        z = (np.log(np.asarray(sspec_sum, dtype=np.float64) + 1e-12) + self.bias) / self.temperature
+        z -= z.max(axis=-1, keepdims=True)
+        e = np.exp(z)
+        return e / e.sum(axis=-1, keepdims=True)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "version": CALIBRATION_VERSION,
+            "bias": [round(float(b), 6) for b in self.bias],
+            "temperature": round(self.temperature, 6),
+            **self.meta,
+        }
+
+@lru_cache(maxsize=1)
+def legacy_calibration() -> SubspecialtyCalibration:
+    return SubspecialtyCalibration(-np.log(LEGACY_CLASS_IMBALANCE), 1.0, {"source": "legacy class_imbalance"})
+
+def model_fingerprint(model_dir: Union[str, Path] = MODEL_DIR) -> str:
+    """ sha256 of the classifier the calibration was fitted against. """
+    h = hashlib.sha256()
+    with open(Path(model_dir) / "sgd_softmax_best.joblib", "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+@lru_cache(maxsize=4)
+def _load(path: str, mtime: float) -> SubspecialtyCalibration:
+    with open(path) as f:
+        data = json.load(f)
+    if data.get("version") != CALIBRATION_VERSION:
+        print(f"Ignoring {path}: calibration version {data.get('version')} != {CALIBRATION_VERSION}")
+        return legacy_calibration()
+    meta = {k: v for k, v in data.items() if k not in ("version", "bias", "temperature")}
+    try:
+        if meta.get("model_sha256") and meta["model_sha256"] != model_fingerprint(Path(path).parent):
+            print(f"Warning: {path} was fitted against a different sgd_softmax_best.joblib; refit it")
+    except FileNotFoundError:
+        pass
+    return SubspecialtyCalibration(np.asarray(data["bias"]), data["temperature"], meta)
+
+def load_calibration(model_dir: Union[str, Path] = MODEL_DIR) -> SubspecialtyCalibration:
+    """ Parsed once per file version (keyed on mtime); falls back to the legacy prior correction. """
+    path = Path(model_dir) / CALIBRATION_FILE
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return legacy_calibration()
+    return _load(str(path), mtime)
+
+# ---------------- Fitting ----------------
+
+def _nll(params: np.ndarray, log_s: np.ndarray, y: np.ndarray) -> float:
+    bias, temperature = params[:N_SSPEC], np.exp(params[N_SSPEC])
+    z = (log_s + bias) / temperature
+    z -= z.max(axis=1, keepdims=True)
+    log_p = z - np.log(np.exp(z).sum(axis=1, keepdims=True))
+    return float(-log_p[np.arange(len(y)), y].mean())
+
+def _ece(p: np.ndarray, y: np.ndarray, bins: int = 10) -> float:
+    conf, pred = p.max(axis=1), p.argmax(axis=1)
+    edges = np.linspace(0, 1, bins + 1)
+    err = 0.0
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        m = (conf > lo) & (conf <= hi)
+        if m.any():
+            err += m.mean() * abs(conf[m].mean() - (pred[m] == y[m]).mean())
+    return float(err)
+
+def fit_calibration(sspec_sums: np.ndarray, y: np.ndarray, meta: Dict[str, Any] = None) -> SubspecialtyCalibration:
+    """ Minimise NLL over (bias[6], log temperature), starting from the legacy prior. """
+    from scipy.optimize import minimize
+
+    log_s = np.log(np.asarray(sspec_sums, dtype=np.float64) + 1e-12)
+    start = legacy_calibration()
+    x0 = np.concatenate([start.bias, [0.0]])
+    bounds = [(None, None)] * N_SSPEC + [(np.log(TEMPERATURE_RANGE[0]), np.log(TEMPERATURE_RANGE[1]))]
+    res = minimize(_nll, x0, args=(log_s, y), method="L-BFGS-B", bounds=bounds)
+    bias = res.x[:N_SSPEC] - res.x[:N_SSPEC].mean()  # softmax is shift-invariant; keep it centred
+    cal = SubspecialtyCalibration(bias, float(np.exp(res.x[N_SSPEC])), dict(meta or {}))
+
+    before, after = start(sspec_sums), cal(sspec_sums)
+    cal.meta["metrics"] = {
+        "nll_legacy": round(_nll(x0, log_s, y), 4),
+        "nll": round(float(res.fun), 4),
+        "ece_legacy": round(_ece(before, y), 4),
+        "ece": round(_ece(after, y), 4),
+        "accuracy": round(float((after.argmax(axis=1) == y).mean()), 4),
+    }
+    return cal
+
+def subspecialty_sums(cond_probs: np.ndarray, sspec_map: np.ndarray) -> np.ndarray:
+    """ (n, n_conditions) condition probabilities -> (n, 6) per-subspecialty sums. """
+    onehot = np.zeros((cond_probs.shape[1], N_SSPEC))
+    onehot[np.arange(len(sspec_map)), sspec_map] = 1.0
+    return cond_probs @ onehot
+
+if __name__ == "__main__":
+    import argparse
+    import pandas as pd
+    from backend.model_inference import ConditionSoftmaxPredictor
+
+    ap = argparse.ArgumentParser(description="Fit the subspecialty calibration and write model/calibration.json")
+    ap.add_argument("--model-dir", default=str(MODEL_DIR))
+    ap.add_argument("--holdout", type=float, default=0.3, help="share of utterances kept out of the fit for reporting")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    df = pd.read_csv(DATA_DIR / "training_dataset.csv")
+    sspecs = pd.read_csv(DATA_DIR / "sspec_key_map.csv")
+    y = df["target_subspecialty"].map(dict(zip(sspecs["subspecialty"], sspecs["sspec_ID"]))).to_numpy()
+    sspec_map = pd.read_csv(DATA_DIR / "symptoms_full.csv")["sspec_ID"].to_numpy(dtype=np.int64)
+
+    predictor = ConditionSoftmaxPredictor(args.model_dir)
+    sums = subspecialty_sums(predictor.predict_proba(df["user_input"].tolist()), sspec_map)
+
+    rng = np.random.default_rng(args.seed)
+    held = rng.random(len(y)) < args.holdout
+    cal = fit_calibration(sums[~held], y[~held], {
+        "model_sha256": model_fingerprint(args.model_dir),
+        "fitted_on": int((~held).sum()),
+    })
+    if held.any():
+        legacy = legacy_calibration()
+        log_s = np.log(sums[held] + 1e-12)
+        cal.meta["holdout"] = {
+            "n": int(held.sum()),
+            "nll_legacy": round(_nll(np.concatenate([legacy.bias, [0.0]]), log_s, y[held]), 4),
+            "nll": round(_nll(np.concatenate([cal.bias, [np.log(cal.temperature)]]), log_s, y[held]), 4),
+            "ece_legacy": round(_ece(legacy(sums[held]), y[held]), 4),
+            "ece": round(_ece(cal(sums[held]), y[held]), 4),
+        }
+
+    out = Path(args.model_dir) / CALIBRATION_FILE
+    with open(out, "w") as f:
+        json.dump(cal.to_json(), f, indent=2)
+    print(json.dumps(cal.to_json(), indent=2))
+    print(f"-> {out}")
@@ -0,0 +1,200 @@
+# backend/char_ngrams.py
+''' Vectorized drop-in for the fitted tfidf_char transform: same feature indices and values, no per-n-gram str objects '''
+# Parity: tests/test_char_ngrams.py; parity + timing from the CLI (repo root): python -m backend.char_ngrams
+import re
+from typing import List, Optional
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# sklearn's _char_ngrams collapses runs of whitespace before slicing
+_WHITE_SPACES = re.compile(r"\s\s+")
+
+class FastCharTfidf:
+    """
+    Replays a fitted TfidfVectorizer(analyzer="char") without building n-gram strings.
+
+    The vocabulary only uses a small alphabet, so every character is mapped to a code in
+    1..A (0 = not in the alphabet) and each n-gram becomes an exact base-(A+1) integer key,
+    computed for the whole batch with a few rolling numpy ops. Keys of different lengths land
+    in disjoint ranges because the leading code is never 0; a window containing a 0 can't be
+    in the vocabulary and is dropped. Keys are looked up with one searchsorted against the
+    sorted vocabulary keys, counted per document, then idf-weighted and normalized exactly
+    like TfidfTransformer.
+    """
+
+    def __init__(self, vectorizer):
+        self.min_n, self.max_n = vectorizer.ngram_range
+        self.lowercase = vectorizer.lowercase
+        self.norm = vectorizer.norm
+        self.sublinear_tf = vectorizer.sublinear_tf
+        self.binary = vectorizer.binary
+        self.idf = vectorizer.idf_.astype(np.float64) if vectorizer.use_idf else None
+        self.n_features = len(vectorizer.vocabulary_)
+        self.dtype = vectorizer.dtype
+
+        alphabet = sorted(set("".join(vectorizer.vocabulary_)))
+        self.base = len(alphabet) + 1
+        if self.base ** self.max_n >= 2 ** 63:
+            raise ValueError(f"alphabet of {len(alphabet)} chars is too large for exact {self.max_n}-gram keys")
+        cps = np.fromiter((ord(ch) for ch in alphabet), dtype=np.int64, count=len(alphabet))
+        # codepoint -> code; anything past the table clips onto its last slot, which stays 0
+        self._lut = np.zeros(int(cps.max()) + 2, dtype=np.int64)
+        self._lut[cps] = np.arange(1, len(alphabet) + 1)
+
+        keys = np.fromiter((self._key(g) for g in vectorizer.vocabulary_), dtype=np.int64,
+                           count=self.n_features)
+        cols = np.fromiter(vectorizer.vocabulary_.values(), dtype=np.int64, count=self.n_features)
+        order = np.argsort(keys)
+        self._keys, self._cols = keys[order], cols[order]
+
+    @classmethod
+    def from_vectorizer(cls, vectorizer) -> Optional["FastCharTfidf"]:
+        """ None when the vectorizer uses anything this replay doesn't reproduce (then keep sklearn's transform). """
+        if vectorizer is None:
+            return None
+        p = vectorizer.get_params()
+        supported = (
+            p["analyzer"] == "char" and p["preprocessor"] is None and p["strip_accents"] is None
+            and p["input"] == "content" and p["norm"] in ("l2", "l1", None)
+            and hasattr(vectorizer, "vocabulary_")
+        )
+        if not supported:
+            return None
+        try:
+            return cls(vectorizer)
+        except ValueError as e:
+            print(f"Char n-gram fast path disabled: {e}")
+            return None
+
+    def _key(self, gram: str) -> int:
+        key = 0
+        for ch in gram:
+            key = key * self.base + int(self._lut[ord(ch)])
+        return key
+
+    def _codes(self, texts: List[str]) -> np.ndarray:
+        joined = "".join(texts)
+        cp = np.frombuffer(joined.encode("utf-32-le", "surrogatepass"), dtype=np.uint32).astype(np.int64)
+        return self._lut[np.minimum(cp, len(self._lut) - 1)]
+
+    def transform(self, texts: List[str]) -> csr_matrix:
+        return self.tfidf(self.counts(texts))
+
+    def counts(self, texts: List[str]) -> csr_matrix:
+        """ Raw n-gram counts (float64), what CountVectorizer.transform would return. """
+        if isinstance(texts, str):
+            raise ValueError("Iterable over raw text documents expected, string object received.")
+        docs = [_WHITE_SPACES.sub(" ", t.lower() if self.lowercase else t) for t in texts]
+        lens = np.fromiter((len(d) for d in docs), dtype=np.int64, count=len(docs))
+        starts = np.concatenate([[0], np.cumsum(lens)])
+        codes = self._codes(docs)
+        doc_of = np.repeat(np.arange(len(docs), dtype=np.int64), lens)
+        # a window is valid when it has no 0 code and doesn't run past its own document
+        zeros = np.concatenate([[0], np.cumsum(codes == 0)])
+        doc_end = starts[1:][doc_of]
+
+        pos_parts, col_parts = [], []
+        key = np.zeros(len(codes), dtype=np.int64)
+        for n in range(1, self.max_n + 1):
+            m = len(codes) - n + 1
+            if m <= 0:
+                break
+            key = key[:m] * self.base + codes[n - 1:n - 1 + m]
+            if n < self.min_n:
+                continue
+            j = np.arange(m)
+            ok = (zeros[j + n] == zeros[j]) & (j + n <= doc_end[:m])
+            k = key[ok]
+            at = np.searchsorted(self._keys, k)
+            at[at == len(self._keys)] = 0
+            hit = self._keys[at] == k
+            pos_parts.append(j[ok][hit])
+            col_parts.append(self._cols[at[hit]])
+
+        pos = np.concatenate(pos_parts) if pos_parts else np.zeros(0, dtype=np.int64)
+        cols = np.concatenate(col_parts) if col_parts else np.zeros(0, dtype=np.int64)
+        cell, counts = np.unique(doc_of[pos] * self.n_features + cols, return_counts=True)
+        rows, cols = np.divmod(cell, self.n_features)
+
+        vals = counts.astype(np.float64)
+        if self.binary:
+            vals[:] = 1.0
+        indptr = np.searchsorted(rows, np.arange(len(docs) + 1))
+        return csr_matrix((vals, cols, indptr), shape=(len(docs), self.n_features))
+
+    def tfidf(self, counts: csr_matrix) -> csr_matrix:
+        """ idf weighting + normalization, as TfidfTransformer.transform does it. """
+        X = counts.astype(np.float64, copy=True)
+        if self.sublinear_tf:
+            np.log(X.data, X.data)
+            X.data += 1.0
+        if self.idf is not None:
+            X.data *= self.idf[X.indices]
+        if self.norm is not None:
+            from sklearn.preprocessing import normalize
+            X = normalize(X, norm=self.norm, copy=False)
+        return X.astype(self.dtype, copy=False)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    import warnings
+    from pathlib import Path
+
+    import pandas as pd
+    from joblib import load
+
+    warnings.filterwarnings("ignore", message="Trying to unpickle estimator")
+    backend_dir = Path(__file__).resolve().parent
+    ap = argparse.ArgumentParser(description="Check FastCharTfidf against the fitted tfidf_char.joblib")
+    ap.add_argument("--model-dir", default=str(backend_dir / "model"))
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    v_char = load(Path(args.model_dir) / "tfidf_char.joblib")
+    fast = FastCharTfidf.from_vectorizer(v_char)
+    if fast is None:
+        raise SystemExit("tfidf_char.joblib uses options FastCharTfidf doesn't replay")
+    texts = pd.read_csv(backend_dir / "data" / "training_dataset.csv")["user_input"].astype(str).tolist()
+
+    def _diff(batch):
+        want, got = v_char.transform(batch).tocsr(), fast.transform(batch)
+        want.sort_indices(), got.sort_indices()
+        if not (np.array_equal(want.indptr, got.indptr) and np.array_equal(want.indices, got.indices)):
+            return None, got.nnz
+        return (float(np.abs(want.data - got.data).max()) if want.nnz else 0.0), got.nnz
+
+    def _check(name, batch):
+        err, nnz = _diff(batch)
+        ok = err is not None and err <= 1e-12
+        print(f"{name}: {len(batch)} docs, nnz {nnz}, "
+              + ("indices DIFFER" if err is None else f"max |diff| {err:.1e}") + f" -> {'ok' if ok else 'MISMATCH'}")
+        return ok
+
+    def _time(fn, batch):
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            fn(batch)
+            best = min(best, time.perf_counter() - t0)
+        return best * 1e3
+
+    # the whole set batched, one utterance at a time (the request path), and long transcripts
+    # the way inference() grows work_str turn after turn
+    transcripts = [" ".join(texts[i:i + 40]) for i in range(0, len(texts), 40)]
+    singles = [_diff([t])[0] for t in texts]
+    single_ok = all(e is not None and e <= 1e-12 for e in singles)
+    print(f"per utterance: {len(texts)} single-doc calls -> {'ok' if single_ok else 'MISMATCH'}")
+    ok = all([
+        single_ok,
+        _check("training_dataset.csv", texts),
+        _check("long transcripts", transcripts),
+        _check("edge cases", ["", "ab", "abc", "A\t\tB  c\n\nd", "naïve café ✓ 𝄞𝄞𝄞", "?" * 7, "Pap  SMEAR\u00a0\u00a0pain"]),
+    ])
+    for name, batch in (("single utterance", texts[:1]), ("long transcript", transcripts[:1]),
+                        ("training_dataset.csv", texts)):
+        base, new = _time(v_char.transform, batch), _time(fast.transform, batch)
+        print(f"{name:>22}: sklearn {base:8.2f} ms, fast {new:8.2f} ms ({base / new:.1f}x)")
+    raise SystemExit(0 if ok else 1)
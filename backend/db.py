@@ -1,17 +1,24 @@
 import sqlite3
 import os
+from typing import List
 
 # Allow overriding via env; default to lunara.db in the user's home directory to avoid repo-local sqlite files
 DB_PATH = os.getenv("LUNARA_DB_PATH", os.path.join(os.path.expanduser("~"), "lunara.db"))
 
-def get_connection():
+def get_connection(with_archive: bool = False):
     conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.execute("PRAGMA foreign_keys = ON;")
     conn.row_factory = sqlite3.Row
+    if with_archive:
+        attach_archive(conn)
     return conn
 
 def init_db():
     conn = get_connection()
+    # Only takes effect on a new (empty) file; older databases convert with a one-off VACUUM
+    # (python -m backend.queries.maintenance convert). Lets the maintenance scheduler return
+    # pages freed by deletes to the filesystem a few hundred at a time.
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
     c = conn.cursor()
     
     # insurance
@@ -85,4 +92,178 @@ def init_db():
     """)
 
     conn.commit()
+    migrate(conn)
     conn.close()
+
+# ---------------- Migrations ----------------
+# init_db() creates the original (version 0) tables; everything after that is a numbered
+# migration. PRAGMA user_version records the last one applied, so each runs exactly once.
+
+def _merge_duplicate_clients(c):
+    # Older databases matched clients case/whitespace-sensitively, so the same person can
+    # exist several times. Fold them onto the lowest client_id before the unique index goes on.
+    c.execute("""
+    CREATE TEMP TABLE client_merge AS
+    SELECT client_id,
+           MIN(client_id) OVER (
+               PARTITION BY lower(trim(client_fn)), lower(trim(client_ln)), client_dob
+           ) AS keep_id
+    FROM client;
+    """)
+    dup_ids = "SELECT client_id FROM client_merge WHERE client_id <> keep_id"
+    c.execute(f"""
+    UPDATE triage
+    SET client_id = (SELECT keep_id FROM client_merge m WHERE m.client_id = triage.client_id)
+    WHERE client_id IN ({dup_ids});
+    """)
+    c.execute(f"DELETE FROM client WHERE client_id IN ({dup_ids});")
+    c.execute("DROP TABLE client_merge;")
+
+def _m1_client_identity(c):
+    # client identity: one row per (name, DOB), ignoring case and surrounding whitespace
+    _merge_duplicate_clients(c)
+    c.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_client_identity
+    ON client (lower(trim(client_fn)), lower(trim(client_ln)), client_dob);
+    """)
+
+    # client_phonetic: soundex codes for near-duplicate candidate lookup
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS client_phonetic (
+        client_id INTEGER PRIMARY KEY REFERENCES client(client_id) ON DELETE CASCADE,
+        fn_code VARCHAR(4),
+        ln_code VARCHAR(4),
+        client_dob DATE
+    );
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_client_phonetic_ln_dob ON client_phonetic (ln_code, client_dob);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_client_phonetic_dob_fn ON client_phonetic (client_dob, fn_code);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_client_phonetic_ln_fn ON client_phonetic (ln_code, fn_code);")
+
+def _m2_query_indexes(c):
+    # q_delete_triage and any per-triage Q/A lookup
+    c.execute("CREATE INDEX IF NOT EXISTS idx_triage_question_triage ON triage_question (triage_id);")
+    # client -> triages join
+    c.execute("CREATE INDEX IF NOT EXISTS idx_triage_client ON triage (client_id);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_triage_agent ON triage (agent_id);")
+    # date_time holds both CURRENT_TIMESTAMP and ISO-8601 'T...Z' strings; datetime() folds
+    # them to one sortable form, and the dashboard counts range-scan on that expression
+    c.execute("CREATE INDEX IF NOT EXISTS idx_triage_datetime ON triage (datetime(date_time));")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_triage_sent_to_epic ON triage (sent_to_epic, triage_id);")
+    # q_get_or_create_doctor_by_name
+    c.execute("CREATE INDEX IF NOT EXISTS idx_doctor_name ON doctor (doc_fn, doc_ln);")
+
+def _m3_epic_outbox(c):
+    # One row per triage queued for Epic; next_attempt_at is unix time (also used as a claim lease)
+    c.execute("""
+    CREATE TABLE IF NOT EXISTS epic_outbox (
+        outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        triage_id INT NOT NULL UNIQUE REFERENCES triage(triage_id) ON DELETE CASCADE,
+        idempotency_key VARCHAR(64) NOT NULL UNIQUE,
+        status VARCHAR(16) NOT NULL DEFAULT 'pending',
+        attempts INT NOT NULL DEFAULT 0,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        sent_at TIMESTAMP
+    );
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_epic_outbox_due ON epic_outbox (status, next_attempt_at);")
+
+def _m4_answer_turns(c):
+    # turn_number makes /api/triage/answer idempotent: a retried turn hits the unique index
+    # instead of logging the Q/A (and advancing the model) twice. Existing rows are numbered
+    # in insertion order.
+    c.execute("ALTER TABLE triage_question ADD COLUMN turn_number INTEGER;")
+    c.execute("""
+    UPDATE triage_question
+    SET turn_number = (
+        SELECT COUNT(*) FROM triage_question q
+        WHERE q.triage_id = triage_question.triage_id
+          AND q.triage_question_id <= triage_question.triage_question_id
+    );
+    """)
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ux_triage_question_turn ON triage_question (triage_id, turn_number);")
+
+MIGRATIONS = [
+    (1, _m1_client_identity),
+    (2, _m2_query_indexes),
+    (3, _m3_epic_outbox),
+    (4, _m4_answer_turns),
+]
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+def migrate(conn) -> int:
+    """ Apply pending migrations in order, one transaction each. Returns the resulting version. """
+    for version, step in MIGRATIONS:
+        if schema_version(conn) >= version:
+            continue
+        # IMMEDIATE takes the write lock up front so concurrent workers apply each step once
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            if schema_version(conn) < version:
+                step(conn)
+                conn.execute(f"PRAGMA user_version = {int(version)};")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return schema_version(conn)
+
+# ---------------- Archive ----------------
+# Closed triages past the retention age move out of the live tables into per-month partitions
+# (triage_YYYY_MM / triage_question_YYYY_MM) in a second SQLite file. Only queries that ask for
+# history attach it, as `archive`; the *_archived views UNION ALL the partitions.
+
+ARCHIVE_SCHEMA = "archive"
+ARCHIVED_TABLES = ("triage", "triage_question")
+
+def archive_path() -> str:
+    # Next to the live database unless LUNARA_ARCHIVE_DB_PATH says otherwise
+    return os.getenv("LUNARA_ARCHIVE_DB_PATH") or os.path.splitext(DB_PATH)[0] + "_archive.db"
+
+def table_columns(conn, schema: str, table: str) -> List[str]:
+    return [r[1] for r in conn.execute(f"PRAGMA {schema}.table_info({table});")]
+
+def archive_months(conn) -> List[str]:
+    """ 'YYYY_MM' of every partition, oldest first. """
+    rows = conn.execute(
+        f"""
+        SELECT name FROM {ARCHIVE_SCHEMA}.sqlite_master
+        WHERE type = 'table' AND name GLOB 'triage_[0-9][0-9][0-9][0-9]_[0-9][0-9]'
+        ORDER BY name;
+        """
+    ).fetchall()
+    return [r[0][len("triage_"):] for r in rows]
+
+def rebuild_archive_views(conn) -> None:
+    """ Recreate the *_archived views over the current partitions, in the live tables' column order. """
+    months = archive_months(conn)
+    for table in ARCHIVED_TABLES:
+        cols = table_columns(conn, "main", table)
+        parts = []
+        for month in months:
+            # partitions made before a migration added a column read it as NULL
+            have = set(table_columns(conn, ARCHIVE_SCHEMA, f"{table}_{month}"))
+            select = ", ".join(c if c in have else f"NULL AS {c}" for c in cols)
+            parts.append(f"SELECT {select} FROM {table}_{month}")
+        body = "\nUNION ALL\n".join(parts) or f"SELECT {', '.join(f'NULL AS {c}' for c in cols)} WHERE 0"
+        conn.execute(f"DROP VIEW IF EXISTS {ARCHIVE_SCHEMA}.{table}_archived;")
+        conn.execute(f"CREATE VIEW {ARCHIVE_SCHEMA}.{table}_archived AS {body};")
+
+def attach_archive(conn):
+    conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA};", (archive_path(),))
+    has_views = f"SELECT 1 FROM {ARCHIVE_SCHEMA}.sqlite_master WHERE type = 'view' AND name = 'triage_archived';"
+    if conn.execute(has_views).fetchone() is None:
+        # First use of a fresh archive file; IMMEDIATE so concurrent first users create it once
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            if conn.execute(has_views).fetchone() is None:
+                rebuild_archive_views(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return conn
@@ -0,0 +1,200 @@
+# backend/eval_triage.py
+''' Offline end-to-end evaluation: replay training_dataset.csv through the full inference() question loop '''
+# Usage (repo root): python -m backend.eval_triage --workers 8 --max-turns 8 --out eval_report.json
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from joblib import load
+
+BACKEND_DIR = Path(__file__).resolve().parent
+DATA_DIR = BACKEND_DIR / "data"
+FALLBACK_QUESTION = "Thank you for answering all our questions."
+
+# ---------------- Worker ----------------
+# Each worker process gets its own inference() state dir, so conversations never share
+# work.str / null.idx / ... the way concurrent API calls would.
+
+_STATE_DIR: Optional[str] = None
+
+def _init_worker(parent_dir: str):
+    global _STATE_DIR
+    _STATE_DIR = tempfile.mkdtemp(dir=parent_dir)
+    # pickled vectorizers warn once per load under a newer scikit-learn; keep the output readable
+    warnings.filterwarnings("ignore", message="Trying to unpickle estimator")
+
+def _quiet(fn, **kwargs):
+    # inference() prints every call; keep the worker output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        out = fn(**kwargs)
+    return out, time.perf_counter() - t0
+
+def _top_sspec(result: Dict[str, Any]) -> str:
+    subs = result.get("subspecialty_results") or []
+    return subs[0]["subspecialty_name"] if subs else ""
+
+def _top2(result: Dict[str, Any]) -> List[float]:
+    # best-first, so the stopping sweep can re-score any policy without re-running the model
+    return [float(s["percent_match"]) for s in (result.get("subspecialty_results") or [])[:2]]
+
+def _replay(case: Dict[str, Any], max_turns: int) -> Dict[str, Any]:
+    """
+    One simulated call: the utterance, then up to max_turns yes/no answers. The caller answers
+    truthfully: yes only when the asked question belongs to the target condition.
+    """
+    from backend.model_inference import inference
+
+    _quiet(inference, user_text="", first_call=True, state_dir=_STATE_DIR)
+    result, dt = _quiet(inference, user_text=case["user_input"], last_ans=-1, state_dir=_STATE_DIR)
+    latencies = [dt]
+    top1 = [_top_sspec(result)]
+    top2 = [_top2(result)]
+    doctors = [list((result.get("doctor_results") or {}).values())]
+    asked = []
+
+    for _ in range(max_turns):
+        if result.get("done") or result.get("question") == FALLBACK_QUESTION:
+            break
+        qid = int(load(Path(_STATE_DIR) / "last.qid"))
+        asked.append(qid)
+        # the UI's yes/no buttons send an empty free-text answer plus last_ans
+        answer = 1 if qid == case["target_condition_id"] else 0
+        result, dt = _quiet(inference, user_text="", last_ans=answer, state_dir=_STATE_DIR)
+        latencies.append(dt)
+        top1.append(_top_sspec(result))
+        top2.append(_top2(result))
+        doctors.append(list((result.get("doctor_results") or {}).values()))
+
+    return {
+        "target_condition_id": case["target_condition_id"],
+        "target_subspecialty": case["target_subspecialty"],
+        "top1_by_turn": top1,
+        "top2_by_turn": top2,
+        "doctors_by_turn": doctors,
+        "asked": asked,
+        "latencies_s": latencies,
+    }
+
+def _replay_chunk(cases: List[Dict[str, Any]], max_turns: int) -> List[Dict[str, Any]]:
+    return [_replay(c, max_turns) for c in cases]
+
+# ---------------- Scoring ----------------
+
+def _doctor_truth():
+    """ doctor name -> sspec name, and condition_ID -> set of doctor names that treat it. """
+    docs = pd.read_csv(DATA_DIR / "doc_sspec_map.csv")
+    sspecs = pd.read_csv(DATA_DIR / "sspec_key_map.csv")
+    sspec_name = dict(zip(sspecs["sspec_ID"], sspecs["subspecialty"]))
+    doc_sspec = {row.Name: sspec_name[row.sspec_ID] for row in docs.itertuples()}
+
+    cond_doc = pd.read_csv(DATA_DIR / "cond_doc_map.csv")
+    names = docs["Name"].tolist()
+    treats = {
+        int(row[0]): {names[j] for j, v in enumerate(row[1:]) if v}
+        for row in cond_doc.itertuples(index=False)
+    }
+    return doc_sspec, treats
+
+def summarize(runs: List[Dict[str, Any]], max_turns: int, wall_s: float, workers: int) -> Dict[str, Any]:
+    doc_sspec, treats = _doctor_truth()
+    n = len(runs)
+
+    # A conversation that stopped early keeps its last ranking for the later turns
+    def at_turn(seq, t):
+        return seq[min(t, len(seq) - 1)]
+
+    acc_by_turn = [
+        sum(at_turn(r["top1_by_turn"], t) == r["target_subspecialty"] for r in runs) / n
+        for t in range(max_turns + 1)
+    ]
+
+    turns_to_correct = []
+    for r in runs:
+        hit = next((t for t, s in enumerate(r["top1_by_turn"]) if s == r["target_subspecialty"]), None)
+        turns_to_correct.append(hit)
+    reached = [t for t in turns_to_correct if t is not None]
+
+    final_docs = [r["doctors_by_turn"][-1][:3] for r in runs]
+    doc_sspec_hit = [any(doc_sspec.get(d) == r["target_subspecialty"] for d in docs)
+                     for r, docs in zip(runs, final_docs)]
+    covered = [(r, docs) for r, docs in zip(runs, final_docs) if r["target_condition_id"] in treats]
+    doc_cond_hit = [any(d in treats[r["target_condition_id"]] for d in docs) for r, docs in covered]
+
+    lat = np.asarray([x for r in runs for x in r["latencies_s"]]) * 1e3
+    return {
+        "cases": n,
+        "max_turns": max_turns,
+        "workers": workers,
+        "accuracy_by_turn": [round(a, 4) for a in acc_by_turn],
+        "reached_correct": round(len(reached) / n, 4),
+        "mean_turns_to_correct": round(float(np.mean(reached)), 3) if reached else None,
+        "mean_turns_asked": round(float(np.mean([len(r["asked"]) for r in runs])), 3),
+        "doctor_top3_subspecialty_hit": round(float(np.mean(doc_sspec_hit)), 4),
+        "doctor_top3_condition_hit": round(float(np.mean(doc_cond_hit)), 4) if doc_cond_hit else None,
+        "doctor_condition_cases": len(doc_cond_hit),
+        "inference_calls": int(lat.size),
+        "inference_ms_p50": round(float(np.percentile(lat, 50)), 2),
+        "inference_ms_p95": round(float(np.percentile(lat, 95)), 2),
+        "wall_s": round(wall_s, 2),
+        "cases_per_s": round(n / wall_s, 2) if wall_s else None,
+    }
+
+# ---------------- CLI ----------------
+
+def load_cases(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    df = pd.read_csv(DATA_DIR / "training_dataset.csv")
+    if limit:
+        df = df.head(limit)
+    return [
+        {
+            "target_condition_id": int(row.target_condition_id),
+            "target_subspecialty": row.target_subspecialty,
+            "user_input": row.user_input,
+        }
+        for row in df.itertuples()
+    ]
+
+def run(workers: int, max_turns: int, limit: Optional[int] = None, chunk: int = 25) -> Dict[str, Any]:
+    cases = load_cases(limit)
+    chunks = [cases[i:i + chunk] for i in range(0, len(cases), chunk)]
+    state_root = tempfile.mkdtemp(prefix="lunara_eval_")
+    t0 = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(state_root,)) as pool:
+            runs = [r for part in pool.map(_replay_chunk, chunks, [max_turns] * len(chunks)) for r in part]
+    finally:
+        shutil.rmtree(state_root, ignore_errors=True)
+    wall = time.perf_counter() - t0
+    return {"summary": summarize(runs, max_turns, wall, workers), "runs": runs}
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--max-turns", type=int, default=8, help="yes/no questions after the opening utterance")
+    ap.add_argument("--limit", type=int, default=None, help="only the first N utterances")
+    ap.add_argument("--out", default="eval_report.json", help="machine-readable report (summary + per-case runs)")
+    args = ap.parse_args()
+
+    report = run(args.workers, args.max_turns, args.limit)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+
+    s = report["summary"]
+    print(f"{s['cases']} cases, {s['workers']} workers, {s['wall_s']}s wall ({s['cases_per_s']} cases/s)")
+    for t, acc in enumerate(s["accuracy_by_turn"]):
+        print(f"  turn {t}: top-1 subspecialty accuracy {acc:.3f}")
+    print(f"reached correct: {s['reached_correct']:.3f}, mean turns to correct: {s['mean_turns_to_correct']}")
+    print(f"doctor top-3 hit: subspecialty {s['doctor_top3_subspecialty_hit']}, condition {s['doctor_top3_condition_hit']}")
+    print(f"inference p50 {s['inference_ms_p50']} ms, p95 {s['inference_ms_p95']} ms -> {args.out}")
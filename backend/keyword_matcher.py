@@ -0,0 +1,181 @@
+# backend/keyword_matcher.py
+''' Aho-Corasick over the symptoms_full.csv keywords: a per-condition keyword-hit vector in one pass over the words '''
+# Brute-force check: tests/test_keyword_matcher.py; accuracy + timing from the CLI (repo root): python -m backend.keyword_matcher
+import math
+import re
+from collections import deque
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Words as the keyword column writes them: "follow-up", "0-22", "women's"
+_WORD = re.compile(r"[a-z0-9]+(?:['-][a-z0-9]+)*")
+# Filler inside run-together keyword phrases ("bleeding after sex", "no period 6 months")
+STOPWORDS = frozenset("a an and or of in on the to for with after before no not from by at".split())
+BIGRAM_WEIGHT = 2.0  # a two-word phrase is stronger evidence than either word alone
+FLOOR = 0.05  # share of the fallback distribution spread evenly, so no condition is ruled out
+
+def words(text: str) -> List[str]:
+    return _WORD.findall((text or "").lower())
+
+def keyword_patterns(keywords: str) -> List[Tuple[str, ...]]:
+    """
+    The keyword column runs phrases together ("heavy bleeding irregular bleeding ..."), so the
+    patterns are its content words and its adjacent word pairs.
+    """
+    ws = words(keywords)
+    pats = {(w,) for w in ws if w not in STOPWORDS and not w.isdigit()}
+    pats |= {(a, b) for a, b in zip(ws, ws[1:]) if not (a in STOPWORDS and b in STOPWORDS)}
+    return sorted(pats)
+
+class KeywordAutomaton:
+    """
+    Word-level Aho-Corasick: states step on word ids, so one pass over an utterance's words
+    finds every pattern occurrence, overlapping ones included. Each pattern carries a weight
+    per condition (IDF over conditions; BIGRAM_WEIGHT for pairs); hits(text) sums the weights
+    of the distinct patterns found.
+    """
+
+    def __init__(self, patterns: Sequence[Sequence[Tuple[str, ...]]]):
+        self.n_conditions = len(patterns)
+        self.vocab: Dict[str, int] = {}
+        self._goto: List[Dict[int, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]  # state -> pattern ids ending here (incl. via fail links)
+
+        conds_of: Dict[Tuple[str, ...], List[int]] = {}
+        for cond, pats in enumerate(patterns):
+            for p in pats:
+                conds_of.setdefault(tuple(p), []).append(cond)
+        self.patterns: List[Tuple[str, ...]] = sorted(conds_of)
+        for pid, p in enumerate(self.patterns):
+            self._insert(p, pid)
+        self._link()
+
+        # dense (n_patterns, n_conditions): ~1k x 140, and one row gather beats a scatter per pattern
+        self.weights = np.zeros((len(self.patterns), self.n_conditions))
+        for pid, p in enumerate(self.patterns):
+            conds = conds_of[p]
+            idf = math.log(1.0 + self.n_conditions / len(conds))
+            self.weights[pid, conds] = idf * (BIGRAM_WEIGHT if len(p) > 1 else 1.0)
+
+    @classmethod
+    def from_keywords(cls, keywords: Sequence[str]) -> "KeywordAutomaton":
+        """ One entry per condition, in symptoms_full.csv row order. """
+        return cls([keyword_patterns(str(k) if k == k else "") for k in keywords])  # k == k: not NaN
+
+    # ---------------- Build ----------------
+
+    def _insert(self, pattern: Tuple[str, ...], pid: int) -> None:
+        state = 0
+        for w in pattern:
+            wid = self.vocab.setdefault(w, len(self.vocab))
+            nxt = self._goto[state].get(wid)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][wid] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            state = nxt
+        self._out[state].append(pid)
+
+    def _link(self) -> None:
+        todo = deque(self._goto[0].values())
+        while todo:
+            state = todo.popleft()
+            for wid, nxt in self._goto[state].items():
+                todo.append(nxt)
+                if state:
+                    f = self._fail[state]
+                    while f and wid not in self._goto[f]:
+                        f = self._fail[f]
+                    self._fail[nxt] = self._goto[f].get(wid, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    # ---------------- Match ----------------
+
+    def matches(self, text: str) -> List[int]:
+        """ Ids (into self.patterns) of the distinct patterns in text, in order of first occurrence. """
+        goto, fail, out, vocab = self._goto, self._fail, self._out, self.vocab
+        state, seen, found = 0, set(), []
+        for w in words(text):
+            wid = vocab.get(w)
+            if wid is None:
+                state = 0  # a word no pattern contains: nothing can continue through it
+                continue
+            while state and wid not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(wid, 0)
+            for pid in out[state]:
+                if pid not in seen:
+                    seen.add(pid)
+                    found.append(pid)
+        return found
+
+    def hits(self, text: str) -> np.ndarray:
+        """ (n_conditions,) keyword evidence per condition (0 = none of its keywords appear). """
+        found = self.matches(text)
+        if not found:
+            return np.zeros(self.n_conditions)
+        return self.weights[found].sum(axis=0)
+
+    def proba(self, hits: np.ndarray) -> np.ndarray:
+        """ hits -> a distribution over conditions, for when the model can't answer. """
+        total = hits.sum()
+        if total <= 0:
+            return np.full(self.n_conditions, 1.0 / self.n_conditions)
+        return (1.0 - FLOOR) * hits / total + FLOOR / self.n_conditions
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+    from pathlib import Path
+
+    import pandas as pd
+
+    from backend.model_inference import topk_indices
+
+    ap = argparse.ArgumentParser(description="Keyword automaton: agreement with a brute-force scan, fallback accuracy, speed.")
+    ap.add_argument("--limit", type=int, default=None, help="only the first N training utterances")
+    args = ap.parse_args()
+
+    data = Path(__file__).resolve().parent / "data"
+    symptoms = pd.read_csv(data / "symptoms_full.csv")
+    df = pd.read_csv(data / "training_dataset.csv")
+    if args.limit:
+        df = df.head(args.limit)
+    texts = df["user_input"].tolist()
+    sspec_of = symptoms["sspec_ID"].to_numpy()
+    sspec_id = dict(zip(*pd.read_csv(data / "sspec_key_map.csv")[["subspecialty", "sspec_ID"]].T.values))
+
+    t0 = time.perf_counter()
+    ac = KeywordAutomaton.from_keywords(symptoms["keywords"].tolist())
+    build_ms = (time.perf_counter() - t0) * 1e3
+
+    # brute force: every pattern against every word window
+    bad = 0
+    for text in texts:
+        ws = words(text)
+        grams = set(zip(ws)) | set(zip(ws, ws[1:]))
+        want = {pid for pid, p in enumerate(ac.patterns) if p in grams}
+        bad += set(ac.matches(text)) != want
+
+    t0 = time.perf_counter()
+    H = np.stack([ac.hits(t) for t in texts])
+    per_us = (time.perf_counter() - t0) / len(texts) * 1e6
+    chars = np.mean([len(t) for t in texts])
+
+    P = np.stack([ac.proba(h) for h in H])
+    y_cond = df["target_condition_id"].to_numpy()
+    y_sspec = df["target_subspecialty"].map(sspec_id).to_numpy()
+    sums = np.zeros((len(P), sspec_of.max() + 1))
+    np.add.at(sums.T, sspec_of, P.T)
+    top6 = np.mean([c in topk_indices(p, 6) for c, p in zip(y_cond, P)])
+    print(f"{len(ac.patterns)} patterns over {ac.n_conditions} conditions, {len(ac._goto)} states, built in {build_ms:.1f} ms")
+    print(f"{len(texts)} utterances ({chars:.0f} chars avg): {per_us:.1f} us each, {bad} disagree with brute force")
+    # training utterances are written from these very keywords, so this is an upper bound
+    print(f"keywords alone: top-1 subspecialty {np.mean(sums.argmax(1) == y_sspec):.3f}, "
+          f"target condition in top-6 {top6:.3f}, no hit at all {np.mean(H.sum(1) == 0):.3f}")
+    raise SystemExit(1 if bad else 0)
@@ -18,6 +18,7 @@ class TriageSummary(BaseModel):
     final_recommendation: Optional[str] = None
     confidence_score: int
     recommended_doctor: Optional[str] = None
+    recommended_doctors: List[str] = []
     subspecialist_confidences: List[SubspecialistConfidence]
     status: Optional[str] = "completed"
     agent_notes: Optional[str] = None
@@ -17,6 +17,7 @@ class AnswerRequest(BaseModel):
     question: str
     answer: str
     last_ans: Optional[int] = -1  # yes=1, no=0, skip=-1
+    turn_number: Optional[int] = None  # 1-based; makes retries of the same turn idempotent
 
 class AnswerResponse(BaseModel):
     triage_id: int
@@ -24,6 +25,10 @@ class AnswerResponse(BaseModel):
     subspecialty_results: List[Dict[str, Any]]
     condition_results: List[Dict[str, Any]]
     doctor_results: List[Dict[str, Any]]
+    done: bool = False  # no further question; the results above are the final recommendation
+    stop_reason: Optional[str] = None  # confidence | margin | max_turns | exhausted
+    source: str = "model"  # "keywords" when the keyword automaton answered instead of the model
+    explanation: Optional[List[Dict[str, Any]]] = None  # ?explain=true: top contributing features per top condition
 
 class EndTriageRequest(BaseModel):
     triage_id: int
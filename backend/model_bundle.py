@@ -0,0 +1,430 @@
+# backend/model_bundle.py
+''' Immutable, content-hashed model bundles with an atomically swapped CURRENT pointer '''
+# Usage (repo root):
+#   python -m backend.model_bundle build --activate   # snapshot backend/model + backend/data
+#   python -m backend.model_bundle list
+#   python -m backend.model_bundle activate <bundle_id>
+#   python -m backend.model_bundle verify [<bundle_id>]
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = Path(__file__).resolve().parent
+MODEL_DIR = BACKEND_DIR / "model"
+DATA_DIR = BACKEND_DIR / "data"
+BUNDLE_ROOT = Path(os.getenv("LUNARA_MODEL_BUNDLES", MODEL_DIR / "bundles"))
+POINTER = "CURRENT"
+MANIFEST = "manifest.json"
+RELOAD_CHECK_S = 2.0  # how often workers stat the pointer for a new version
+# LUNARA_KEYWORD_FALLBACK=1: until the model is in memory, answer from the keyword automaton
+KEYWORD_FALLBACK = os.getenv("LUNARA_KEYWORD_FALLBACK", "0") == "1"
+# LUNARA_KEYWORD_BOOST=<b>: scale each condition by 1 + b * (its keyword hits / the best one's); 0 = off
+KEYWORD_BOOST = float(os.getenv("LUNARA_KEYWORD_BOOST", "0"))
+
+# (file, source dir, required)
+BUNDLE_FILES = [
+    ("sgd_softmax_best.joblib", MODEL_DIR, True),
+    ("tfidf_word.joblib", MODEL_DIR, True),
+    ("tfidf_char.joblib", MODEL_DIR, False),
+    ("label_map.json", MODEL_DIR, True),
+    ("calibration.json", MODEL_DIR, False),
+    ("symptoms_full.csv", DATA_DIR, True),
+    ("cond_doc_map.csv", DATA_DIR, True),
+    ("doc_sspec_map.csv", DATA_DIR, True),
+    ("sspec_key_map.csv", DATA_DIR, True),
+]
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+# ---------------- Build / activate ----------------
+
+def build_bundle(root: Union[str, Path] = BUNDLE_ROOT, sources: List = BUNDLE_FILES) -> str:
+    """ Snapshot the artifacts into root/<bundle_id>/ and return the id (a content hash). """
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    files: Dict[str, Dict] = {}
+    for name, src_dir, required in sources:
+        src = Path(src_dir) / name
+        if not src.exists():
+            if required:
+                raise FileNotFoundError(f"Bundle needs {src}")
+            continue
+        files[name] = {"sha256": _sha256(src), "bytes": src.stat().st_size, "src": src}
+
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(f"{name}\0{files[name]['sha256']}\n".encode())
+    bundle_id = digest.hexdigest()[:16]
+
+    final = root / bundle_id
+    if final.exists():
+        return bundle_id  # same content already bundled
+
+    # Stage in a sibling temp dir, then rename: readers never see a partial bundle
+    staging = Path(tempfile.mkdtemp(prefix=f".{bundle_id}.", dir=root))
+    try:
+        for name, meta in files.items():
+            shutil.copy2(meta.pop("src"), staging / name)
+        manifest = {"bundle_id": bundle_id, "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "files": files}
+        with open(staging / MANIFEST, "w") as f:
+            json.dump(manifest, f, indent=2)
+        for p in staging.iterdir():
+            os.chmod(p, 0o444)
+        os.chmod(staging, 0o755)  # mkdtemp creates it 0700
+        os.rename(staging, final)
+    except Exception:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return bundle_id
+
+def activate(bundle_id: str, root: Union[str, Path] = BUNDLE_ROOT) -> None:
+    """ Point CURRENT at a bundle; a single os.replace, so readers see the old id or the new one. """
+    root = Path(root)
+    if not (root / bundle_id / MANIFEST).exists():
+        raise FileNotFoundError(f"No bundle {bundle_id} under {root}")
+    fd, tmp = tempfile.mkstemp(prefix=".CURRENT.", dir=root)
+    with os.fdopen(fd, "w") as f:
+        f.write(bundle_id + "\n")
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, root / POINTER)
+
+def current_id(root: Union[str, Path] = BUNDLE_ROOT) -> Optional[str]:
+    try:
+        return (Path(root) / POINTER).read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+def verify(bundle_id: str, root: Union[str, Path] = BUNDLE_ROOT) -> List[str]:
+    """ Files whose content no longer matches the manifest. """
+    path = Path(root) / bundle_id
+    with open(path / MANIFEST) as f:
+        manifest = json.load(f)
+    return [name for name, meta in manifest["files"].items()
+            if not (path / name).exists() or _sha256(path / name) != meta["sha256"]]
+
+# ---------------- Loaded bundle ----------------
+
+class ModelGate:
+    """
+    At most `limit` model calls in flight (LUNARA_MODEL_MAX_INFLIGHT); a request past that gets
+    the keyword answer at once instead of queueing behind the others. No limit -> never falls back.
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self._sem = threading.BoundedSemaphore(limit) if limit else None
+        self.calls = 0
+        self.fallbacks = 0
+
+    def acquire(self) -> bool:
+        if self._sem is not None and not self._sem.acquire(blocking=False):
+            self.fallbacks += 1
+            return False
+        self.calls += 1
+        return True
+
+    def release(self) -> None:
+        if self._sem is not None:
+            self._sem.release()
+
+    def stats(self) -> Dict:
+        return {"max_inflight": self.limit, "model_calls": self.calls, "keyword_fallbacks": self.fallbacks}
+
+model_gate = ModelGate(int(os.getenv("LUNARA_MODEL_MAX_INFLIGHT", "0")) or None)
+
+class ModelBundle:
+    """ Everything inference() reads, loaded into memory once and never mutated. """
+
+    def __init__(self, model_dir: Union[str, Path], data_dir: Union[str, Path], bundle_id: str,
+                 with_model: bool = True):
+        from backend.calibration import load_calibration
+        from backend.keyword_matcher import KeywordAutomaton
+        from backend.model_inference import ConditionSoftmaxPredictor, topk_indices
+
+        self.bundle_id = bundle_id
+        self.path = Path(model_dir)
+        self._topk = topk_indices
+        # None: keywords-only stand-in, served while the real bundle loads
+        self.predictor = ConditionSoftmaxPredictor(model_dir) if with_model else None
+        self.calibration = load_calibration(model_dir)
+        if self.predictor is not None:
+            self.label_map = self.predictor.label_map
+        else:
+            with open(Path(model_dir) / "label_map.json") as f:
+                self.label_map = json.load(f)
+
+        symptoms = pd.read_csv(Path(data_dir) / "symptoms_full.csv").values
+        self.sspec_map = symptoms[:, 1].astype(np.int64)
+        self.cond_map = symptoms[:, 2]
+        self.questions = symptoms[:, 8]
+        self.true_scaler = symptoms[:, 9].astype(np.float32)
+        self.doc_map = pd.read_csv(Path(data_dir) / "cond_doc_map.csv").values
+        self.doc_names = pd.read_csv(Path(data_dir) / "doc_sspec_map.csv").values
+        self.sspecs = pd.read_csv(Path(data_dir) / "sspec_key_map.csv").values
+
+        # keyword hits come out in symptoms row order; the model's classes are in label_map order
+        self.keywords = KeywordAutomaton.from_keywords(symptoms[:, 3])
+        row_of = {int(c): i for i, c in enumerate(symptoms[:, 0])}
+        self._keyword_rows = np.asarray([row_of[int(c)] for c in self.label_map], dtype=np.intp)
+        self._class_of = {int(c): i for i, c in enumerate(self.label_map)}
+
+    @classmethod
+    def from_bundle(cls, bundle_id: str, root: Union[str, Path] = BUNDLE_ROOT, with_model: bool = True) -> "ModelBundle":
+        path = Path(root) / bundle_id
+        return cls(path, path, bundle_id, with_model)
+
+    @classmethod
+    def from_loose_files(cls, with_model: bool = True) -> "ModelBundle":
+        # No bundle activated yet: the files checked into backend/model + backend/data
+        return cls(MODEL_DIR, DATA_DIR, "loose", with_model)
+
+    def keyword_hits(self, text: str) -> np.ndarray:
+        """ Keyword evidence per model class (label_map order). """
+        return self.keywords.hits(text)[self._keyword_rows]
+
+    def _result(self, probs: np.ndarray, text: str, k: int, source: str = "model", X=None) -> Dict:
+        if KEYWORD_BOOST and source == "model":
+            hits = self.keyword_hits(text)
+            if hits.any():
+                probs = probs * (1.0 + KEYWORD_BOOST * hits / hits.max())
+                probs = probs / probs.sum()
+        out = {
+            "probs": probs,
+            "topk": [(int(self.label_map[i]), float(probs[i])) for i in self._topk(probs, k)],
+            "label_map": self.label_map,
+            "source": source,
+        }
+        if X is not None:
+            out["explanation"] = self.explain(X, out["topk"])
+        return out
+
+    def explain(self, X, topk: List, conditions: int = 3, features: int = 5) -> Optional[List[Dict]]:
+        """ The words / char n-grams of the scored tf-idf row X that pushed each top condition up most. """
+        top = topk[:conditions]
+        terms = self.predictor.contributions(X, [self._class_of[int(c)] for c, _p in top], features)
+        if terms is None:
+            return None
+        return [
+            {
+                "condition": self.cond_map[int(c)],
+                "condition_id": int(c),
+                "probability": round(float(p), 4),
+                "features": [{"feature": f, "kind": kind, "contribution": round(v, 4)} for kind, f, v in t],
+            }
+            for (c, p), t in zip(top, terms)
+        ]
+
+    def predict(self, text: str, k: int = 6, explain: bool = False) -> Dict:
+        """ {probs, topk, label_map, source} for one text: one vectorize + one scoring pass, nothing reloaded. """
+        if self.predictor is None or not model_gate.acquire():
+            return self.predict_keywords(text, k)
+        try:
+            X = self.predictor._vectorize([text])
+            probs = self.predictor._proba(X)[0]
+        finally:
+            model_gate.release()
+        return self._result(probs, text, k, X=X if explain else None)
+
+    def predict_keywords(self, text: str, k: int = 6) -> Dict:
+        """ predict() from the keyword automaton alone: tens of microseconds, no model needed. """
+        return self._result(self.keywords.proba(self.keyword_hits(text)), text, k, source="keywords")
+
+    def predict_counts(self, counts, text: str, k: int = 6, explain: bool = False) -> Dict:
+        """ predict(text) from its already computed predictor.counts([text]). """
+        X = self.predictor._tfidf(counts)
+        return self._result(self.predictor._proba(X)[0], text, k, X=X if explain else None)
+
+    def predict_delta(self, base, delta, text: str, k: int = 6, explain: bool = False) -> Dict:
+        """ predict(text) from predictor.linear_base() of an earlier transcript plus the count delta since. """
+        # explaining needs the merged tf-idf row: re-weighted from counts, never re-tokenized
+        X = None
+        if explain:
+            counts = (base[0][0], base[1][0] if len(base) > 1 else None)
+            X = self.predictor._tfidf(self.predictor.add_delta(counts, delta))
+        return self._result(self.predictor.merge_delta(base, delta)[0], text, k, X=X)
+
+class BundleRegistry:
+    """
+    Holds the live ModelBundle. get() is a plain attribute read, so a request keeps using the
+    bundle it started with; a new CURRENT is loaded on a background thread and swapped in only
+    once it is fully in memory, so no request ever waits on a load. With keyword_fallback the
+    very first load works the same way: a keywords-only bundle answers until the model is in.
+    """
+
+    def __init__(self, root: Union[str, Path] = BUNDLE_ROOT, check_s: float = RELOAD_CHECK_S,
+                 keyword_fallback: bool = KEYWORD_FALLBACK):
+        self.root = Path(root)
+        self.check_s = check_s
+        self.keyword_fallback = keyword_fallback
+        self._bundle: Optional[ModelBundle] = None
+        self._lock = threading.Lock()
+        self._loading = False
+        self._next_check = 0.0
+
+    def _load(self, bundle_id: Optional[str], with_model: bool = True) -> ModelBundle:
+        if bundle_id:
+            return ModelBundle.from_bundle(bundle_id, self.root, with_model)
+        return ModelBundle.from_loose_files(with_model)
+
+    def get(self) -> ModelBundle:
+        bundle = self._bundle
+        if bundle is None:
+            with self._lock:
+                if self._bundle is None:
+                    # keywords-only first (milliseconds); the model then loads in the background
+                    self._bundle = self._load(current_id(self.root), with_model=not self.keyword_fallback)
+                bundle = self._bundle
+            if bundle.predictor is None:
+                self._reload_async(current_id(self.root))
+            return bundle
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_s
+            wanted = current_id(self.root)
+            if (wanted and wanted != bundle.bundle_id) or bundle.predictor is None:
+                self._reload_async(wanted)
+        return bundle
+
+    def _reload_async(self, bundle_id: Optional[str]) -> None:
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+
+        def _run():
+            try:
+                fresh = self._load(bundle_id)
+                self._bundle = fresh  # the swap: one reference assignment
+                print(f"Model bundle {fresh.bundle_id} is live")
+            except Exception as e:
+                print(f"Failed to load model bundle {bundle_id}: {e}")
+            finally:
+                with self._lock:
+                    self._loading = False
+
+        threading.Thread(target=_run, name=f"bundle-load-{bundle_id or 'loose'}", daemon=True).start()
+
+registry = BundleRegistry()
+
+def current_bundle() -> ModelBundle:
+    return registry.get()
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Manage content-hashed model bundles.")
+    ap.add_argument("--root", default=str(BUNDLE_ROOT))
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="snapshot backend/model + backend/data into a new bundle")
+    b.add_argument("--activate", action="store_true")
+    b.add_argument("--model-dir", default=str(MODEL_DIR), help="take the model files from here (e.g. a model_compress output)")
+    a = sub.add_parser("activate")
+    a.add_argument("bundle_id")
+    sub.add_parser("list")
+    v = sub.add_parser("verify")
+    v.add_argument("bundle_id", nargs="?")
+    s = sub.add_parser("swap-check", help="measure request latency while bundles are swapped back and forth")
+    s.add_argument("bundle_ids", nargs=2)
+    s.add_argument("--seconds", type=float, default=10.0)
+    e = sub.add_parser("explain-check", help="check explanations add up to the model score and time them")
+    e.add_argument("--texts", type=int, default=500)
+    args = ap.parse_args()
+    root = Path(args.root)
+
+    if args.cmd == "build":
+        model_dir = Path(args.model_dir)
+        bid = build_bundle(root, [(n, model_dir if d == MODEL_DIR else d, r) for n, d, r in BUNDLE_FILES])
+        if args.activate:
+            activate(bid, root)
+        print(bid + (" (active)" if args.activate else ""))
+    elif args.cmd == "activate":
+        activate(args.bundle_id, root)
+        print(f"CURRENT -> {args.bundle_id}")
+    elif args.cmd == "list":
+        live = current_id(root)
+        for p in sorted(root.glob(f"*/{MANIFEST}")):
+            with open(p) as f:
+                m = json.load(f)
+            print(f"{'*' if m['bundle_id'] == live else ' '} {m['bundle_id']}  {m['created']}  {len(m['files'])} files")
+    elif args.cmd == "verify":
+        bid = args.bundle_id or current_id(root)
+        bad = verify(bid, root)
+        print(f"{bid}: " + ("ok" if not bad else f"modified: {', '.join(bad)}"))
+        raise SystemExit(1 if bad else 0)
+    elif args.cmd == "swap-check":
+        reg = BundleRegistry(root, check_s=0.05)
+        activate(args.bundle_ids[0], root)
+        reg.get()
+        lat, seen, stop = [], set(), threading.Event()
+
+        def _requests():
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                bundle = reg.get()
+                bundle.predict("heavy bleeding and pelvic pain")
+                lat.append(time.perf_counter() - t0)
+                seen.add(bundle.bundle_id)
+
+        workers = [threading.Thread(target=_requests) for _ in range(4)]
+        for w in workers:
+            w.start()
+        end, swaps, i = time.time() + args.seconds, 0, 1
+        while time.time() < end:
+            time.sleep(1.0)
+            activate(args.bundle_ids[i % 2], root)
+            swaps, i = swaps + 1, i + 1
+        stop.set()
+        for w in workers:
+            w.join()
+        ms = np.asarray(lat) * 1e3
+        print(f"{len(ms)} requests, {swaps} swaps, bundles served: {sorted(seen)}")
+        print(f"latency p50 {np.percentile(ms, 50):.2f} ms, p99 {np.percentile(ms, 99):.2f} ms, max {ms.max():.2f} ms")
+    elif args.cmd == "explain-check":
+        bundle = BundleRegistry(root).get()
+        p = bundle.predictor
+        texts = pd.read_csv(DATA_DIR / "training_dataset.csv")["user_input"].tolist()[:args.texts]
+        bad = 0
+        for text in texts:
+            X = p._vectorize([text])
+            scores = p.model.decision_function(X)[0]
+            out = bundle.predict(text)
+            classes = [bundle._class_of[c] for c, _p in out["topk"][:3]]
+            # all the terms plus the intercept are the class score; the reported ones are its largest
+            full = X.data[:, None] * p._coef_t[X.indices][:, classes]
+            bad += not np.allclose(full.sum(axis=0) + p.model.intercept_[classes], scores[classes])
+            for j, t in enumerate(p.contributions(X, classes, k=5)):
+                want = [v for v in sorted(full[:, j], reverse=True)[:5] if v > 0]
+                bad += not np.allclose([v for _k, _f, v in t], want)
+            bad += not np.array_equal(bundle.predict(text, explain=True)["probs"], out["probs"])
+
+        def _ms(fn):
+            lat = []
+            for text in texts:
+                t0 = time.perf_counter()
+                fn(text)
+                lat.append((time.perf_counter() - t0) * 1e3)
+            return np.percentile(lat, 50), np.percentile(lat, 95)
+
+        p._feature_names()  # built once, on the first explain
+        plain, explained = _ms(bundle.predict), _ms(lambda t: bundle.predict(t, explain=True))
+        print(f"{len(texts)} texts, {bad} explanations that don't add up to the model score")
+        print(f"predict: p50 {plain[0]:.3f} ms, p95 {plain[1]:.3f} ms; with explain: p50 {explained[0]:.3f} ms, "
+              f"p95 {explained[1]:.3f} ms (+{explained[0] - plain[0]:.3f} ms p50)")
+        sample = bundle.predict(texts[0], explain=True)["explanation"][0]
+        print(f"e.g. {sample['condition']} ({sample['probability']}): "
+              + ", ".join(f"{f['kind']} {f['feature']!r} +{f['contribution']}" for f in sample["features"]))
+        raise SystemExit(1 if bad else 0)
@@ -0,0 +1,171 @@
+# backend/model_compress.py
+''' Offline classifier compression: drop features no class uses, store the weights as float32 or int8 '''
+# Usage (repo root, needs sgd_softmax_best.joblib):
+#   python -m backend.model_compress --out backend/model/compressed --threshold 0.01 --dtype int8
+#   python -m backend.model_bundle build --model-dir backend/model/compressed --activate
+import copy
+import json
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+import numpy as np
+from joblib import dump, load
+
+from backend.calibration import model_fingerprint
+
+BACKEND_DIR = Path(__file__).resolve().parent
+MODEL_DIR = BACKEND_DIR / "model"
+DATA_DIR = BACKEND_DIR / "data"
+DTYPES = ("float64", "float32", "int8")
+
+def feature_mask(coef: np.ndarray, threshold: float) -> np.ndarray:
+    """ Columns where some class weight reaches threshold x the largest weight in the model. """
+    col_max = np.abs(coef).max(axis=0)
+    return col_max >= threshold * col_max.max()
+
+def prune_vectorizer(v, keep: np.ndarray):
+    """ A copy of a fitted TfidfVectorizer with only the `keep` columns, renumbered in order. """
+    v = copy.deepcopy(v)
+    new_index = np.cumsum(keep) - 1
+    v.vocabulary_ = {term: int(new_index[i]) for term, i in v.vocabulary_.items() if keep[i]}
+    if v.use_idf:
+        v.idf_ = v.idf_[keep]
+    if hasattr(v, "_tfidf"):
+        v._tfidf.n_features_in_ = int(keep.sum())  # transform() validates the column count
+    if hasattr(v, "stop_words_"):
+        del v.stop_words_  # terms dropped at fit time; sklearn only keeps them for introspection
+    return v
+
+def quantize(coef: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """ (stored weights, per-class scale or None). int8: one symmetric scale per class row. """
+    if dtype != "int8":
+        return coef.astype(dtype), None
+    scale = np.abs(coef).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    return np.round(coef / scale[:, None]).astype(np.int8), scale
+
+def compress(model_dir: Union[str, Path], out_dir: Union[str, Path], threshold: float = 0.01,
+             dtype: str = "int8") -> Dict[str, Any]:
+    """
+    Write a pruned, reduced-precision copy of the model dir into out_dir: same file names, so
+    model_bundle can snapshot it like the original. ConditionSoftmaxPredictor dequantizes int8
+    (coef_scale_) to float32 once at load.
+    """
+    model_dir, out_dir = Path(model_dir), Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    model = load(model_dir / "sgd_softmax_best.joblib")
+    v_word = load(model_dir / "tfidf_word.joblib")
+    char_path = model_dir / "tfidf_char.joblib"
+    v_char = load(char_path) if char_path.exists() else None
+
+    coef = np.asarray(model.coef_, dtype=np.float64)
+    keep = feature_mask(coef, threshold)
+    n_word = len(v_word.vocabulary_)
+    dump(prune_vectorizer(v_word, keep[:n_word]), out_dir / "tfidf_word.joblib")
+    if v_char is not None:
+        dump(prune_vectorizer(v_char, keep[n_word:]), out_dir / "tfidf_char.joblib")
+
+    model = copy.deepcopy(model)
+    model.coef_, scale = quantize(coef[:, keep], dtype)
+    if scale is not None:
+        model.coef_scale_ = scale
+    model.n_features_in_ = int(keep.sum())
+    dump(model, out_dir / "sgd_softmax_best.joblib")
+
+    shutil.copy2(model_dir / "label_map.json", out_dir / "label_map.json")
+    cal_path = model_dir / "calibration.json"
+    if cal_path.exists():
+        # the posterior barely moves (see the parity report); re-point the fingerprint instead of refitting
+        with open(cal_path) as f:
+            cal = json.load(f)
+        cal["compressed_from"] = cal.get("model_sha256")
+        cal["model_sha256"] = model_fingerprint(out_dir)
+        with open(out_dir / "calibration.json", "w") as f:
+            json.dump(cal, f, indent=2)
+
+    return {
+        "features": int(keep.size),
+        "kept": int(keep.sum()),
+        "kept_word": int(keep[:n_word].sum()),
+        "kept_char": int(keep[n_word:].sum()),
+        "dtype": dtype,
+        "threshold": threshold,
+    }
+
+# ---------------- Parity report ----------------
+
+def _dir_bytes(model_dir: Path) -> int:
+    return sum((model_dir / n).stat().st_size for n in ("sgd_softmax_best.joblib", "tfidf_word.joblib", "tfidf_char.joblib")
+               if (model_dir / n).exists())
+
+def _weight_bytes(predictor) -> int:
+    # the live weight arrays (model.coef_ is a view of _coef_t when they share memory)
+    m = predictor.model
+    arrays = [predictor._coef_t] if predictor._coef_t is not None else []
+    if not any(np.shares_memory(m.coef_, a) for a in arrays):
+        arrays.append(m.coef_)
+    return sum(a.nbytes for a in arrays)
+
+def parity_report(model_dir: Union[str, Path], out_dir: Union[str, Path], limit: Optional[int] = None) -> Dict[str, Any]:
+    """ Original vs compressed on training_dataset.csv: top-k accuracy, agreement, memory, latency. """
+    import time
+    import pandas as pd
+    from backend.model_inference import ConditionSoftmaxPredictor, topk_indices
+
+    df = pd.read_csv(DATA_DIR / "training_dataset.csv")
+    if limit:
+        df = df.head(limit)
+    texts, y = df["user_input"].tolist(), df["target_condition_id"].to_numpy()
+    report: Dict[str, Any] = {"utterances": len(texts)}
+    probs, top3 = {}, {}
+    for name, path in (("original", Path(model_dir)), ("compressed", Path(out_dir))):
+        p = ConditionSoftmaxPredictor(path)
+        P = p.predict_proba(texts)
+        label = np.asarray(p.label_map)
+        t3 = label[topk_indices(P, 3)]
+        lat = []
+        for text in texts[:300]:
+            t0 = time.perf_counter()
+            p.predict_proba(text)
+            lat.append((time.perf_counter() - t0) * 1e3)
+        probs[name], top3[name] = P, t3
+        report[name] = {
+            "features": int(p._coef_t.shape[0]) if p._coef_t is not None else None,
+            "weight_dtype": str(p._coef_t.dtype) if p._coef_t is not None else None,
+            "weights_mb": round(_weight_bytes(p) / 2 ** 20, 2),
+            "files_mb": round(_dir_bytes(path) / 2 ** 20, 2),
+            "top1_acc": round(float(np.mean(t3[:, 0] == y)), 4),
+            "top3_acc": round(float(np.mean((t3 == y[:, None]).any(axis=1))), 4),
+            "predict_ms_p50": round(float(np.percentile(lat, 50)), 3),
+            "predict_ms_p95": round(float(np.percentile(lat, 95)), 3),
+        }
+    a, b = top3["original"], top3["compressed"]
+    report["top1_agree"] = round(float(np.mean(a[:, 0] == b[:, 0])), 4)
+    report["top3_same_set"] = round(float(np.mean([set(x) == set(z) for x, z in zip(a, b)])), 4)
+    report["max_abs_prob_diff"] = float(np.abs(probs["original"] - probs["compressed"]).max())
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Prune + quantize the classifier into a new model dir and report parity.")
+    ap.add_argument("--model-dir", default=str(MODEL_DIR))
+    ap.add_argument("--out", required=True, help="directory for the compressed artifacts")
+    ap.add_argument("--threshold", type=float, default=0.01, help="keep a feature if some class weight >= this x the largest")
+    ap.add_argument("--dtype", choices=DTYPES, default="int8")
+    ap.add_argument("--limit", type=int, default=None, help="report on the first N utterances only")
+    args = ap.parse_args()
+
+    summary = compress(args.model_dir, args.out, args.threshold, args.dtype)
+    print(f"kept {summary['kept']:,} / {summary['features']:,} features "
+          f"(word {summary['kept_word']:,}, char {summary['kept_char']:,}), weights stored as {args.dtype}")
+    r = parity_report(args.model_dir, args.out, args.limit)
+    print(f"{'':>12} {'features':>9} {'weights':>10} {'files':>9} {'top-1':>7} {'top-3':>7} {'p50 ms':>7} {'p95 ms':>7}")
+    for name in ("original", "compressed"):
+        s = r[name]
+        print(f"{name:>12} {s['features']:>9,} {s['weights_mb']:>7.2f} MB {s['files_mb']:>6.2f} MB "
+              f"{s['top1_acc']:>7.4f} {s['top3_acc']:>7.4f} {s['predict_ms_p50']:>7.3f} {s['predict_ms_p95']:>7.3f}")
+    print(f"{r['utterances']} utterances: top-1 agrees {r['top1_agree']:.4f}, same top-3 set {r['top3_same_set']:.4f}, "
+          f"max |dp| {r['max_abs_prob_diff']:.2e}")
@@ -1,10 +1,40 @@
 import json
+import re
 import pandas as pd
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 import numpy as np
 from joblib import load, dump
-from scipy.sparse import hstack
+from scipy.sparse import csr_matrix, hstack
+from scipy.special import expit
+from sklearn.feature_extraction.text import CountVectorizer
+from backend.char_ngrams import FastCharTfidf, _WHITE_SPACES
+
+TOPK_SORT_CUTOFF = 512  # below this, one full sort of a single row beats argpartition's fixed overhead
+TAIL_WINDOW = 256  # chars of a transcript re-tokenized when text is appended to it
+
+def topk_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k largest scores, best first, along the last axis (1-D or batched 2-D).
+    Ties go to the lower index, the same order as np.argsort(-scores, kind="stable").
+    argpartition is O(n); only the k survivors get sorted.
+    """
+    scores = np.asarray(scores)
+    n = scores.shape[-1]
+    k = max(0, min(int(k), n))
+    if (scores.ndim == 1 and n < TOPK_SORT_CUTOFF) or k in (0, n):
+        return np.argsort(-scores, axis=-1, kind="stable")[..., :k]
+    rows = scores.reshape(-1, n)
+    # the k-th largest value per row; argpartition picks arbitrarily among items equal to it,
+    # so take everything above it plus the lowest-index ties until there are k
+    kth = np.take_along_axis(rows, np.argpartition(rows, n - k, axis=-1)[:, n - k:n - k + 1], axis=-1)
+    above = rows > kth
+    tied = rows == kth
+    need = k - above.sum(axis=-1, keepdims=True)
+    keep = above | (tied & (np.cumsum(tied, axis=-1) <= need))
+    part = np.nonzero(keep)[1].reshape(len(rows), k)  # ascending index within each row
+    order = np.argsort(-np.take_along_axis(rows, part, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1).reshape(scores.shape[:-1] + (k,))
 
 class ConditionSoftmaxPredictor:
     """
@@ -24,17 +54,201 @@ class ConditionSoftmaxPredictor:
         # char vectorizer might be absent if you trained word-only
         char_path = model_dir / "tfidf_char.joblib"
         self.v_char = load(char_path) if char_path.exists() else None
+        # same output as v_char.transform, without a Python str per n-gram; None -> use sklearn
+        self.char_fast = FastCharTfidf.from_vectorizer(self.v_char)
+        self._token_re = re.compile(self.v_word.token_pattern)
+        # OvR log-loss models score as X @ coef.T + b; keeping coef.T C-contiguous saves the copy
+        # scipy makes of it on every sparse @ dense call. None -> model.predict_proba as is.
+        m = self.model
+        scale = getattr(m, "coef_scale_", None)
+        if scale is not None:
+            # int8 weights from backend/model_compress.py: dequantize once, keep float32
+            m.coef_ = m.coef_.astype(np.float32) * np.asarray(scale, dtype=np.float32)[:, None]
+        ovr = (getattr(m, "loss", None) == "log_loss" and getattr(m, "coef_", None) is not None
+               and m.coef_.ndim == 2 and m.coef_.shape[0] > 1)
+        self._coef_t = np.ascontiguousarray(m.coef_.T) if ovr else None
+        if self._coef_t is not None:
+            m.coef_ = self._coef_t.T  # the same array, viewed back: one copy of the weights, not two
+        self._names = None  # (feature names, "word" / "char") by column, built on the first explain
 
         with (model_dir / "label_map.json").open() as f:
             self.label_map: List[int] = json.load(f)  # index -> condition_ID
         self.n_classes = len(self.label_map)
 
+    def _proba(self, X) -> np.ndarray:
+        if self._coef_t is None:
+            return self.model.predict_proba(X)
+        return self._proba_from_scores(self._scores(X) + self.model.intercept_)
+
+    def _scores(self, X, rows: int = 256) -> np.ndarray:
+        W = self._coef_t
+        if W.dtype == np.float64:
+            return X @ W
+        # float32 weights (model_compress): sparse @ float32 would upcast all of W on every call;
+        # gather just the rows X uses and score in float64, like merge_delta does
+        X = X.tocsr()
+        out = np.empty((X.shape[0], W.shape[1]))
+        for i in range(0, X.shape[0], rows):
+            S = X[i:i + rows]
+            G = csr_matrix((S.data, np.arange(S.nnz), S.indptr), shape=(S.shape[0], S.nnz))
+            out[i:i + rows] = G @ W[S.indices].astype(np.float64)
+        return out
+
+    @staticmethod
+    def _proba_from_scores(scores: np.ndarray) -> np.ndarray:
+        # what LinearClassifierMixin._predict_proba_lr does with decision_function's output
+        prob = expit(scores, out=scores)
+        prob_sum = prob.sum(axis=1)
+        all_zero = prob_sum == 0
+        if all_zero.any():
+            prob[all_zero, :] = 1
+            prob_sum[all_zero] = prob.shape[1]
+        prob /= prob_sum.reshape((prob.shape[0], -1))
+        return prob
+
     def _vectorize(self, texts: List[str]):
-        Xw = self.v_word.transform(texts)
-        if self.v_char is not None:
-            Xc = self.v_char.transform(texts)
-            return hstack([Xw, Xc], format="csr")
-        return Xw
+        return self._tfidf(self.counts(texts))
+
+    def counts(self, texts: List[str]) -> Tuple:
+        """ Raw (word, char) term counts; _tfidf() of these is exactly the vectorizers' transform(). """
+        Cw = CountVectorizer.transform(self.v_word, texts)
+        if self.v_char is None:
+            return Cw, None
+        Cc = self.char_fast.counts(texts) if self.char_fast else CountVectorizer.transform(self.v_char, texts)
+        return Cw, Cc
+
+    def _tfidf(self, counts: Tuple):
+        Cw, Cc = counts
+        Xw = self.v_word._tfidf.transform(Cw, copy=True)
+        if Cc is None:
+            return Xw
+        Xc = self.char_fast.tfidf(Cc) if self.char_fast else self.v_char._tfidf.transform(Cc, copy=True)
+        return hstack([Xw, Xc], format="csr")
+
+    def predict_proba_counts(self, counts: Tuple) -> np.ndarray:
+        return self._proba(self._tfidf(counts))
+
+    def _word_cut(self, text: str) -> Optional[int]:
+        # Start of a suffix whose first (n-1) tokens can't change whatever gets appended:
+        # tokens are maximal word runs, so only the last one (if it touches the end) can grow.
+        v = self.v_word
+        if v.analyzer != "word" or v.tokenizer or v.preprocessor or v.stop_words or v.strip_accents or v.binary:
+            return None
+        lo = max(0, len(text) - TAIL_WINDOW)
+        stable = [m.start() + lo for m in self._token_re.finditer(text[lo:])
+                  if m.end() + lo < len(text) and (m.start() > 0 or lo == 0)]
+        need = max(v.ngram_range[1] - 1, 1)
+        return stable[-need] if len(stable) >= need else None
+
+    def _char_cut(self, text: str) -> Optional[int]:
+        # Start of a suffix reaching back max_n - 1 chars (+1: a trailing whitespace char may be
+        # rewritten when the appended text starts with whitespace), cut outside a whitespace run
+        if self.char_fast is None or self.char_fast.binary:
+            return None
+        reach = self.char_fast.max_n - 1
+        c = len(text) - reach
+        while c > 0 and (text[c - 1].isspace() or len(_WHITE_SPACES.sub(" ", text[c:])) <= reach):
+            c -= 1
+        return max(c, 0)
+
+    def count_delta(self, text: str, extra: str) -> Optional[Tuple]:
+        """
+        counts(text + extra) - counts(text), from re-counting only a short tail:
+        counts(tail + extra) - counts(tail). Exact, because n-grams that start before the tail
+        are the same either way. None when the cut can't be proven safe (non-ASCII near the
+        join, no stable token, unusual vectorizer options).
+        """
+        cw = self._word_cut(text)
+        cc = self._char_cut(text) if self.v_char is not None else 0
+        if cw is None or cc is None or not extra.isascii() or not text[max(min(cw, cc) - 1, 0):].isascii():
+            return None
+        tail_w, tail_c = text[cw:], text[cc:]
+        Dw = CountVectorizer.transform(self.v_word, [tail_w + extra, tail_w])
+        Dw = Dw[0] - Dw[1]
+        Dw.eliminate_zeros()
+        if self.v_char is None:
+            return Dw, None
+        Dc = self.char_fast.counts([tail_c + extra, tail_c])
+        Dc = Dc[0] - Dc[1]
+        Dc.eliminate_zeros()
+        return Dw, Dc
+
+    def extend_counts(self, counts: Tuple, text: str, extra: str) -> Optional[Tuple]:
+        """ counts(text + extra) from counts(text); None when count_delta() is. """
+        delta = self.count_delta(text, extra)
+        return None if delta is None else self.add_delta(counts, delta)
+
+    @staticmethod
+    def add_delta(counts: Tuple, delta: Tuple) -> Tuple:
+        out = []
+        for C, D in zip(counts, delta):
+            if C is not None:
+                C = C + D
+                C.eliminate_zeros()
+            out.append(C)
+        return tuple(out)
+
+    def linear_base(self, counts: Tuple) -> Optional[List[Tuple]]:
+        """
+        Per tf-idf block (word, char): the count row, idf, the block's coef.T rows, the raw
+        scores (idf * counts) @ coef.T and the squared norm. merge_delta() scores appended text
+        from these by touching only the columns it changes. None unless the model is OvR log-loss
+        and the vectorizers are plain idf + l2.
+        """
+        if self._coef_t is None:
+            return None
+        base, off = [], 0
+        for C, v in zip(counts, (self.v_word, self.v_char)):
+            if C is None:
+                continue
+            if v.sublinear_tf or v.binary or not v.use_idf or v.norm != "l2":
+                return None
+            C = C.tocsr().sorted_indices()
+            W = self._coef_t[off:off + C.shape[1]]
+            u = C.data * v.idf_[C.indices]
+            base.append((C, v.idf_, W, u @ W[C.indices], float(u @ u)))
+            off += C.shape[1]
+        return base
+
+    def merge_delta(self, base: List[Tuple], delta: Tuple) -> np.ndarray:
+        """ predict_proba_counts(counts + delta) from linear_base(counts), equal up to float rounding. """
+        scores = np.array(self.model.intercept_, dtype=np.float64)
+        for (C, idf, W, r, sq), D in zip(base, [D for D in delta if D is not None]):
+            cols = D.indices
+            at = np.minimum(np.searchsorted(C.indices, cols), max(C.nnz - 1, 0))
+            c_old = np.where(C.indices[at] == cols, C.data[at], 0.0) if C.nnz else np.zeros(len(cols))
+            u_old, u_new = c_old * idf[cols], (c_old + D.data) * idf[cols]
+            r = r + (u_new - u_old) @ W[cols]
+            sq = sq + float(u_new @ u_new - u_old @ u_old)
+            if sq > 0:
+                scores += r / np.sqrt(sq)
+        return self._proba_from_scores(scores[None, :])
+
+    def _feature_names(self) -> Tuple[np.ndarray, np.ndarray]:
+        if self._names is None:
+            blocks = [(v.get_feature_names_out(), kind) for v, kind in ((self.v_word, "word"), (self.v_char, "char"))
+                      if v is not None]
+            self._names = (np.concatenate([names for names, _k in blocks]),
+                           np.concatenate([np.full(len(names), kind) for names, kind in blocks]))
+        return self._names
+
+    def contributions(self, X, classes: List[int], k: int = 5) -> Optional[List[List[Tuple[str, str, float]]]]:
+        """
+        Per class index in `classes`: the k largest positive X[j] * coef[class, j] terms of the
+        tf-idf row X that was scored, as (kind, feature, contribution). Exact for the linear
+        model (the terms plus the intercept are the class score); None for any other model.
+        """
+        if self._coef_t is None:
+            return None
+        X = X.tocsr()
+        cols = X.indices
+        terms = X.data[:, None] * self._coef_t[np.ix_(cols, classes)]  # (nnz, len(classes))
+        names, kinds = self._feature_names()
+        out = []
+        for j in range(len(classes)):
+            top = topk_indices(terms[:, j], min(k, len(cols))) if len(cols) else []
+            out.append([(str(kinds[cols[t]]), str(names[cols[t]]), float(terms[t, j])) for t in top if terms[t, j] > 0])
+        return out
 
     def predict_proba(self, texts: Union[str, List[str]]) -> np.ndarray:
         """
@@ -44,95 +258,71 @@ class ConditionSoftmaxPredictor:
         if isinstance(texts, str):
             texts = [texts]
         X = self._vectorize(texts)
-        proba = self.model.predict_proba(X)
+        proba = self._proba(X)
         return proba
 
-    def topk(self, text: str, k: int = 10) -> List[Tuple[int, float]]:
+    def topk(self, text: str, k: int = 10, probs: np.ndarray = None) -> List[Tuple[int, float]]:
         """
         Returns the top-k (condition_ID, probability) pairs for a single text.
+        Pass `probs` when predict_proba already ran for this text to skip the second model call.
         """
-        p = self.predict_proba(text)[0]
-        idxs = np.argsort(p)[::-1][:k]
-        return [(int(self.label_map[i]), float(p[i])) for i in idxs]
-
-# ---- convenience wrapper ----
-def load_and_predict_softmax(model_dir: Union[str, Path], user_input: str, k: int = 6):
-    """
-    Loads the model and returns:
-      - 'probs': full softmax vector as a numpy array (classes ordered by label_map)
-      - 'topk': list of (condition_ID, probability) for the top-k classes
-      - 'label_map': the ordered condition_ID list (index -> condition_ID)
-    """
-    predictor = ConditionSoftmaxPredictor(model_dir)
-    probs = predictor.predict_proba(user_input)[0]
-    return {
-        "probs": probs,                          # np.ndarray of length n_classes
-        "topk": predictor.topk(user_input, k=k), # [(condition_ID, prob), ...]
-        "label_map": predictor.label_map         # index -> condition_ID
-    }
+        p = self.predict_proba(text)[0] if probs is None else probs
+        return [(int(self.label_map[i]), float(p[i])) for i in topk_indices(p, k)]
 
 
-def power_transform(
-    arr,
-    alpha   :   float   =   5
-):
-    t_sum = 0
-    for i in range(len(arr)):
-        t_sum += arr[i] ** alpha
-    
-    out = np.zeros(len(arr), dtype=np.float32)
+from pathlib import Path
+from backend.model_bundle import current_bundle
+from backend.queries.doctor_network import doctor_network, rank_in_network_first
+from backend.stopping import StoppingPolicy, stopping_policy
 
-    for i in range(len(out)):
-        out[i] = arr[i] ** alpha / t_sum
+# ---------------- Conversation state ----------------
+# One conversation's progress lives in small joblib files under its state dir. The steps below
+# are what inference() runs per turn; backend/speculative.py reuses them to precompute a turn.
 
-    return out
-    
-from pathlib import Path
+FINAL_QUESTION = "Thank you for answering all our questions."
 
-class_imbalance = np.asarray([0.3088, 0.2683, 0.1244, 0.0874, 0.107, 0.104])
+def default_state_dir() -> Path:
+    return Path(__file__).resolve().parent / "model"
 
-def inference(
-    user_text = "", 
-    first_call=False,
-    last_ans=-1
-):
-    backend_dir = Path(__file__).resolve().parent
-    data_dir = backend_dir / "data"
-    
-    print("user_text:", user_text)
-    print("first_call:",first_call)
-    print("last_ans:",last_ans)
-    model_dir = backend_dir / "model"
+def reset_state(state_dir: Path, ins_id: Optional[int] = None) -> None:
+    dump("",state_dir / 'work.str')
+    dump([],state_dir / 'null.idx')
+    dump([],state_dir / 'sclr.idx')
+    dump([],state_dir / 'dont.ask')
+    dump(-1,state_dir / 'last.qid')
+    dump(-2,state_dir / 'iter.cnt')
+    dump(ins_id,state_dir / 'ins.id')  # caller's insurance plan, resolved once at triage start
 
-    if(first_call):
-        dump("",model_dir / 'work.str')
-        dump([],model_dir / 'null.idx')
-        dump([],model_dir / 'sclr.idx')
-        dump([],model_dir / 'dont.ask')
-        dump(-1,model_dir / 'last.qid')
-        dump(-2,model_dir / 'iter.cnt')
-
-    work_str = load(model_dir / 'work.str')
-    work_str += user_text
-    
-    null_idx = load(model_dir / 'null.idx')
-    sclr_idx = load(model_dir / 'sclr.idx')
-    dont_ask = load(model_dir / 'dont.ask')
-    last_qid = load(model_dir / 'last.qid')
-    iter_cnt = load(model_dir / 'iter.cnt') + 1
+def load_state(state_dir: Path) -> Dict[str, Any]:
+    return {
+        "work_str": load(state_dir / 'work.str'),
+        "null_idx": load(state_dir / 'null.idx'),
+        "sclr_idx": load(state_dir / 'sclr.idx'),
+        "dont_ask": load(state_dir / 'dont.ask'),
+        "last_qid": load(state_dir / 'last.qid'),
+        "iter_cnt": load(state_dir / 'iter.cnt'),
+        "ins_id": load(state_dir / 'ins.id') if (state_dir / 'ins.id').exists() else None,
+    }
 
-    out = load_and_predict_softmax(model_dir, work_str, k=6)
-    
+def save_state(state_dir: Path, state: Dict[str, Any], next_qid: Optional[int]) -> None:
+    dump(state["null_idx"],state_dir / 'null.idx')
+    dump(state["sclr_idx"],state_dir / 'sclr.idx')
+    dump(state["dont_ask"],state_dir / 'dont.ask')
+    dump(state["work_str"],state_dir / 'work.str')
+    dump(state["iter_cnt"], state_dir/ 'iter.cnt')
+    if next_qid is not None:
+        dump(next_qid, state_dir / 'last.qid')
+
+def apply_answer(state: Dict[str, Any], last_ans: int, user_text: str = "") -> Dict[str, Any]:
+    """ The state after answering state['last_qid'] with last_ans (1 yes, 0 no, else skip); doesn't mutate state. """
     #for saving progress, need to collect
     #null.idx variable from long term storage
     #sclr.idx variable from long term storage
     #these variables is reinitialized upon first_call and appends once per NO/FALSE on question
-
-    #print(f"loaded last_qid: {last_qid}")
-
-    sspec_full = pd.read_csv(data_dir / 'symptoms_full.csv').values[:, 1:3]
-    sspec_map = sspec_full[:, 0].astype(np.int64)
-    cond_map = sspec_full[:, 1]
+    null_idx = list(state["null_idx"])
+    sclr_idx = list(state["sclr_idx"])
+    dont_ask = list(state["dont_ask"])
+    last_qid = state["last_qid"]
 
     if(last_qid>-1):
         if(last_ans==1):
@@ -149,33 +339,51 @@ def inference(
             #pass question case!! should be absolutely no change
             dont_ask.append(last_qid)
 
+    return {
+        "work_str": state["work_str"] + user_text,
+        "null_idx": null_idx,
+        "sclr_idx": sclr_idx,
+        "dont_ask": dont_ask,
+        "last_qid": last_qid,
+        "iter_cnt": state["iter_cnt"] + 1,
+        "ins_id": state.get("ins_id"),
+    }
+
+def rank_turn(bundle, out: Dict[str, Any], state: Dict[str, Any],
+              first_call: bool = False, policy: Optional[StoppingPolicy] = None) -> Tuple[Dict[str, Any], Optional[int]]:
+    """
+    Rankings + next question from the model output for state['work_str'] and the already
+    answered state. Returns (inference() response, next_qid to store or None); the response's
+    done / stop_reason say whether the stopping policy (default: stopping_policy) ended it.
+    """
+    probs_raw = np.array(out['probs'], dtype=float)
+    null_idx, sclr_idx, dont_ask = state["null_idx"], state["sclr_idx"], state["dont_ask"]
+    last_qid = state["last_qid"]
+
+    sspec_map = bundle.sspec_map
+    cond_map = bundle.cond_map
+
     if(len(sclr_idx)>0):
         #here for inference
-        sclr_vals = pd.read_csv(data_dir / 'symptoms_full.csv').values[sclr_idx, 9].astype(np.float32)
-        out['probs'][sclr_idx] *= sclr_vals
+        sclr_vals = bundle.true_scaler[sclr_idx]
+        probs_raw[sclr_idx] *= sclr_vals
 
     if(len(null_idx)>0):
         #nullify invalid ones
-        out['probs'][null_idx] = 0
+        probs_raw[null_idx] = 0
     
     if(len(null_idx)+len(sclr_idx)>0):
         #need to renormalize to sum one
-        out['probs'] = out['probs']/np.sum(out['probs'])
-
-
-    #need to dump updated values
-    dump(null_idx,model_dir / 'null.idx')
-    dump(sclr_idx,model_dir / 'sclr.idx')
-    dump(dont_ask,model_dir / 'dont.ask')
-    dump(work_str,model_dir / 'work.str')
-    dump(iter_cnt, model_dir/ 'iter.cnt')
+        probs_raw = probs_raw/np.sum(probs_raw)
 
     #need to solve for highest proba outside strongest sspec aggregation        
     #mean_by_sspec = np.bincount(sspec_map, weights=out["probs"])
     #print(np.round(mean_by_sspec, 4))
 
+    next_qid_out = None
+    stop_reason = None
     if(first_call==False):
-        probs  = np.asarray(out["probs"], dtype=float)         # shape (N,)
+        probs  = np.asarray(probs_raw, dtype=float)            # shape (N,)
         labels = np.asarray(sspec_map)                         # shape (N,)
         # Factorize labels (works for int/str/object; contiguous 0..U-1 codes)
         uniq, inv = np.unique(labels, return_inverse=True)     # inv: shape (N,), ints
@@ -199,11 +407,12 @@ def inference(
         # Check if we've asked this question before (safety check)
         if next_qid in dont_ask:
             # If all questions exhausted, just return a fallback
-            question = "Thank you for answering all our questions."
+            question = FINAL_QUESTION
+            stop_reason = "exhausted"
         else:
             #then we will call
-            dump(next_qid, model_dir / 'last.qid')
-            question = pd.read_csv(data_dir / 'symptoms_full.csv').values[next_qid, 8]
+            next_qid_out = next_qid
+            question = bundle.questions[next_qid]
     else:
         question = 'Q_INIT'
 
@@ -212,22 +421,20 @@ def inference(
 
     topk_cond = [{"condition":cond_map[i[0]],"condition_results":round(i[1], 4)} for i in out['topk']]
 
-    doc_map = pd.read_csv(data_dir / 'cond_doc_map.csv').values
+    doc_map = bundle.doc_map
 
-    doc_names = pd.read_csv(data_dir / 'doc_sspec_map.csv').values
+    doc_names = bundle.doc_names
 
-    doc_mapper = out['probs'][doc_map[:, 0]]
+    doc_mapper = probs_raw[doc_map[:, 0]]
 
 
     doc_prod = doc_map[:, 1:] * doc_mapper[:, None]
     doc_sum = np.log(np.sum(doc_prod, axis=0)+1)
+    # doctors who take the caller's plan rank first (preloaded mask, no DB query here)
+    doc_sum = rank_in_network_first(doc_sum, doctor_network.eligible(bundle, state.get("ins_id")))
 
-    e_trans_doc = doc_sum / np.sum(doc_sum)
-    p_trans_doc = power_transform(e_trans_doc, alpha=0.5)
-
-    doc_order_idx = np.argsort(-p_trans_doc)[:6]
-
-    doc_results = np.empty(6, dtype=dict)
+    # only the doctor order is returned, and any power transform preserves it
+    doc_order_idx = topk_indices(doc_sum, 3)
 
     doc_results = {
         "Best Match":doc_names[doc_order_idx[0],1],
@@ -235,18 +442,14 @@ def inference(
         "Third Match":doc_names[doc_order_idx[2],1]
     }
 
-    sspec_sum = np.zeros(6, dtype=np.float32)
-
-    for i in range(sspec_map.shape[0]):
-        sspec_sum[sspec_map[i]] += out['probs'][i]
+    sspec_sum = np.bincount(sspec_map, weights=probs_raw, minlength=6)
 
-    sspec_sum /= class_imbalance
+    # fitted prior correction + temperature (calibration.json in the bundle)
+    p_trans_sums = bundle.calibration(sspec_sum)
 
-    p_trans_sums = power_transform(sspec_sum, np.exp(iter_cnt))
+    sspecs = bundle.sspecs
 
-    sspecs = pd.read_csv(data_dir / 'sspec_key_map.csv').values
-
-    order_idx = np.argsort(-p_trans_sums)
+    order_idx = topk_indices(p_trans_sums, len(p_trans_sums))
 
 
     results = np.empty(len(p_trans_sums), dtype=dict)
@@ -259,13 +462,52 @@ def inference(
         }
 
     results = list(results[order_idx])
+
+    # the posterior may already be decisive: no further question, the rankings above are final
+    if next_qid_out is not None:
+        stop_reason = (policy or stopping_policy).reason(p_trans_sums, state["iter_cnt"])
+        if stop_reason is not None:
+            next_qid_out = None
+            question = FINAL_QUESTION
     
     ret = {
         "subspecialty_results": results,
         "doctor_results":doc_results,
         "condition_results":topk_cond,
-        "question":question
+        "question":question,
+        "done":stop_reason is not None,
+        "stop_reason":stop_reason,
+        "source":out.get("source", "model")  # "keywords": model still loading or over its in-flight limit
     }
+    if out.get("explanation") is not None:
+        ret["explanation"] = out["explanation"]
+
+    return ret, next_qid_out
+
+def inference(
+    user_text = "", 
+    first_call=False,
+    last_ans=-1,
+    state_dir=None,
+    ins_id=None,
+    explain=False
+):
+    # immutable artifacts + knowledge tables, held for this whole request even if a swap happens
+    bundle = current_bundle()
+    
+    print("user_text:", user_text)
+    print("first_call:",first_call)
+    print("last_ans:",last_ans)
+    # per-conversation state files; defaults to model_dir (the single live session)
+    state_dir = Path(state_dir) if state_dir is not None else default_state_dir()
+
+    if(first_call):
+        reset_state(state_dir, ins_id)
+
+    state = apply_answer(load_state(state_dir), last_ans, user_text)
+    out = bundle.predict(state["work_str"], k=6, explain=explain)
+    ret, next_qid = rank_turn(bundle, out, state, first_call)
+    save_state(state_dir, state, next_qid)
 
     return ret
 
@@ -334,4 +576,55 @@ def model_file(*parts: str, env_var: str = "BACKEND_MODEL_DIR") -> Path:
     Convenience: get a file path inside backend/model.
     Example: model_file('work.str') -> /abs/path/to/backend/model/work.str
     """
-    return backend_model_dir(env_var=env_var).joinpath(*parts)
\ No newline at end of file
+    return backend_model_dir(env_var=env_var).joinpath(*parts)
+
+if __name__ == "__main__":
+    # python -m backend.model_inference  -> top-k timing, plus model calls per request if the model is present
+    import argparse, time
+    ap = argparse.ArgumentParser(description="Benchmark topk_indices against a full stable argsort.")
+    ap.add_argument("--classes", type=int, default=140)
+    ap.add_argument("--batch", type=int, default=1000)
+    ap.add_argument("--k", type=int, default=6)
+    ap.add_argument("--reps", type=int, default=2000)
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(0)
+    def _time(fn, reps):
+        t0 = time.perf_counter()
+        for _ in range(reps):
+            fn()
+        return (time.perf_counter() - t0) / reps * 1e6
+
+    for shape, reps in (((args.classes,), args.reps), ((args.batch, args.classes), max(args.reps // 100, 5))):
+        p = rng.dirichlet(np.ones(args.classes), size=shape[:-1] or None)
+        t_sort = _time(lambda: np.argsort(-p, axis=-1, kind="stable")[..., :args.k], reps)
+        t_topk = _time(lambda: topk_indices(p, args.k), reps)
+        print(f"shape {shape}, k={args.k}: stable argsort {t_sort:.1f} us, topk_indices {t_topk:.1f} us ({t_sort / t_topk:.1f}x)")
+
+    model_dir = Path(__file__).resolve().parent / "model"
+    if (model_dir / "sgd_softmax_best.joblib").exists():
+        # the request path is ModelBundle.predict: count the vectorize and scoring passes it makes
+        # (patched on the imported module: under -m this file is __main__, a separate copy)
+        from backend.model_bundle import ModelBundle
+        from backend.model_inference import ConditionSoftmaxPredictor as Predictor
+        bundle = ModelBundle.from_loose_files()
+        calls = {"_vectorize": 0, "_proba": 0}
+        real = {name: getattr(Predictor, name) for name in calls}
+        def _counting(name):
+            def _call(self, *a, **kw):
+                calls[name] += 1
+                return real[name](self, *a, **kw)
+            return _call
+        for name in calls:
+            setattr(Predictor, name, _counting(name))
+        try:
+            bundle.predict("heavy bleeding and pelvic pain", k=6)
+        finally:
+            for name, fn in real.items():
+                setattr(Predictor, name, fn)
+        t_call = _time(lambda: bundle.predict("heavy bleeding and pelvic pain", k=6), 200) / 1e3
+        print(f"ModelBundle.predict: {calls['_vectorize']} vectorize + {calls['_proba']} scoring call(s) per request "
+              f"({t_call:.2f} ms each)")
+        assert calls == {"_vectorize": 1, "_proba": 1}, calls
+    else:
+        print("sgd_softmax_best.joblib not found; skipped the model-call count")
@@ -0,0 +1,312 @@
+# backend/queries/archive.py
+''' Moves closed triages out of the live tables into per-month partitions of the archive database '''
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from backend.db import ARCHIVED_TABLES, archive_months, get_connection, rebuild_archive_views, table_columns
+from backend.queries.dashboard_query import q_dashboard_stats
+from backend.queries.triage_events import triage_bus
+
+ARCHIVE_AFTER_DAYS = 90.0
+MIN_AGE_DAYS = 7.0  # the dashboard's today / this-week counts only look at live rows
+BATCH_SIZE = 200
+PAUSE_S = 0.05  # gap between batches so writers queued on the lock get in
+_MONTH = re.compile(r"\d{4}_\d{2}")
+
+def archive_after_days_from_env() -> Optional[float]:
+    """ LUNARA_ARCHIVE_AFTER_DAYS=<days>; unset -> no background archival. """
+    spec = os.getenv("LUNARA_ARCHIVE_AFTER_DAYS", "").strip()
+    return float(spec) if spec else None
+
+def _in_list(ids: List[int]) -> str:
+    return ", ".join("?" for _ in ids)
+
+def _ensure_partition(conn, month: str) -> bool:
+    """ Create the month's tables, or add columns the live tables gained since. True -> views need a rebuild. """
+    if not _MONTH.fullmatch(month or ""):
+        raise ValueError(f"Bad archive month {month!r}")
+    changed = False
+    for table in ARCHIVED_TABLES:
+        part = f"{table}_{month}"
+        have = table_columns(conn, "archive", part)
+        if not have:
+            conn.execute(f"CREATE TABLE archive.{part} AS SELECT * FROM main.{table} WHERE 0;")
+            key = "triage_id" if table == "triage" else "triage_question_id"
+            conn.execute(f"CREATE UNIQUE INDEX archive.ux_{part} ON {part} ({key});")
+            if table == "triage_question":
+                conn.execute(f"CREATE INDEX archive.idx_{part}_triage ON {part} (triage_id);")
+            changed = True
+            continue
+        for col in table_columns(conn, "main", table):
+            if col not in have:
+                conn.execute(f"ALTER TABLE archive.{part} ADD COLUMN {col};")
+                changed = True
+    return changed
+
+def _notify_archived(triage_ids: List[int]) -> None:
+    # One event per batch; dashboards drop the ids from their live list
+    if not triage_bus.has_listeners():
+        return
+    try:
+        triage_bus.publish("triage.archived", {"ids": [str(t) for t in triage_ids], "stats": q_dashboard_stats()})
+    except Exception as e:
+        print(f"Error publishing triage.archived for {len(triage_ids)} triages: {e}")
+
+def q_archive_batch(older_than_days: float = ARCHIVE_AFTER_DAYS, limit: int = BATCH_SIZE) -> List[int]:
+    """
+    Move up to `limit` closed triages (sent to Epic, or ended with q_end_triage) created more
+    than `older_than_days` ago, with their Q/A, into the archive. One short IMMEDIATE
+    transaction across both files; returns the triage ids moved.
+    """
+    if older_than_days < MIN_AGE_DAYS:
+        raise ValueError(f"older_than_days must be at least {MIN_AGE_DAYS}")
+    conn = get_connection(with_archive=True)
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        # Range scan on idx_triage_datetime; a triage still waiting in the Epic outbox stays live
+        rows = conn.execute(
+            """
+            SELECT t.triage_id, strftime('%Y_%m', datetime(t.date_time)) AS month
+            FROM main.triage t
+            WHERE datetime(t.date_time) < datetime('now', ?)
+              AND (t.sent_to_epic = 1 OR t.agent_notes IS NOT NULL)
+              AND NOT EXISTS (
+                  SELECT 1 FROM main.epic_outbox o
+                  WHERE o.triage_id = t.triage_id AND o.status <> 'sent'
+              )
+            ORDER BY datetime(t.date_time)
+            LIMIT ?;
+            """,
+            (f"-{float(older_than_days)} days", int(limit))
+        ).fetchall()
+        by_month: Dict[str, List[int]] = {}
+        for r in rows:
+            by_month.setdefault(r["month"], []).append(r["triage_id"])
+
+        cols = {table: ", ".join(table_columns(conn, "main", table)) for table in ARCHIVED_TABLES}
+        views_stale = False
+        for month, ids in by_month.items():
+            views_stale |= _ensure_partition(conn, month)
+            for table in ARCHIVED_TABLES:
+                # OR REPLACE: re-archiving an id (e.g. restored by hand) overwrites the old copy
+                conn.execute(
+                    f"""
+                    INSERT OR REPLACE INTO archive.{table}_{month} ({cols[table]})
+                    SELECT {cols[table]} FROM main.{table} WHERE triage_id IN ({_in_list(ids)});
+                    """,
+                    tuple(ids)
+                )
+        if views_stale:
+            rebuild_archive_views(conn)
+
+        moved = [r["triage_id"] for r in rows]
+        if moved:
+            conn.execute(f"DELETE FROM main.triage_question WHERE triage_id IN ({_in_list(moved)});", tuple(moved))
+            conn.execute(f"DELETE FROM main.triage WHERE triage_id IN ({_in_list(moved)});", tuple(moved))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    if moved:
+        _notify_archived(moved)
+    return moved
+
+def q_archive_partitions() -> List[Dict[str, Any]]:
+    conn = get_connection(with_archive=True)
+    try:
+        out = []
+        for month in archive_months(conn):
+            out.append({
+                "month": month.replace("_", "-"),
+                "triages": conn.execute(f"SELECT COUNT(*) FROM archive.triage_{month};").fetchone()[0],
+                "questions": conn.execute(f"SELECT COUNT(*) FROM archive.triage_question_{month};").fetchone()[0],
+            })
+        return out
+    finally:
+        conn.close()
+
+def q_drop_archive_month(month: str) -> bool:
+    """ Retention: drop a whole month ('YYYY-MM') of archived triages. """
+    month = month.replace("-", "_")
+    if not _MONTH.fullmatch(month):
+        raise ValueError(f"Bad archive month {month!r}")
+    conn = get_connection(with_archive=True)
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        if month not in archive_months(conn):
+            conn.rollback()
+            return False
+        for table in ARCHIVED_TABLES:
+            conn.execute(f"DROP TABLE archive.{table}_{month};")
+        rebuild_archive_views(conn)
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# ---------------- Background worker ----------------
+
+class ArchiveWorker:
+    """
+    Background thread: every `interval_s`, archive eligible triages in batches of
+    `batch_size`, pausing between batches so request writers never wait behind a long run.
+    """
+
+    def __init__(self, older_than_days: float = ARCHIVE_AFTER_DAYS, batch_size: int = BATCH_SIZE,
+                 pause_s: float = PAUSE_S, interval_s: float = 3600.0):
+        if older_than_days < MIN_AGE_DAYS:
+            raise ValueError(f"older_than_days must be at least {MIN_AGE_DAYS}")
+        self.older_than_days = older_than_days
+        self.batch_size = batch_size
+        self.pause_s = pause_s
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.archived = 0
+        self.batches = 0
+        self.max_batch_ms = 0.0
+        self.last_run: Optional[float] = None
+
+    def run_once(self) -> int:
+        """ Archive one batch; returns the number of triages moved. """
+        t0 = time.perf_counter()
+        moved = q_archive_batch(self.older_than_days, self.batch_size)
+        if moved:
+            self.batches += 1
+            self.archived += len(moved)
+            self.max_batch_ms = max(self.max_batch_ms, (time.perf_counter() - t0) * 1e3)
+        return len(moved)
+
+    def drain(self) -> int:
+        """ Archive everything currently eligible; returns triages moved. """
+        total = 0
+        while not self._stop.is_set():
+            n = self.run_once()
+            total += n
+            if n < self.batch_size:
+                break
+            self._stop.wait(self.pause_s)
+        self.last_run = time.time()
+        return total
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.drain()
+            except Exception as e:
+                print(f"Archive worker error: {e}")
+            self._stop.wait(self.interval_s)
+
+    def start(self) -> "ArchiveWorker":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="triage-archiver", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "older_than_days": self.older_than_days,
+            "archived": self.archived,
+            "batches": self.batches,
+            "max_batch_ms": round(self.max_batch_ms, 2),
+            "last_run": self.last_run,
+            "partitions": q_archive_partitions(),
+        }
+
+# ---------------- Load check ----------------
+
+if __name__ == "__main__":
+    # python -m backend.queries.archive --n 50000
+    import argparse, tempfile
+    import numpy as np
+    from backend import db
+    from backend.queries import dashboard_query as dq
+    from backend.queries import general_queries as gq
+
+    ap = argparse.ArgumentParser(description="Archive a seeded history while a writer keeps logging triages.")
+    ap.add_argument("--n", type=int, default=50000, help="closed triages to seed, spread over the last two years")
+    ap.add_argument("--batch", type=int, default=BATCH_SIZE)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="lunara_archive_")
+    db.DB_PATH = os.path.join(tmp, "archive_check.db")
+    db.init_db()
+    conn = db.get_connection()
+    conn.executemany("INSERT INTO client (client_fn, client_ln, client_dob) VALUES (?, ?, ?);",
+                     [(f"fn{i}", f"ln{i}", "1990-01-02") for i in range(1000)])
+    conn.executemany(
+        "INSERT INTO triage (agent_id, client_id, date_time, gob_conf, agent_notes) "
+        "VALUES (?, ?, datetime('now', ?), ?, ?);",
+        [(101, i % 1000 + 1, f"-{(i * 730) // args.n} days", i % 100, "notes") for i in range(args.n)]
+    )
+    conn.executemany(
+        "INSERT INTO triage_question (triage_id, turn_number, triage_question, triage_answer) VALUES (?, ?, ?, ?);",
+        [(t, k, f"Q{k}", "yes") for t in range(1, args.n + 1) for k in (1, 2, 3)]
+    )
+    conn.commit()
+    conn.close()
+
+    def _timed(fn, repeat=20):
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - t0)
+        return best * 1e3
+
+    hot = lambda: (dq.q_search_triages("ln7", 1, 20), dq.q_dashboard_stats())
+    before_ms = _timed(hot)
+    total_before = dq.q_total_triages()
+
+    # Writer: one triage + one Q/A row at a time, like the call-center flow
+    lat, stop = [], threading.Event()
+    def _writer():
+        client_id = gq.q_get_or_create_client("Jane", "Doe", "1990-01-02")
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            tid = gq.q_start_triage(101, client_id)
+            gq.q_insert_triage_question(tid, "Q_INIT", "pelvic pain")
+            lat.append(time.perf_counter() - t0)
+            time.sleep(0.002)
+    writer = threading.Thread(target=_writer)
+    writer.start()
+    time.sleep(0.5)
+    baseline = len(lat)
+
+    worker = ArchiveWorker(ARCHIVE_AFTER_DAYS, batch_size=args.batch)
+    t0 = time.perf_counter()
+    moved = worker.drain()
+    wall = time.perf_counter() - t0
+    stop.set()
+    writer.join()
+
+    after_ms = _timed(hot)
+    ms = np.asarray(lat) * 1e3
+    during = ms[baseline:]
+    print(f"archived {moved:,} of {args.n:,} triages in {wall:.2f}s ({moved / wall:,.0f}/s), "
+          f"{worker.batches} batches, slowest {worker.max_batch_ms:.1f} ms")
+    print(f"writer latency before: p50 {np.percentile(ms[:baseline], 50):.2f} ms, "
+          f"p99 {np.percentile(ms[:baseline], 99):.2f} ms")
+    print(f"writer latency during: p50 {np.percentile(during, 50):.2f} ms, "
+          f"p99 {np.percentile(during, 99):.2f} ms, max {during.max():.2f} ms ({len(during)} writes)")
+    print(f"search + stats: {before_ms:.2f} ms -> {after_ms:.2f} ms")
+    written = len(lat)
+    total_all = dq.q_total_triages(include_archived=True)
+    print(f"live {dq.q_total_triages():,}, live + archived {total_all:,} "
+          f"(expected {total_before + written:,}), partitions {len(q_archive_partitions())}")
+    oldest = dq.q_triage_item(args.n, include_conversation=True, include_archived=True)
+    print(f"oldest triage via include_archived: {oldest['case_number']} from {oldest['created_date']}, "
+          f"{len(oldest['conversation_history'])} Q/A rows; live-only lookup -> {dq.q_triage_item(args.n)}")
@@ -1,5 +1,7 @@
 from typing import List, Optional, Tuple, Dict, Any
 from backend.db import get_connection
+from backend.queries.triage_events import triage_bus
+from backend.queries.write_queue import write_queue
 
 TZ = 'America/New_York'
 SPECIALTY_COLS = [
@@ -11,8 +13,18 @@ SPECIALTY_COLS = [
     ("Maternal-Fetal Medicine", "mfm_conf")
 ]
 
-def _execute_scalar(sql: str, params: tuple = ()) -> int:
-    conn = get_connection()
+# Final shape of a /api/triages item; `fields=` projections are validated against this
+TRIAGE_ITEM_FIELDS = (
+    "id", "case_number", "agent_id",
+    "patient_first_name", "patient_last_name", "patient_dob",
+    "created_date", "health_history", "conversation_history",
+    "final_recommendation", "confidence_score", "recommended_doctor",
+    "recommended_doctors", "subspecialist_confidences", "status", "agent_notes",
+    "sent_to_epic", "epic_sent_date",
+)
+
+def _execute_scalar(sql: str, params: tuple = (), with_archive: bool = False) -> int:
+    conn = get_connection(with_archive)
     try:
         cur = conn.execute(sql, params)
         row = cur.fetchone()
@@ -20,22 +32,8 @@ def _execute_scalar(sql: str, params: tuple = ()) -> int:
     finally:
         conn.close()
 
-def q_delete_triage(triage_id: int) -> bool:
-    conn = get_connection()
-    try:
-        # Cascade delete manually since foreign keys might not cascade automatically depending on PRAGMA
-        conn.execute("DELETE FROM triage_question WHERE triage_id = ?", (triage_id,))
-        cur = conn.execute("DELETE FROM triage WHERE triage_id = ?", (triage_id,))
-        conn.commit()
-        return cur.rowcount > 0
-    except Exception as e:
-        print(f"Error deleting triage {triage_id}: {e}")
-        return False
-    finally:
-        conn.close()
-
-def _execute_query(sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
-    conn = get_connection()
+def _execute_query(sql: str, params: tuple = (), with_archive: bool = False) -> List[Dict[str, Any]]:
+    conn = get_connection(with_archive)
     try:
         cur = conn.execute(sql, params)
         rows = cur.fetchall()
@@ -45,46 +43,151 @@ def _execute_query(sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
         conn.close()
 
 def q_delete_triage(triage_id: int) -> bool:
-    conn = get_connection()
-    try:
+    def _delete(conn) -> bool:
         # Cascade delete manually since foreign keys might not cascade automatically depending on PRAGMA
         conn.execute("DELETE FROM triage_question WHERE triage_id = ?", (triage_id,))
-        cur = conn.execute("DELETE FROM triage WHERE triage_id = ?", (triage_id,))
-        conn.commit()
-        return cur.rowcount > 0
+        return conn.execute("DELETE FROM triage WHERE triage_id = ?", (triage_id,)).rowcount > 0
+    try:
+        deleted = write_queue.run(_delete)
     except Exception as e:
         print(f"Error deleting triage {triage_id}: {e}")
         return False
-    finally:
-        conn.close()
+    if deleted:
+        notify_triage_changed("deleted", triage_id)
+    return deleted
 
-def q_total_triages() -> int:
-    return _execute_scalar("SELECT COUNT(*) FROM triage;")
+def q_total_triages(include_archived: bool = False) -> int:
+    total = _execute_scalar("SELECT COUNT(*) FROM triage;")
+    if include_archived:
+        total += _execute_scalar("SELECT COUNT(*) FROM archive.triage_archived;", with_archive=True)
+    return total
 
 def q_cases_today(tz: str = TZ) -> int:
     # SQLite 'date("now", "localtime")' is approximate for "server local time".
     # For a hackathon project, using 'now', 'localtime' is usually sufficient.
     # Otherwise we'd need to pass python datetime objects.
-    # Let's simple check matching dates in strings.
+    # Range on datetime(date_time) (UTC) between local midnights so idx_triage_datetime is used.
     sql = """
     SELECT COUNT(*) 
     FROM triage 
-    WHERE date(date_time, 'localtime') = date('now', 'localtime');
+    WHERE datetime(date_time) >= datetime('now', 'localtime', 'start of day', 'utc')
+      AND datetime(date_time) <  datetime('now', 'localtime', 'start of day', '+1 day', 'utc');
     """
     return _execute_scalar(sql)
 
 def q_cases_this_week(tz: str = TZ) -> int:
     # 'weekday 0' is Sunday in some systems, Monday in others. SQLite modifier 'weekday 0' advances to next Sunday.
     # We want current week. 
-    # date('now', 'localtime', 'weekday 0', '-7 days') gives start of week (Sunday-based).
+    # date('now', 'localtime', 'weekday 0', '-7 days') gives start of week (Sunday-based);
+    # compared as its UTC instant so idx_triage_datetime is used.
     sql = """
     SELECT COUNT(*)
     FROM triage
-    WHERE date(date_time, 'localtime') >= date('now', 'localtime', 'weekday 0', '-7 days');
+    WHERE datetime(date_time) >= datetime('now', 'localtime', 'weekday 0', '-7 days', 'start of day', 'utc');
     """
     return _execute_scalar(sql)
 
-def q_search_triages(term: Optional[str], page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+# Columns the item SELECT reads; include_archived swaps `triage` for live + archived rows
+_TRIAGE_SOURCE_COLS = """
+    triage_id, agent_id, client_id, date_time,
+    re_conf, mfm_conf, uro_conf, gob_conf, mis_conf, go_conf,
+    doc_id1, doc_id2, doc_id3, agent_notes, sent_to_epic, epic_sent_date
+"""
+
+def _source(table: str, cols: str, include_archived: bool) -> str:
+    if not include_archived:
+        return table
+    return f"(SELECT {cols} FROM main.{table} UNION ALL SELECT {cols} FROM archive.{table}_archived)"
+
+_TRIAGE_ITEM_SELECT = """
+      SELECT
+        t.triage_id, t.agent_id, t.client_id, t.date_time,
+        t.re_conf, t.mfm_conf, t.uro_conf, t.gob_conf, t.mis_conf, t.go_conf,
+        t.doc_id1, t.doc_id2, t.doc_id3,
+        t.agent_notes,
+        COALESCE(t.sent_to_epic, 0) AS sent_to_epic,
+        t.epic_sent_date,
+        c.client_fn, c.client_ln, c.client_dob,
+        d1.doc_fn AS doc1_fn, d1.doc_ln AS doc1_ln,
+        d2.doc_fn AS doc2_fn, d2.doc_ln AS doc2_ln,
+        d3.doc_fn AS doc3_fn, d3.doc_ln AS doc3_ln
+      FROM {source} t
+      JOIN client c ON c.client_id = t.client_id
+      LEFT JOIN doctor d1 ON d1.doc_id = t.doc_id1
+      LEFT JOIN doctor d2 ON d2.doc_id = t.doc_id2
+      LEFT JOIN doctor d3 ON d3.doc_id = t.doc_id3
+"""
+
+def _doctor_label(fn: Optional[str], ln: Optional[str]) -> Optional[str]:
+    if not (fn or ln):
+        return None
+    return f"Dr. {(fn or '').strip()} {(ln or '').strip()}".strip()
+
+def _triage_item(r: Dict[str, Any]) -> Dict[str, Any]:
+    docs = [_doctor_label(r.get(f"doc{i}_fn"), r.get(f"doc{i}_ln")) for i in (1, 2, 3)]
+
+    spec_vals = []
+    for label, col in SPECIALTY_COLS:
+        v = r.get(col)
+        try:
+            v = int(v) if v is not None else 0
+        except:
+            v = 0
+        spec_vals.append({"name": label, "confidence": v})
+    best = max(spec_vals, key=lambda s: s["confidence"]) if spec_vals else {"name": None, "confidence": 0}
+
+    return {
+        "id": str(r["triage_id"]),
+        "case_number": f"TRG-{str(r['triage_id']).zfill(3)}",
+        "agent_id": r["agent_id"],
+        "patient_first_name": r.get("client_fn"),
+        "patient_last_name": r.get("client_ln"),
+        "patient_dob": str(r["client_dob"]) if r.get("client_dob") else None,
+        "created_date": str(r["date_time"]),
+        "health_history": [],
+        "conversation_history": [],
+        "final_recommendation": best["name"],
+        "confidence_score": best["confidence"],
+        "recommended_doctor": docs[0],
+        "recommended_doctors": [d for d in docs if d],
+        "subspecialist_confidences": spec_vals,
+        "status": "completed",
+        "agent_notes": r.get("agent_notes"),
+        "sent_to_epic": bool(r.get("sent_to_epic", 0)),
+        "epic_sent_date": str(r["epic_sent_date"]) if r.get("epic_sent_date") else None
+    }
+
+def _item_select(include_archived: bool = False) -> str:
+    return _TRIAGE_ITEM_SELECT.format(source=_source("triage", _TRIAGE_SOURCE_COLS, include_archived))
+
+def _attach_conversations(items: List[Dict[str, Any]], include_archived: bool = False) -> None:
+    """ Fill conversation_history for a whole page with one IN-list query (no N+1). """
+    if not items:
+        return
+    by_id = {int(it["id"]): it["conversation_history"] for it in items}
+    source = _source("triage_question", "triage_question_id, triage_id, triage_question, triage_answer", include_archived)
+    rows = _execute_query(
+        f"""
+        SELECT triage_id, triage_question, triage_answer
+        FROM {source} q
+        WHERE triage_id IN ({", ".join("?" for _ in by_id)})
+        ORDER BY triage_id, triage_question_id;
+        """,
+        tuple(by_id),
+        include_archived
+    )
+    for r in rows:
+        by_id[r["triage_id"]].append({"question": r["triage_question"], "answer": r["triage_answer"]})
+
+def q_search_triages(term: Optional[str], page: int = 1, page_size: int = 20,
+                     fields: Optional[List[str]] = None, include_conversation: bool = False,
+                     include_archived: bool = False) -> Dict[str, Any]:
+    """
+    Returns the /api/triages envelope with items already in their final JSON shape.
+    `fields` (subset of TRIAGE_ITEM_FIELDS) trims each item to just those keys.
+    `include_conversation` loads every item's Q/A log in one extra query.
+    `include_archived` searches the archive partitions too (attaches the archive database).
+    """
     term = (term or "").strip()
     offset = (max(page, 1) - 1) * page_size
 
@@ -109,72 +212,30 @@ def q_search_triages(term: Optional[str], page: int = 1, page_size: int = 20) ->
 
     # Main query
     sql = f"""
-      SELECT
-        t.triage_id, t.agent_id, t.client_id, t.date_time,
-        t.re_conf, t.mfm_conf, t.uro_conf, t.gob_conf, t.mis_conf, t.go_conf,
-        t.doc_id1, t.doc_id2, t.doc_id3,
-        t.agent_notes,
-        COALESCE(t.sent_to_epic, 0) AS sent_to_epic,
-        t.epic_sent_date,
-        c.client_fn, c.client_ln, c.client_dob,
-        d1.doc_fn AS doc1_fn, d1.doc_ln AS doc1_ln
-      FROM triage t
-      JOIN client c ON c.client_id = t.client_id
-      LEFT JOIN doctor d1 ON d1.doc_id = t.doc_id1
+      {_item_select(include_archived)}
       {where_sql}
       ORDER BY t.triage_id DESC
       LIMIT ? OFFSET ?
     """
     query_params = tuple(params + [page_size, offset])
     
-    rows = _execute_query(sql, query_params)
+    rows = _execute_query(sql, query_params, include_archived)
 
-    items = []
-    for r in rows:
-        case_number = f"TRG-{str(r['triage_id']).zfill(3)}"
-        rec_doc = None
-        if r.get("doc1_fn") or r.get("doc1_ln"):
-            rec_doc = f"Dr. {r.get('doc1_fn','').strip()} {r.get('doc1_ln','').strip()}".strip()
-
-        spec_vals = []
-        for label, col in SPECIALTY_COLS:
-            v = r.get(col)
-            try:
-                v = int(v) if v is not None else 0
-            except:
-                v = 0
-            spec_vals.append({"name": label, "confidence": v})
-        best = max(spec_vals, key=lambda s: s["confidence"]) if spec_vals else {"name": None, "confidence": 0}
-
-        items.append({
-            "id": str(r["triage_id"]),
-            "case_number": case_number,
-            "agent_id": r["agent_id"],
-            "patient_first_name": r.get("client_fn"),
-            "patient_last_name": r.get("client_ln"),
-            "patient_dob": str(r["client_dob"]) if r.get("client_dob") else None,
-            "created_date": str(r["date_time"]),
-            "health_history": [],
-            "conversation_history": [],
-            "final_recommendation": best["name"],
-            "confidence_score": best["confidence"],
-            "recommended_doctor": rec_doc,
-            "subspecialist_confidences": spec_vals,
-            "status": "completed",
-            "agent_notes": r.get("agent_notes"),
-            "sent_to_epic": bool(r.get("sent_to_epic", 0)),
-            "epic_sent_date": str(r["epic_sent_date"]) if r.get("epic_sent_date") else None
-        })
+    items = [_triage_item(r) for r in rows]
+    if include_conversation and (not fields or "conversation_history" in fields):
+        _attach_conversations(items, include_archived)
+    if fields:
+        items = [{k: it[k] for k in fields} for it in items]
 
     # Count totals
     count_sql = f"""
       SELECT COUNT(*)
-      FROM triage t
+      FROM {_source("triage", _TRIAGE_SOURCE_COLS, include_archived)} t
       JOIN client c ON c.client_id = t.client_id
       {where_sql};
     """
     count_params = tuple(params)
-    total = _execute_scalar(count_sql, count_params)
+    total = _execute_scalar(count_sql, count_params, include_archived)
 
     return {
         "items": items,
@@ -184,6 +245,42 @@ def q_search_triages(term: Optional[str], page: int = 1, page_size: int = 20) ->
         "total_pages": (total + page_size - 1) // page_size
     }
 
+def q_triage_item(triage_id: int, include_conversation: bool = False,
+                  include_archived: bool = False) -> Optional[Dict[str, Any]]:
+    rows = _execute_query(f"{_item_select(include_archived)} WHERE t.triage_id = ?;", (triage_id,), include_archived)
+    if not rows:
+        return None
+    item = _triage_item(rows[0])
+    if include_conversation:
+        _attach_conversations([item], include_archived)
+    return item
+
+def q_dashboard_stats(include_archived: bool = False) -> Dict[str, int]:
+    # today / this_week only count live rows; archival keeps at least a week (MIN_AGE_DAYS)
+    return {
+        "total": q_total_triages(include_archived),
+        "today": q_cases_today(),
+        "this_week": q_cases_this_week(),
+    }
+
+def notify_triage_changed(kind: str, triage_id: int) -> None:
+    """
+    Push a triage change to /api/triages/stream listeners. Costs one item lookup (plus the
+    stats counts when the row set changed) per write, however many dashboards are connected,
+    and nothing at all when nobody is listening.
+    """
+    if not triage_bus.has_listeners():
+        return
+    try:
+        data: Dict[str, Any] = {"id": str(triage_id)}
+        if kind != "deleted":
+            data["item"] = q_triage_item(triage_id)
+        if kind in ("created", "deleted"):
+            data["stats"] = q_dashboard_stats()
+        triage_bus.publish(f"triage.{kind}", data)
+    except Exception as e:
+        print(f"Error publishing triage event {kind} {triage_id}: {e}")
+
 def q_mark_sent_to_epic(triage_id: int):
     sql = """
     UPDATE triage
@@ -191,12 +288,8 @@ def q_mark_sent_to_epic(triage_id: int):
     WHERE triage_id = ?
     RETURNING triage_id, sent_to_epic, epic_sent_date;
     """
-    # SQLite returns cursor from execute.
-    conn = get_connection()
-    try:
-        cur = conn.execute(sql, (triage_id,))
-        conn.commit()
-        row = cur.fetchone()
+    def _mark(conn):
+        # RETURNING rows must be read before the commit
+        row = conn.execute(sql, (triage_id,)).fetchone()
         return dict(row) if row else None
-    finally:
-        conn.close()
\ No newline at end of file
+    return write_queue.run(_mark)
\ No newline at end of file
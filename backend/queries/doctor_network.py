@@ -0,0 +1,149 @@
+# backend/queries/doctor_network.py
+''' Preloaded doctor x insurance-plan eligibility, applied to the model's doctor ranking as a mask '''
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from backend.db import get_connection
+
+def q_doctor_networks() -> Dict[str, set]:
+    """ {doctor name as the model spells it (minus "Dr."): {ins_id, ...}} from doctor_insurance. """
+    conn = get_connection()
+    try:
+        rows = conn.execute(
+            """
+            SELECT di.ins_id, d.doc_fn, d.doc_ln
+            FROM doctor_insurance di
+            JOIN doctor d ON d.doc_id = di.doc_id;
+            """
+        ).fetchall()
+    finally:
+        conn.close()
+    out: Dict[str, set] = {}
+    for r in rows:
+        out.setdefault(_name_key(f"{r['doc_fn'] or ''} {r['doc_ln'] or ''}"), set()).add(int(r['ins_id']))
+    return out
+
+def _name_key(name: str) -> str:
+    # q_get_or_create_doctor_by_name stores "Dr. A B C" as fn "A B", ln "C"; both sides collapse to "A B C"
+    return " ".join((name or "").replace("Dr.", "").split())
+
+class DoctorNetwork:
+    """
+    One boolean row per insurance plan over the model's doctor columns (doc_sspec_map order),
+    built from doctor_insurance once per model bundle. eligible(bundle, ins_id) is then a dict
+    lookup: no DB query on the request path. A plan with no network rows, or no plan at all,
+    gives None (rank every doctor, as before).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built: Dict[str, Tuple[Dict[int, int], np.ndarray]] = {}  # bundle_id -> (ins_id -> row, matrix)
+
+    def _build(self, doc_names) -> Tuple[Dict[int, int], np.ndarray]:
+        networks = q_doctor_networks()
+        plans = sorted({ins for ids in networks.values() for ins in ids})
+        rows = {ins: i for i, ins in enumerate(plans)}
+        matrix = np.zeros((len(plans), len(doc_names)), dtype=bool)
+        for col, name in enumerate(doc_names[:, 1]):
+            for ins in networks.get(_name_key(str(name)), ()):
+                matrix[rows[ins], col] = True
+        return rows, matrix
+
+    def eligible(self, bundle, ins_id: Optional[int]) -> Optional[np.ndarray]:
+        if ins_id is None:
+            return None
+        built = self._built.get(bundle.bundle_id)
+        if built is None:
+            with self._lock:
+                built = self._built.get(bundle.bundle_id)
+                if built is None:
+                    built = self._built[bundle.bundle_id] = self._build(bundle.doc_names)
+        rows, matrix = built
+        row = rows.get(int(ins_id))
+        return None if row is None else matrix[row]
+
+    def refresh(self) -> None:
+        """ Drop the matrices; the next eligible() rebuilds from doctor_insurance. """
+        with self._lock:
+            self._built = {}
+
+    def stats(self) -> Dict[str, int]:
+        built = dict(self._built)
+        return {
+            "bundles": len(built),
+            "plans": max((len(rows) for rows, _m in built.values()), default=0),
+            "in_network_pairs": max((int(m.sum()) for _r, m in built.values()), default=0),
+        }
+
+doctor_network = DoctorNetwork()
+
+def rank_in_network_first(doc_sum: np.ndarray, eligible: Optional[np.ndarray]) -> np.ndarray:
+    """
+    doc_sum (>= 0) shifted so every in-network doctor outranks every out-of-network one; order
+    within each side is unchanged, so a plan with < 3 in-network doctors still fills 3 slots.
+    """
+    if eligible is None or not eligible.any():
+        return doc_sum
+    return np.where(eligible, doc_sum, doc_sum - doc_sum.max() - 1.0)
+
+
+if __name__ == "__main__":
+    # python -m backend.queries.doctor_network --plans 50
+    import argparse, os, random, tempfile, time
+    import pandas as pd
+    ap = argparse.ArgumentParser(description="Check in-network doctor ranking on a seeded throwaway DB.")
+    ap.add_argument("--plans", type=int, default=50)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    from backend import db
+    from backend.model_bundle import DATA_DIR
+    from backend.model_inference import topk_indices
+    db.DB_PATH = os.path.join(tempfile.mkdtemp(prefix="lunara_network_"), "network.db")
+    db.init_db()
+
+    class _Bundle:
+        bundle_id = "check"
+        doc_names = pd.read_csv(DATA_DIR / "doc_sspec_map.csv").values
+
+    rng = random.Random(args.seed)
+    n_docs = len(_Bundle.doc_names)
+    conn = db.get_connection()
+    conn.executemany("INSERT INTO insurance (ins_pol) VALUES (?);", [(f"plan{i}",) for i in range(args.plans)])
+    for name in _Bundle.doc_names[:, 1]:
+        parts = _name_key(str(name)).split()
+        conn.execute("INSERT INTO doctor (doc_fn, doc_ln) VALUES (?, ?);", (" ".join(parts[:-1]), parts[-1]))
+    want = np.zeros((args.plans + 1, n_docs), dtype=bool)
+    for ins in range(1, args.plans + 1):
+        for col in rng.sample(range(n_docs), rng.randint(1, n_docs)):
+            conn.execute("INSERT INTO doctor_insurance (doc_id, ins_id) VALUES (?, ?);", (col + 1, ins))
+            want[ins, col] = True
+    conn.commit()
+    conn.close()
+
+    net = DoctorNetwork()
+    t0 = time.perf_counter()
+    net.eligible(_Bundle, 1)
+    build_ms = (time.perf_counter() - t0) * 1e3
+    bad = 0
+    for ins in range(1, args.plans + 1):
+        elig = net.eligible(_Bundle, ins)
+        bad += not np.array_equal(elig, want[ins])
+        doc_sum = np.log(np.asarray([rng.random() for _ in range(n_docs)]) + 1)
+        top = topk_indices(rank_in_network_first(doc_sum, elig), 3)
+        in_net = [c for c in topk_indices(doc_sum, n_docs) if want[ins, c]]
+        # in-network doctors come first, in the model's order
+        bad += list(top[:min(3, len(in_net))]) != in_net[:3]
+    bad += net.eligible(_Bundle, None) is not None or net.eligible(_Bundle, 10 ** 6) is not None
+
+    n = 100_000
+    doc_sum = np.log(np.random.default_rng(0).random(n_docs) + 1)
+    t0 = time.perf_counter()
+    for i in range(n):
+        topk_indices(rank_in_network_first(doc_sum, net.eligible(_Bundle, 1 + i % args.plans)), 3)
+    per_us = (time.perf_counter() - t0) / n * 1e6
+    print(f"{args.plans} plans x {n_docs} doctors: matrix built in {build_ms:.2f} ms, "
+          f"mask + top-3 {per_us:.1f} us per turn, {bad} mismatches")
+    raise SystemExit(1 if bad else 0)
@@ -0,0 +1,323 @@
+# backend/queries/epic_outbox.py
+''' Outbox + background dispatcher that hands finished triages to Epic as FHIR Appointments '''
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import urllib.request
+from typing import Any, Dict, List, Optional, Tuple
+
+from backend.db import get_connection
+from backend.queries.dashboard_query import notify_triage_changed
+from backend.queries.generate_fhir import build_referral_payloads
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_S = 2.0
+BACKOFF_MAX_S = 600.0
+CLAIM_LEASE_S = 120.0  # a claimed batch is invisible to other dispatchers for this long
+
+def idempotency_key(triage_id: int) -> str:
+    # Stable per triage, so a redelivery after a crash/timeout is recognisable downstream
+    return f"lunara-triage-{int(triage_id)}"
+
+# ---------------- Sinks ----------------
+# A sink takes [(idempotency_key, fhir_payload), ...] and either delivers the whole batch
+# or raises; the dispatcher retries failed batches with backoff.
+
+class FileSink:
+    """ Appends one {"idempotency_key", "resource"} line per referral; skips keys already written. """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._seen = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        self._seen.add(json.loads(line)["idempotency_key"])
+
+    def deliver(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        lines = []
+        for key, payload in batch:
+            if key in self._seen:
+                continue
+            lines.append(json.dumps({"idempotency_key": key, "resource": payload}, separators=(",", ":")) + "\n")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        self._seen.update(key for key, _ in batch)
+
+def batch_idempotency_key(keys: List[str]) -> str:
+    """ Fixed-length digest of every row key in the batch, independent of their order. """
+    return hashlib.sha256("\n".join(sorted(keys)).encode("utf-8")).hexdigest()
+
+class HttpSink:
+    """ POSTs the batch as NDJSON; the receiver is expected to dedupe on idempotency_key. """
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+
+    def deliver(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        body = "".join(
+            json.dumps({"idempotency_key": key, "resource": payload}, separators=(",", ":")) + "\n"
+            for key, payload in batch
+        ).encode("utf-8")
+        req = urllib.request.Request(
+            self.url,
+            data=body,
+            method="POST",
+            headers={
+                "Content-Type": "application/x-ndjson",
+                # Batch-level key: same set of referrals -> same key, whatever the batch size
+                "Idempotency-Key": batch_idempotency_key([key for key, _ in batch]),
+            },
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            if not 200 <= resp.status < 300:
+                raise RuntimeError(f"Epic sink returned HTTP {resp.status}")
+
+def sink_from_env() -> Optional[Any]:
+    """ LUNARA_EPIC_SINK=file:/path/out.ndjson or http(s)://host/path; unset -> no dispatcher. """
+    spec = os.getenv("LUNARA_EPIC_SINK", "").strip()
+    if not spec:
+        return None
+    if spec.startswith("file:"):
+        return FileSink(spec[len("file:"):])
+    if spec.startswith(("http://", "https://")):
+        return HttpSink(spec)
+    raise ValueError(f"Unsupported LUNARA_EPIC_SINK: {spec}")
+
+# ---------------- Outbox queries ----------------
+
+def q_enqueue_unsent() -> int:
+    """ Queue every ended (agent_notes set by q_end_triage), not-yet-sent triage. Returns rows queued. """
+    conn = get_connection()
+    try:
+        rows = conn.execute(
+            """
+            SELECT t.triage_id
+            FROM triage t
+            LEFT JOIN epic_outbox o ON o.triage_id = t.triage_id
+            WHERE t.sent_to_epic = 0 AND t.agent_notes IS NOT NULL AND o.triage_id IS NULL;
+            """
+        ).fetchall()
+        conn.executemany(
+            "INSERT OR IGNORE INTO epic_outbox (triage_id, idempotency_key) VALUES (?, ?);",
+            [(r["triage_id"], idempotency_key(r["triage_id"])) for r in rows]
+        )
+        conn.commit()
+        return len(rows)
+    finally:
+        conn.close()
+
+def q_claim_batch(limit: int = BATCH_SIZE, now: Optional[float] = None) -> List[Tuple[int, str, int]]:
+    """ Lease up to `limit` due rows; returns [(triage_id, idempotency_key, attempts), ...]. """
+    now = time.time() if now is None else now
+    conn = get_connection()
+    try:
+        rows = conn.execute(
+            """
+            UPDATE epic_outbox
+            SET next_attempt_at = ?
+            WHERE outbox_id IN (
+                SELECT outbox_id FROM epic_outbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY next_attempt_at, outbox_id
+                LIMIT ?
+            )
+            RETURNING triage_id, idempotency_key, attempts;
+            """,
+            (now + CLAIM_LEASE_S, now, int(limit))
+        ).fetchall()
+        conn.commit()
+        return [(r["triage_id"], r["idempotency_key"], r["attempts"]) for r in rows]
+    finally:
+        conn.close()
+
+def _in_list(ids: List[int]) -> str:
+    return ", ".join("?" for _ in ids)
+
+def q_mark_batch_sent(triage_ids: List[int]) -> int:
+    """ One UPDATE for the whole batch (plus the outbox rows), in one transaction. """
+    if not triage_ids:
+        return 0
+    conn = get_connection()
+    try:
+        cur = conn.execute(
+            f"""
+            UPDATE triage
+            SET sent_to_epic = 1, epic_sent_date = CURRENT_TIMESTAMP
+            WHERE triage_id IN ({_in_list(triage_ids)});
+            """,
+            tuple(triage_ids)
+        )
+        conn.execute(
+            f"""
+            UPDATE epic_outbox
+            SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+            WHERE triage_id IN ({_in_list(triage_ids)});
+            """,
+            tuple(triage_ids)
+        )
+        conn.commit()
+        updated = cur.rowcount
+    finally:
+        conn.close()
+    for tid in triage_ids:
+        notify_triage_changed("updated", tid)
+    return updated
+
+def _backoff_s(attempts: int) -> float:
+    delay = min(BACKOFF_MAX_S, BACKOFF_BASE_S * (2 ** max(attempts - 1, 0)))
+    return delay * random.uniform(0.5, 1.0)  # jitter so retries don't line up
+
+def q_mark_batch_failed(claimed: List[Tuple[int, str, int]], error: str, now: Optional[float] = None) -> None:
+    now = time.time() if now is None else now
+    conn = get_connection()
+    try:
+        conn.executemany(
+            """
+            UPDATE epic_outbox
+            SET attempts = ?, next_attempt_at = ?, last_error = ?,
+                status = CASE WHEN ? >= ? THEN 'failed' ELSE 'pending' END
+            WHERE triage_id = ?;
+            """,
+            [
+                (attempts + 1, now + _backoff_s(attempts + 1), error[:1024], attempts + 1, MAX_ATTEMPTS, tid)
+                for tid, _key, attempts in claimed
+            ]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+def q_outbox_counts() -> Dict[str, int]:
+    conn = get_connection()
+    try:
+        rows = conn.execute("SELECT status, COUNT(*) AS n FROM epic_outbox GROUP BY status;").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+    finally:
+        conn.close()
+
+# ---------------- Dispatcher ----------------
+
+class EpicDispatcher:
+    """
+    Background thread: queue unsent triages, lease a batch, render FHIR payloads in one
+    batched fetch, deliver to the sink, then mark the batch sent (or schedule a retry).
+    """
+
+    def __init__(self, sink, batch_size: int = BATCH_SIZE, idle_sleep_s: float = 2.0):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.idle_sleep_s = idle_sleep_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.sent = 0
+        self.failed_batches = 0
+        self.busy_s = 0.0
+
+    def run_once(self) -> int:
+        """ Deliver one batch; returns the number of referrals sent. """
+        claimed = q_claim_batch(self.batch_size)
+        if not claimed:
+            return 0
+        t0 = time.perf_counter()
+        try:
+            payloads = build_referral_payloads([tid for tid, _k, _a in claimed])
+            ready = [c for c in claimed if c[0] in payloads]
+            if ready:
+                self.sink.deliver([(key, payloads[tid]) for tid, key, _a in ready])
+        except Exception as e:
+            print(f"Epic delivery failed for {len(claimed)} referrals: {e}")
+            q_mark_batch_failed(claimed, str(e))
+            self.failed_batches += 1
+            return 0
+        finally:
+            self.busy_s += time.perf_counter() - t0
+        # no payload (e.g. the triage vanished mid-claim): retry on the usual backoff, never "sent"
+        missing = [c for c in claimed if c[0] not in payloads]
+        if missing:
+            q_mark_batch_failed(missing, "no referral payload")
+        q_mark_batch_sent([tid for tid, _k, _a in ready])
+        self.sent += len(ready)
+        return len(ready)
+
+    def drain(self) -> int:
+        """ Queue and send everything currently due; returns referrals sent. """
+        q_enqueue_unsent()
+        total = 0
+        while True:
+            n = self.run_once()
+            if not n:
+                return total
+            total += n
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                sent = self.drain()
+            except Exception as e:
+                print(f"Epic dispatcher error: {e}")
+                sent = 0
+            if not sent:
+                self._stop.wait(self.idle_sleep_s)
+
+    def start(self) -> "EpicDispatcher":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="epic-dispatcher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sent": self.sent,
+            "failed_batches": self.failed_batches,
+            "referrals_per_s": round(self.sent / self.busy_s, 1) if self.busy_s else 0.0,
+            "outbox": q_outbox_counts(),
+        }
+
+
+# ---------------- Throughput check ----------------
+
+if __name__ == "__main__":
+    # python -m backend.queries.epic_outbox --n 20000
+    import argparse, tempfile
+    ap = argparse.ArgumentParser(description="Measure Epic hand-off throughput into a local file sink.")
+    ap.add_argument("--n", type=int, default=20000, help="ended triages to seed")
+    ap.add_argument("--batch", type=int, default=BATCH_SIZE)
+    args = ap.parse_args()
+
+    from backend import db
+    tmp = tempfile.mkdtemp(prefix="lunara_epic_")
+    db.DB_PATH = os.path.join(tmp, "epic.db")
+    db.init_db()
+    conn = db.get_connection()
+    conn.executemany("INSERT INTO client (client_fn, client_ln, client_dob) VALUES (?, ?, ?);",
+                     [(f"fn{i}", f"ln{i}", "1990-01-02") for i in range(args.n)])
+    conn.executemany("INSERT INTO triage (agent_id, client_id, gob_conf, agent_notes) VALUES (?, ?, ?, ?);",
+                     [(101, i + 1, i % 100, "notes") for i in range(args.n)])
+    conn.commit()
+    conn.close()
+
+    out_path = os.path.join(tmp, "epic.ndjson")
+    dispatcher = EpicDispatcher(FileSink(out_path), batch_size=args.batch)
+    t0 = time.perf_counter()
+    sent = dispatcher.drain()
+    wall = time.perf_counter() - t0
+    redelivered = EpicDispatcher(FileSink(out_path)).drain()
+    with open(out_path, encoding="utf-8") as f:
+        lines = sum(1 for _ in f)
+    print(f"sent {sent:,} referrals in {wall:.2f}s -> {sent / wall:,.0f} referrals/s (batch={args.batch})")
+    print(f"second drain sent {redelivered}, sink holds {lines:,} lines, outbox {q_outbox_counts()}")
@@ -1,7 +1,12 @@
 # backend/queries/general_queries.py
 import json
+import re
+from datetime import date
 from typing import Any, Dict, List, Optional, Tuple
 from backend.db import get_connection
+from backend.queries.dashboard_query import notify_triage_changed
+from backend.queries.write_queue import write_queue
+from backend.queries.utils.convert_date_overkill import parse_date_all
 
 # ---------------- Helpers ----------------
 
@@ -23,44 +28,155 @@ def _exec_fetchall(sql: str, params: tuple = ()) -> List[Any]:
     finally:
         conn.close()
 
+# Writes go through the single writer thread, which commits concurrent ones together
 def _exec_insert(sql: str, params: tuple = ()) -> int:
-    conn = get_connection()
-    try:
-        cur = conn.execute(sql, params)
-        conn.commit()
-        return cur.lastrowid
-    finally:
-        conn.close()
+    return write_queue.execute(sql, params).lastrowid
 
 def _exec_autocommit(sql: str, params: tuple = ()) -> None:
-    conn = get_connection()
-    try:
-        conn.execute(sql, params)
-        conn.commit()
-    finally:
-        conn.close()
+    write_queue.execute(sql, params)
 
 # ---------------- Clients ----------------
 
-def q_get_or_create_client(first_name: str, last_name: str, dob_iso: str) -> int:
-    row = _exec_fetchone(
-        "SELECT client_id FROM client WHERE client_fn = ? AND client_ln = ? AND client_dob = ? LIMIT 1;",
-        (first_name, last_name, dob_iso)
+_SOUNDEX_CODES = {
+    **dict.fromkeys("bfpv", "1"), **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"), "l": "4", **dict.fromkeys("mn", "5"), "r": "6",
+}
+
+def _soundex(name: str) -> str:
+    s = "".join(ch for ch in (name or "").lower() if "a" <= ch <= "z")
+    if not s:
+        return ""
+    out = s[0].upper()
+    prev = _SOUNDEX_CODES.get(s[0], "")
+    for ch in s[1:]:
+        code = _SOUNDEX_CODES.get(ch, "")
+        if code and code != prev:
+            out += code
+            if len(out) == 4:
+                break
+        if ch not in "hw":  # h/w don't separate equal codes; vowels do
+            prev = code
+    return out.ljust(4, "0")
+
+def _trigrams(text: str) -> set:
+    s = f"  {' '.join((text or '').lower().split())} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+_ISO_DOB = re.compile(r"(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})")
+
+def _canonical_dob(dob: str) -> str:
+    raw = (dob or "").strip()
+    if not raw:
+        return raw
+    m = _ISO_DOB.fullmatch(raw)
+    if m:
+        # Year-first is always Y-M-D here (parse_date_all would also offer a day-first reading)
+        try:
+            return date(int(m.group(1)), int(m.group(2)), int(m.group(3))).isoformat()
+        except ValueError:
+            return raw
+    parsed = parse_date_all(raw)
+    # Only rewrite unambiguous inputs; a guessed day/month swap would split the identity
+    return parsed["best"] if parsed["best"] and not parsed["ambiguous"] else raw
+
+def _insert_client_phonetic(conn, client_id: int, first_name: str, last_name: str, dob: str) -> None:
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO client_phonetic (client_id, fn_code, ln_code, client_dob)
+        VALUES (?, ?, ?, ?);
+        """,
+        (client_id, _soundex(first_name), _soundex(last_name), dob)
     )
-    if row:
-        return row['client_id']
 
-    return _exec_insert(
-        "INSERT INTO client (client_fn, client_ln, client_dob) VALUES (?, ?, ?);",
-        (first_name, last_name, dob_iso)
+def q_get_or_create_client(first_name: str, last_name: str, dob_iso: str) -> int:
+    first_name = (first_name or "").strip()
+    last_name = (last_name or "").strip()
+    dob = _canonical_dob(dob_iso)
+
+    # Single upsert against ux_client_identity; no select-then-insert race
+    def _upsert(conn) -> int:
+        cur = conn.execute(
+            """
+            INSERT INTO client (client_fn, client_ln, client_dob) VALUES (?, ?, ?)
+            ON CONFLICT (lower(trim(client_fn)), lower(trim(client_ln)), client_dob) DO NOTHING;
+            """,
+            (first_name, last_name, dob)
+        )
+        if cur.rowcount:
+            _insert_client_phonetic(conn, cur.lastrowid, first_name, last_name, dob)
+            return cur.lastrowid
+        return conn.execute(
+            """
+            SELECT client_id FROM client
+            WHERE lower(trim(client_fn)) = lower(?) AND lower(trim(client_ln)) = lower(?) AND client_dob = ?;
+            """,
+            (first_name, last_name, dob)
+        ).fetchone()['client_id']
+    return write_queue.run(_upsert)
+
+def q_client_insurance(client_id: int) -> Optional[int]:
+    """ The client's ins_pol_id (None when unknown); read once per triage, at start. """
+    row = _exec_fetchone("SELECT ins_pol_id FROM client WHERE client_id = ?;", (int(client_id),))
+    return row['ins_pol_id'] if row else None
+
+def q_find_similar_clients(first_name: str, last_name: str, dob: str, limit: int = 5) -> List[Dict[str, Any]]:
+    """
+    Near-duplicate candidates for a caller: same DOB with a sound-alike first or last name,
+    or both names sound alike. Candidates come from client_phonetic indexes, then get
+    ranked by name trigram similarity (+ exact DOB match).
+    """
+    dob = _canonical_dob(dob)
+    fn_code, ln_code = _soundex(first_name), _soundex(last_name)
+    rows = _exec_fetchall(
+        """
+        SELECT c.client_id, c.client_fn, c.client_ln, c.client_dob
+        FROM client_phonetic p
+        JOIN client c ON c.client_id = p.client_id
+        WHERE (p.ln_code = ? AND p.client_dob = ?)
+           OR (p.client_dob = ? AND p.fn_code = ?)
+           OR (p.ln_code = ? AND p.fn_code = ?)
+        LIMIT 500;
+        """,
+        (ln_code, dob, dob, fn_code, ln_code, fn_code)
     )
+    target = _trigrams(f"{first_name} {last_name}")
+    scored = []
+    for r in rows:
+        grams = _trigrams(f"{r['client_fn']} {r['client_ln']}")
+        sim = len(target & grams) / len(target | grams) if (target or grams) else 0.0
+        score = 0.7 * sim + (0.3 if r['client_dob'] == dob else 0.0)
+        scored.append({
+            "client_id": r['client_id'],
+            "client_fn": r['client_fn'],
+            "client_ln": r['client_ln'],
+            "client_dob": r['client_dob'],
+            "score": round(score, 4),
+        })
+    scored.sort(key=lambda x: x["score"], reverse=True)
+    return scored[:limit]
+
+def q_backfill_client_phonetic() -> int:
+    """ Fill client_phonetic for clients created before it existed. Returns rows added. """
+    def _backfill(conn) -> int:
+        rows = conn.execute(
+            """
+            SELECT c.client_id, c.client_fn, c.client_ln, c.client_dob
+            FROM client c
+            LEFT JOIN client_phonetic p ON p.client_id = c.client_id
+            WHERE p.client_id IS NULL;
+            """
+        ).fetchall()
+        for r in rows:
+            _insert_client_phonetic(conn, r['client_id'], r['client_fn'], r['client_ln'], r['client_dob'])
+        return len(rows)
+    return write_queue.run(_backfill)
 
 # ---------------- Triage header ----------------
 
 def q_start_triage(agent_id: int, client_id: int, timestamp: Optional[str] = None) -> int:
     # If timestamp provided from frontend, use it; otherwise use server time (CURRENT_TIMESTAMP in default)
     if timestamp:
-        return _exec_insert(
+        triage_id = _exec_insert(
             """
             INSERT INTO triage (agent_id, client_id, date_time, sent_to_epic)
             VALUES (?, ?, ?, 0);
@@ -68,23 +184,51 @@ def q_start_triage(agent_id: int, client_id: int, timestamp: Optional[str] = Non
             (int(agent_id), int(client_id), timestamp)
         )
     else:
-        return _exec_insert(
+        triage_id = _exec_insert(
             """
             INSERT INTO triage (agent_id, client_id, sent_to_epic)
             VALUES (?, ?, 0);
             """,
             (int(agent_id), int(client_id))
         )
+    notify_triage_changed("created", triage_id)
+    return triage_id
 
 # ---------------- Q/A log ----------------
 
-def q_insert_triage_question(triage_id: int, question: str, answer: str) -> None:
+def q_insert_triage_question(triage_id: int, question: str, answer: str,
+                             turn_number: Optional[int] = None) -> bool:
+    """
+    Log one Q/A turn. With turn_number, a repeat of an already-logged turn is a no-op and
+    returns False; without it the row gets the next turn number for the triage.
+    """
+    def _log(conn) -> bool:
+        if turn_number is None:
+            cur = conn.execute(
+                """
+                INSERT INTO triage_question (triage_id, turn_number, triage_question, triage_answer)
+                SELECT ?, COALESCE(MAX(turn_number), 0) + 1, ?, ?
+                FROM triage_question WHERE triage_id = ?;
+                """,
+                (triage_id, question[:256], answer[:1024], triage_id)
+            )
+        else:
+            cur = conn.execute(
+                """
+                INSERT INTO triage_question (triage_id, turn_number, triage_question, triage_answer)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (triage_id, turn_number) DO NOTHING;
+                """,
+                (triage_id, int(turn_number), question[:256], answer[:1024])
+            )
+        return cur.rowcount > 0
+    return write_queue.run(_log)
+
+def q_delete_triage_question(triage_id: int, turn_number: int) -> None:
+    # Releases a claimed turn when processing it failed, so the client can retry
     _exec_autocommit(
-        """
-        INSERT INTO triage_question (triage_id, triage_question, triage_answer)
-        VALUES (?, ?, ?);
-        """,
-        (triage_id, question[:256], answer[:1024])
+        "DELETE FROM triage_question WHERE triage_id = ? AND turn_number = ?;",
+        (triage_id, int(turn_number))
     )
 
 # ---------------- Doctors ----------------
@@ -218,6 +362,7 @@ def q_update_triage_from_inference(
     if set_parts:
         params.append(triage_id)
         _exec_autocommit(f"UPDATE triage SET {', '.join(set_parts)} WHERE triage_id = ?;", tuple(params))
+        notify_triage_changed("updated", triage_id)
 
     return subs or [], conds or [], doc_list
 
@@ -228,3 +373,4 @@ def q_end_triage(triage_id: int, agent_notes: Optional[str]) -> None:
         "UPDATE triage SET agent_notes = ? WHERE triage_id = ?;",
         ((agent_notes or "")[:65535], triage_id)
     )
+    notify_triage_changed("ended", triage_id)
@@ -1,23 +1,94 @@
 # backend/queries/referral_builder.py
 from __future__ import annotations
-from typing import Dict, Any, Optional, List
+import json
+import os
+from typing import Dict, Any, Iterable, Iterator, Optional, List
 from datetime import datetime, timezone
-# from .general_queries import run_query
-from .table_creation.AWS_connect import get_rds_client, get_envs
 
-rds_client = get_rds_client()
-DB_CLUSTER_ARN, DB_SECRET_ARN, DB_NAME = get_envs()
+# ---------------- Data API backends ----------------
+# Everything below talks to the database through backend.execute_statement(sql, parameters),
+# which takes/returns the RDS Data API shapes ({"records": [[{"stringValue": ...}, ...]]}).
+# RdsDataBackend is the real Aurora path; SqliteDataBackend answers the same calls from the
+# local SQLite store so the referral path can run (and be load-tested) offline.
 
+class RdsDataBackend:
+    def __init__(self):
+        # Imported lazily so importing this module never opens an AWS connection
+        from .table_creation.AWS_connect import get_rds_client, get_envs
+        self.client = get_rds_client()
+        self.cluster_arn, self.secret_arn, self.database = get_envs()
+
+    def execute_statement(self, sql: str, parameters: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        return self.client.execute_statement(
+            resourceArn=self.cluster_arn,
+            secretArn=self.secret_arn,
+            database=self.database,
+            sql=sql,
+            parameters=parameters or [],
+        )
+
+def _field(v: Any) -> Dict[str, Any]:
+    if v is None:
+        return {"isNull": True}
+    if isinstance(v, bool):
+        return {"booleanValue": v}
+    if isinstance(v, int):
+        return {"longValue": v}
+    if isinstance(v, float):
+        return {"doubleValue": v}
+    if isinstance(v, (bytes, bytearray)):
+        return {"blobValue": bytes(v)}
+    return {"stringValue": str(v)}
+
+def _param_value(value: Dict[str, Any]) -> Any:
+    if value.get("isNull"):
+        return None
+    for k in ("stringValue", "longValue", "doubleValue", "booleanValue", "blobValue"):
+        if k in value:
+            return value[k]
+    return None
+
+class SqliteDataBackend:
+    def __init__(self, connect=None):
+        if connect is None:
+            from backend.db import get_connection as connect
+        self.connect = connect
+        self.calls = 0  # round trips, for load tests
+
+    def execute_statement(self, sql: str, parameters: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
+        # SQLite understands the same :name placeholders the Data API uses
+        params = {p["name"]: _param_value(p.get("value") or {}) for p in (parameters or [])}
+        self.calls += 1
+        conn = self.connect()
+        try:
+            cur = conn.execute(sql, params)
+            rows = cur.fetchall()
+            conn.commit()
+            return {
+                "records": [[_field(v) for v in tuple(r)] for r in rows],
+                "numberOfRecordsUpdated": cur.rowcount if cur.rowcount > 0 else 0,
+            }
+        finally:
+            conn.close()
+
+_backend = None
+
+def get_backend():
+    """ LUNARA_FHIR_DB=rds uses the Aurora Data API; anything else uses the local SQLite store. """
+    global _backend
+    if _backend is None:
+        if os.getenv("LUNARA_FHIR_DB", "sqlite").lower() == "rds":
+            _backend = RdsDataBackend()
+        else:
+            _backend = SqliteDataBackend()
+    return _backend
+
+def set_backend(backend) -> None:
+    global _backend
+    _backend = backend
 
-# blah blah
 def run_query(sql: str, params: list) -> Dict[str, Any]:
-    return rds_client.execute_statement(
-        resourceArn=DB_CLUSTER_ARN,
-        secretArn=DB_SECRET_ARN,
-        database=DB_NAME,
-        sql=sql,
-        parameters=params or [],
-    )
+    return get_backend().execute_statement(sql, params or [])
 
 # Decoding helpers for RDS Data APIs
 def _cell(field: Dict[str, Any]) -> Any:
@@ -32,9 +103,7 @@ def _cell(field: Dict[str, Any]) -> Any:
 def _row(rec: List[Dict[str, Any]]) -> List[Any]:
     return [_cell(c) for c in rec]
 
-# Fetch everything we need for one triage
-def fetch_triage_bundle(triage_id: int) -> Optional[Dict[str, Any]]:
-    sql = """
+_TRIAGE_BUNDLE_SQL = """
     SELECT
       t.triage_id, t.agent_id, t.client_id, t.date_time,
       t.re_conf, t.mfm_conf, t.uro_conf, t.gob_conf, t.mis_conf, t.go_conf,
@@ -52,13 +121,13 @@ def fetch_triage_bundle(triage_id: int) -> Optional[Dict[str, Any]]:
     LEFT JOIN doctor d1 ON d1.doc_id = t.doc_id1
     LEFT JOIN doctor d2 ON d2.doc_id = t.doc_id2
     LEFT JOIN doctor d3 ON d3.doc_id = t.doc_id3
-    WHERE t.triage_id = :tid;
-    """
-    resp = run_query(sql, [{"name":"tid","value":{"longValue": triage_id}}])
-    recs = resp.get("records") or []
-    if not recs:
-        return None
+    WHERE {where}
+"""
+
+# Ids per round trip; keeps the statement well under SQLite/Postgres parameter limits
+BATCH_SIZE = 500
 
+def _bundle_from_record(rec: List[Dict[str, Any]]) -> Dict[str, Any]:
     (
         triage_id, agent_id, client_id, date_time,
         re_conf, mfm_conf, uro_conf, gob_conf, mis_conf, go_conf,
@@ -66,7 +135,7 @@ def fetch_triage_bundle(triage_id: int) -> Optional[Dict[str, Any]]:
         agent_notes,
         client_fn, client_ln, client_dob,
         doc1_fn, doc1_ln, doc2_fn, doc2_ln, doc3_fn, doc3_ln
-    ) = _row(recs[0])
+    ) = _row(rec)
 
     return {
         "triage": {
@@ -94,6 +163,29 @@ def fetch_triage_bundle(triage_id: int) -> Optional[Dict[str, Any]]:
         ]
     }
 
+# Fetch everything we need for one triage
+def fetch_triage_bundle(triage_id: int) -> Optional[Dict[str, Any]]:
+    sql = _TRIAGE_BUNDLE_SQL.format(where="t.triage_id = :tid") + ";"
+    resp = run_query(sql, [{"name":"tid","value":{"longValue": triage_id}}])
+    recs = resp.get("records") or []
+    if not recs:
+        return None
+    return _bundle_from_record(recs[0])
+
+# Fetch many triages with one IN (...) statement per BATCH_SIZE ids
+def fetch_triage_bundles(triage_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    ids = list(dict.fromkeys(int(t) for t in triage_ids))
+    out: Dict[int, Dict[str, Any]] = {}
+    for start in range(0, len(ids), BATCH_SIZE):
+        chunk = ids[start:start + BATCH_SIZE]
+        names = [f"t{i}" for i in range(len(chunk))]
+        sql = _TRIAGE_BUNDLE_SQL.format(where=f"t.triage_id IN ({', '.join(':' + n for n in names)})") + ";"
+        params = [{"name": n, "value": {"longValue": tid}} for n, tid in zip(names, chunk)]
+        for rec in run_query(sql, params).get("records") or []:
+            bundle = _bundle_from_record(rec)
+            out[int(bundle["triage"]["triage_id"])] = bundle
+    return out
+
 # Six subspecialties
 CANON_SPECIALTIES = [
     ("mfm_conf", "Maternal Fetal Medicine"),
@@ -113,18 +205,15 @@ def infer_specialty_ranked(triage_row: Dict[str, Any]) -> Dict[str, Any]:
     top = scored[0] if scored else {"column":"gob_conf","label":"General OB/GYN","score":0}
     return {"top": top, "ranked": scored}
 
-# Build a FHIR-like Appointment JSON (POC/download)
-def build_referral_json(triage_id: int) -> Optional[Dict[str, Any]]:
-    bundle = fetch_triage_bundle(triage_id)
-    if not bundle:
-        return None
+def _now_fhir() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00","Z")
 
+def _appointment_from_bundle(bundle: Dict[str, Any], created: str) -> Dict[str, Any]:
     t = bundle["triage"]
     c = bundle["client"]
     docs = [d for d in bundle["doctors"] if d]
 
     spec = infer_specialty_ranked(t)
-    created = datetime.now(timezone.utc).isoformat(timespec="seconds").replace("+00:00","Z")
 
     participants = [{
         "actor": { "reference": f"Patient/{c['client_id']}", "display": f"{c['first']} {c['last']}" },
@@ -159,3 +248,77 @@ def build_referral_json(triage_id: int) -> Optional[Dict[str, Any]]:
         }]
     }
     return payload
+
+# Build a FHIR-like Appointment JSON (POC/download)
+def build_referral_json(triage_id: int) -> Optional[Dict[str, Any]]:
+    bundle = fetch_triage_bundle(triage_id)
+    if not bundle:
+        return None
+    return _appointment_from_bundle(bundle, _now_fhir())
+
+# Many referrals at once, keyed by triage_id (ids that don't exist are left out)
+def build_referral_payloads(triage_ids: Iterable[int]) -> Dict[int, Dict[str, Any]]:
+    created = _now_fhir()
+    return {tid: _appointment_from_bundle(b, created) for tid, b in fetch_triage_bundles(triage_ids).items()}
+
+# Many referrals at once, streamed as NDJSON (one Appointment per line, in triage_ids order;
+# ids that don't exist are skipped)
+def build_referral_bundle(triage_ids: Iterable[int]) -> Iterator[str]:
+    ids = list(triage_ids)
+    created = _now_fhir()
+    for start in range(0, len(ids), BATCH_SIZE):
+        chunk = ids[start:start + BATCH_SIZE]
+        bundles = fetch_triage_bundles(chunk)
+        for tid in chunk:
+            bundle = bundles.get(int(tid))
+            if bundle:
+                yield json.dumps(_appointment_from_bundle(bundle, created), separators=(",", ":")) + "\n"
+
+
+# ---------------- Offline load test ----------------
+
+if __name__ == "__main__":
+    # python -m backend.queries.generate_fhir --n 5000
+    import argparse, tempfile, time
+    ap = argparse.ArgumentParser(description="Compare per-id vs batched referral export on a scratch SQLite DB.")
+    ap.add_argument("--n", type=int, default=5000, help="number of triages to seed and export")
+    args = ap.parse_args()
+
+    os.environ["LUNARA_DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="lunara_fhir_"), "fhir.db")
+    from backend import db
+    db.DB_PATH = os.environ["LUNARA_DB_PATH"]
+    db.init_db()
+    conn = db.get_connection()
+    conn.executemany("INSERT INTO doctor (doc_fn, doc_ln) VALUES (?, ?);", [("Ann", f"Lee{i}") for i in range(20)])
+    conn.executemany("INSERT INTO client (client_fn, client_ln, client_dob) VALUES (?, ?, ?);",
+                     [(f"fn{i}", f"ln{i}", "1990-01-02") for i in range(args.n)])
+    conn.executemany(
+        """
+        INSERT INTO triage (agent_id, client_id, gob_conf, re_conf, doc_id1, doc_id2, doc_id3, agent_notes)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+        """,
+        [(101, i + 1, i % 100, (i * 7) % 100, 1 + i % 20, 1 + (i + 1) % 20, 1 + (i + 2) % 20, "notes")
+         for i in range(args.n)])
+    conn.commit()
+    conn.close()
+
+    backend = SqliteDataBackend()
+    set_backend(backend)
+    ids = list(range(1, args.n + 1))
+
+    t0 = time.perf_counter()
+    single = [build_referral_json(i) for i in ids]
+    t_single, calls_single = time.perf_counter() - t0, backend.calls
+
+    backend.calls = 0
+    t0 = time.perf_counter()
+    lines = list(build_referral_bundle(ids))
+    t_batch, calls_batch = time.perf_counter() - t0, backend.calls
+
+    same = all(
+        {**json.loads(line), "created": None} == {**one, "created": None}
+        for line, one in zip(lines, single)
+    ) and len(lines) == len(single)
+    print(f"per-id : {len(single):,} referrals, {calls_single:,} round trips, {t_single:.2f}s ({len(single) / t_single:,.0f}/s)")
+    print(f"batched: {len(lines):,} referrals, {calls_batch:,} round trips, {t_batch:.2f}s ({len(lines) / t_batch:,.0f}/s)")
+    print(f"identical payloads: {same}")
@@ -0,0 +1,431 @@
+# backend/queries/maintenance.py
+''' Background SQLite upkeep during quiet periods: optimize / ANALYZE, WAL checkpoints, incremental vacuum '''
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from backend import db
+from backend.db import get_connection
+
+QUIET_RPS = float(os.getenv("LUNARA_MAINTENANCE_QUIET_RPS", "0.5"))  # at or below this request rate counts as quiet
+QUIET_WINDOW_S = 60.0
+TICK_S = 5.0
+FORCE_AFTER_S = 24 * 3600.0  # a task kept waiting this long by traffic runs anyway (its steps stay bounded)
+VACUUM_PAGES = 256  # pages freed per incremental_vacuum step
+MIN_FREE_PAGES = 256  # freelist below this isn't worth a vacuum
+ANALYSIS_LIMIT = 1000  # rows ANALYZE samples per index (PRAGMA analysis_limit)
+STEP_PAUSE_S = 0.05  # gap between steps so queued writers get the lock
+BUSY_TIMEOUT_MS = 200  # a step gives up on a busy database instead of queueing behind writers
+
+# (task, minimum seconds between runs), in run order: the checkpoint goes last so it also
+# folds in the WAL frames vacuum / ANALYZE just wrote
+TASK_INTERVALS = [
+    ("vacuum", 600.0),
+    ("optimize", 3600.0),
+    ("analyze", 24 * 3600.0),
+    ("checkpoint", 300.0),
+]
+
+class Busy(Exception):
+    """ A step found the database locked or traffic picking up; the task retries on a later tick. """
+
+def _file_bytes(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def _pragma(conn, name: str):
+    return conn.execute(f"PRAGMA {name};").fetchone()[0]
+
+def q_db_health(conn=None) -> Dict[str, Any]:
+    """ Page counts, free pages and journal settings of the live database. """
+    own = conn is None
+    conn = conn or get_connection()
+    try:
+        page_size = _pragma(conn, "page_size")
+        return {
+            "path": db.DB_PATH,
+            "db_bytes": _file_bytes(db.DB_PATH),
+            "wal_bytes": _file_bytes(db.DB_PATH + "-wal"),
+            "page_size": page_size,
+            "page_count": _pragma(conn, "page_count"),
+            "freelist_pages": _pragma(conn, "freelist_count"),
+            "free_bytes": _pragma(conn, "freelist_count") * page_size,
+            "journal_mode": _pragma(conn, "journal_mode"),
+            "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(_pragma(conn, "auto_vacuum")),
+        }
+    finally:
+        if own:
+            conn.close()
+
+def q_convert_incremental_vacuum() -> int:
+    """
+    One-off for databases created before init_db turned on incremental auto-vacuum: a full
+    VACUUM that rewrites the file (exclusive lock for its whole duration, so not from the
+    scheduler). Returns bytes reclaimed.
+    """
+    conn = get_connection()
+    try:
+        before = _file_bytes(db.DB_PATH)
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+        conn.execute("VACUUM;")
+        return before - _file_bytes(db.DB_PATH)
+    finally:
+        conn.close()
+
+# ---------------- Scheduler ----------------
+
+class _TaskState:
+    def __init__(self, name: str, interval_s: float):
+        self.name = name
+        self.interval_s = interval_s
+        self.runs = 0
+        self.deferred = 0  # ticks it was due but the app was busy
+        self.due_since: Optional[float] = None
+        self.last_run: Optional[float] = None
+        self.last_ms = 0.0
+        self.total_ms = 0.0
+        self.max_step_ms = 0.0
+        self.last_reclaimed = 0
+        self.reclaimed = 0
+        self.last_result: Optional[str] = None
+        self.last_error: Optional[str] = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_s": self.interval_s,
+            "runs": self.runs,
+            "deferred": self.deferred,
+            "last_run": self.last_run,
+            "last_ms": round(self.last_ms, 2),
+            "total_ms": round(self.total_ms, 2),
+            "max_step_ms": round(self.max_step_ms, 2),
+            "last_reclaimed_bytes": self.last_reclaimed,
+            "reclaimed_bytes": self.reclaimed,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+class MaintenanceScheduler:
+    """
+    Background thread: every `tick_s`, run the tasks whose interval has passed, but only while
+    the app is quiet (at most `quiet_rps` requests/s over the last `quiet_window_s`, counted by
+    note_request). Work is split into short steps (one table per ANALYZE, `vacuum_pages` pages
+    per incremental_vacuum) with the quiet check between them, so a burst of traffic stops a
+    task after at most one step. A task deferred for `force_after_s` runs anyway.
+    """
+
+    def __init__(self, quiet_rps: float = QUIET_RPS, quiet_window_s: float = QUIET_WINDOW_S,
+                 tick_s: float = TICK_S, force_after_s: float = FORCE_AFTER_S,
+                 vacuum_pages: int = VACUUM_PAGES, analysis_limit: int = ANALYSIS_LIMIT,
+                 intervals: List = TASK_INTERVALS):
+        self.quiet_rps = quiet_rps
+        self.quiet_window_s = quiet_window_s
+        self.tick_s = tick_s
+        self.force_after_s = force_after_s
+        self.vacuum_pages = vacuum_pages
+        self.analysis_limit = analysis_limit
+        self.tasks = {name: _TaskState(name, interval) for name, interval in intervals}
+        self._run: Dict[str, Callable] = {
+            "checkpoint": self._checkpoint,
+            "vacuum": self._vacuum,
+            "optimize": self._optimize,
+            "analyze": self._analyze,
+        }
+        self.requests = 0  # bumped on the event loop thread only
+        self._samples: deque = deque()  # (monotonic time, self.requests)
+        self._lock = threading.Lock()  # request_rate runs on the scheduler and on /status threads
+        self._started = time.monotonic()
+        self._forced = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---------------- Traffic ----------------
+
+    def note_request(self) -> None:
+        self.requests += 1
+
+    def request_rate(self) -> float:
+        """ Requests/s over the last quiet_window_s. """
+        with self._lock:
+            now, n = time.monotonic(), self.requests
+            self._samples.append((now, n))
+            while len(self._samples) > 1 and self._samples[1][0] <= now - self.quiet_window_s:
+                self._samples.popleft()
+            t0, n0 = self._samples[0]
+            return (n - n0) / max(now - t0, self.tick_s)
+
+    def quiet(self) -> bool:
+        if time.monotonic() - self._started < self.quiet_window_s:
+            self.request_rate()
+            return False  # not enough history yet
+        return self.request_rate() <= self.quiet_rps
+
+    def _step_ok(self) -> None:
+        # between steps: stop on shutdown, or when traffic picks up (unless this run was forced)
+        if self._stop.is_set() or not (self._forced or self.quiet()):
+            raise Busy("traffic")
+        self._stop.wait(STEP_PAUSE_S)
+
+    # ---------------- Tasks ----------------
+    # Each returns (bytes reclaimed, short result) and times its own steps.
+
+    def _timed_step(self, state: _TaskState, fn: Callable[[], Any]) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return fn()
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e) or "busy" in str(e):
+                raise Busy(str(e))
+            raise
+        finally:
+            state.max_step_ms = max(state.max_step_ms, (time.perf_counter() - t0) * 1e3)
+
+    def _checkpoint(self, conn, state: _TaskState):
+        if _pragma(conn, "journal_mode") != "wal":
+            return 0, "skipped: not in WAL mode"
+        before = _file_bytes(db.DB_PATH + "-wal")
+        # TRUNCATE also shrinks the -wal file, but waits for readers; PASSIVE never blocks anyone
+        mode = "PASSIVE" if self._forced else "TRUNCATE"
+        busy, log, done = self._timed_step(state, lambda: conn.execute(f"PRAGMA wal_checkpoint({mode});").fetchone())
+        if busy:
+            raise Busy("checkpoint blocked by a reader")
+        return max(before - _file_bytes(db.DB_PATH + "-wal"), 0), f"{mode.lower()}: {done}/{log} frames"
+
+    def _vacuum(self, conn, state: _TaskState):
+        if _pragma(conn, "auto_vacuum") != 2:
+            return 0, "skipped: auto_vacuum is not incremental (python -m backend.queries.maintenance convert)"
+        page_size = _pragma(conn, "page_size")
+        free = start = _pragma(conn, "freelist_count")
+        if free < MIN_FREE_PAGES:
+            return 0, f"skipped: {free} free pages"
+        try:
+            while free > 0:
+                # executescript steps the pragma to completion; execute() would free one page
+                self._timed_step(state, lambda: conn.executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)});"))
+                free = _pragma(conn, "freelist_count")
+                if free > 0:
+                    self._step_ok()
+        finally:
+            state.last_reclaimed = (start - free) * page_size
+        return state.last_reclaimed, f"freed {start - free} pages"
+
+    def _optimize(self, conn, state: _TaskState):
+        conn.execute(f"PRAGMA analysis_limit = {int(self.analysis_limit)};")
+        self._timed_step(state, lambda: conn.execute("PRAGMA optimize;").fetchall())
+        return 0, "ok"
+
+    def _analyze(self, conn, state: _TaskState):
+        conn.execute(f"PRAGMA analysis_limit = {int(self.analysis_limit)};")
+        tables = [r[0] for r in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name;")]
+        for i, table in enumerate(tables):
+            if i:
+                self._step_ok()
+            self._timed_step(state, lambda: conn.execute(f'ANALYZE "{table}";'))
+        return 0, f"{len(tables)} tables"
+
+    def run_task(self, name: str, forced: bool = False) -> bool:
+        """ Run one task now; False when it was cut short (busy / traffic) and stays due. """
+        state = self.tasks[name]
+        self._forced = forced
+        conn = get_connection()
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS};")
+        t0 = time.perf_counter()
+        state.last_reclaimed = 0
+        try:
+            reclaimed, result = self._run[name](conn, state)
+            state.last_reclaimed = reclaimed
+            state.last_result = result
+            state.last_error = None
+            done = True
+        except Busy as e:
+            state.last_result = f"interrupted: {e}"
+            done = False
+        except Exception as e:
+            print(f"Maintenance task {name} error: {e}")
+            state.last_error = str(e)
+            done = True  # don't retry every tick; try again next interval
+        finally:
+            conn.close()
+            self._forced = False
+        ms = (time.perf_counter() - t0) * 1e3
+        state.runs += 1
+        state.last_ms = ms
+        state.total_ms += ms
+        state.reclaimed += state.last_reclaimed
+        state.last_run = time.time()
+        if done:
+            state.due_since = None
+        return done
+
+    def run_pending(self, force: bool = False) -> List[str]:
+        """ One tick: run due tasks while quiet (all due tasks when force). Returns the ones run. """
+        now = time.monotonic()
+        ran = []
+        for name, state in self.tasks.items():
+            last = state.last_run
+            if state.due_since is None and (last is None or time.time() - last >= state.interval_s):
+                state.due_since = now
+            if state.due_since is None or self._stop.is_set():
+                continue
+            overdue = now - state.due_since >= self.force_after_s
+            if force or overdue or self.quiet():
+                self.run_task(name, forced=force or overdue)
+                ran.append(name)
+            else:
+                state.deferred += 1
+        return ran
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_pending()
+            except Exception as e:
+                print(f"Maintenance scheduler error: {e}")
+            self._stop.wait(self.tick_s)
+
+    def start(self) -> "MaintenanceScheduler":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._started = time.monotonic()
+            self._thread = threading.Thread(target=self._loop, name="db-maintenance", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            health = q_db_health()
+        except Exception as e:
+            health = {"error": str(e)}
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "quiet": self.quiet(),
+            "requests_per_s": round(self.request_rate(), 3),
+            "quiet_rps": self.quiet_rps,
+            "database": health,
+            "tasks": {name: state.stats() for name, state in self.tasks.items()},
+        }
+
+class RequestRateMiddleware:
+    """ Pure ASGI: counts HTTP requests for the scheduler's quiet check (long-lived streams excluded). """
+
+    def __init__(self, app, scheduler: MaintenanceScheduler):
+        self.app = app
+        self.scheduler = scheduler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not scope["path"].endswith("/stream"):
+            self.scheduler.note_request()
+        await self.app(scope, receive, send)
+
+# LUNARA_MAINTENANCE=0 turns the background upkeep off
+maintenance = MaintenanceScheduler() if os.getenv("LUNARA_MAINTENANCE", "1") != "0" else None
+
+
+# ---------------- Load check ----------------
+
+if __name__ == "__main__":
+    # python -m backend.queries.maintenance check --n 20000
+    import argparse, tempfile
+    import numpy as np
+    from backend.queries import dashboard_query as dq
+    from backend.queries import general_queries as gq
+
+    ap = argparse.ArgumentParser(description="SQLite maintenance: one-off runs and a load check.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("status", help="page / freelist stats of LUNARA_DB_PATH")
+    sub.add_parser("run", help="run every task now against LUNARA_DB_PATH, ignoring traffic")
+    sub.add_parser("convert", help="switch an existing database to incremental auto-vacuum (full VACUUM)")
+    c = sub.add_parser("check", help="seed, delete, then vacuum while a writer keeps logging triages")
+    c.add_argument("--n", type=int, default=20000, help="triages to seed (half are deleted)")
+    c.add_argument("--wal", action="store_true", help="put the check database in WAL mode")
+    args = ap.parse_args()
+
+    def _print_tasks(s: MaintenanceScheduler):
+        print(f"{'task':<11} {'runs':>5} {'ms':>9} {'max step':>9} {'reclaimed':>12}  result")
+        for name, t in s.tasks.items():
+            print(f"{name:<11} {t.runs:>5} {t.total_ms:>9.1f} {t.max_step_ms:>9.1f} {t.reclaimed:>12,}  "
+                  f"{t.last_error or t.last_result}")
+
+    if args.cmd == "status":
+        for k, v in q_db_health().items():
+            print(f"{k:>15}: {v}")
+    elif args.cmd == "run":
+        s = MaintenanceScheduler()
+        s.run_pending(force=True)
+        _print_tasks(s)
+    elif args.cmd == "convert":
+        print(f"reclaimed {q_convert_incremental_vacuum():,} bytes; auto_vacuum = {q_db_health()['auto_vacuum']}")
+    else:
+        tmp = tempfile.mkdtemp(prefix="lunara_maint_")
+        db.DB_PATH = os.path.join(tmp, "maint_check.db")
+        db.init_db()
+        conn = db.get_connection()
+        if args.wal:
+            conn.execute("PRAGMA journal_mode = WAL;")
+        conn.executemany("INSERT INTO client (client_fn, client_ln, client_dob) VALUES (?, ?, ?);",
+                         [(f"fn{i}", f"ln{i}", "1990-01-02") for i in range(1000)])
+        conn.executemany("INSERT INTO triage (agent_id, client_id, agent_notes) VALUES (?, ?, ?);",
+                         [(101, i % 1000 + 1, "notes " * 20) for i in range(args.n)])
+        conn.executemany(
+            "INSERT INTO triage_question (triage_id, turn_number, triage_question, triage_answer) VALUES (?, ?, ?, ?);",
+            [(t, k, f"Q{k} " * 10, "yes, and some detail " * 5) for t in range(1, args.n + 1) for k in range(1, 6)]
+        )
+        conn.commit()
+        conn.close()
+        for tid in range(1, args.n // 2 + 1):  # the oldest half, as a retention clean-up would
+            dq.q_delete_triage(tid)
+        h = q_db_health()
+        print(f"after deleting {args.n // 2:,} of {args.n:,} triages: {h['db_bytes']:,} bytes, "
+              f"{h['freelist_pages']:,} free pages ({h['free_bytes']:,} bytes), auto_vacuum {h['auto_vacuum']}, "
+              f"journal {h['journal_mode']}")
+
+        s = MaintenanceScheduler(quiet_window_s=1.0, tick_s=0.1)
+        s.request_rate()
+        # traffic: the scheduler must hold off
+        for _ in range(50):
+            s.note_request()
+        s._started -= s.quiet_window_s
+        print(f"busy ({s.request_rate():.0f} req/s): ran {s.run_pending() or 'nothing'}, "
+              f"deferred {sum(t.deferred for t in s.tasks.values())} due tasks")
+        time.sleep(1.2)
+
+        # quiet: tasks run while a writer logs one triage + Q/A at a time
+        lat, stop = [], threading.Event()
+        def _writer():
+            client_id = gq.q_get_or_create_client("Jane", "Doe", "1990-01-02")
+            while not stop.is_set():
+                t0 = time.perf_counter()
+                tid = gq.q_start_triage(101, client_id)
+                gq.q_insert_triage_question(tid, "Q_INIT", "pelvic pain")
+                lat.append(time.perf_counter() - t0)
+                time.sleep(0.002)
+        writer = threading.Thread(target=_writer)
+        writer.start()
+        time.sleep(0.5)
+        baseline = len(lat)
+        t0 = time.perf_counter()
+        ran = s.run_pending()
+        wall = time.perf_counter() - t0
+        stop.set()
+        writer.join()
+
+        h2 = q_db_health()
+        ms = np.asarray(lat) * 1e3
+        print(f"quiet: ran {', '.join(ran)} in {wall:.2f}s")
+        _print_tasks(s)
+        print(f"file {h['db_bytes']:,} -> {h2['db_bytes']:,} bytes, free pages {h['freelist_pages']:,} -> {h2['freelist_pages']:,}")
+        print(f"writer latency before: p50 {np.percentile(ms[:baseline], 50):.2f} ms, p99 {np.percentile(ms[:baseline], 99):.2f} ms")
+        during = ms[baseline:]
+        print(f"writer latency during: p50 {np.percentile(during, 50):.2f} ms, p99 {np.percentile(during, 99):.2f} ms, "
+              f"max {during.max():.2f} ms ({len(during)} writes)")
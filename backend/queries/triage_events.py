@@ -0,0 +1,108 @@
+# backend/queries/triage_events.py
+''' In-process pub/sub for live triage changes, consumed by the /api/triages/stream SSE endpoint '''
+import asyncio
+import json
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+HISTORY = 1024  # events kept for Last-Event-ID resume
+
+class TriageEventBus:
+    """
+    Each event is encoded to an SSE frame once and appended to a shared ring buffer;
+    listeners just read frames newer than the last id they saw. Publishing costs the
+    same with 1 or 500 listeners: one wake-up per event loop, not per listener.
+    """
+
+    def __init__(self, history: int = HISTORY):
+        self._lock = threading.Lock()
+        self._frames: Deque[Tuple[int, bytes]] = deque(maxlen=history)
+        self._seq = 0
+        self._wakeups: Dict[asyncio.AbstractEventLoop, asyncio.Event] = {}
+        self.listeners = 0
+
+    @property
+    def last_id(self) -> int:
+        return self._seq
+
+    def has_listeners(self) -> bool:
+        return self.listeners > 0
+
+    def publish(self, event: str, data: Dict[str, Any]) -> int:
+        """ Thread-safe; callable from sync endpoints running in the threadpool. """
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            body = json.dumps(data, separators=(",", ":"), default=str)
+            self._frames.append((seq, f"id: {seq}\nevent: {event}\ndata: {body}\n\n".encode("utf-8")))
+            loops = list(self._wakeups)
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._wake, loop)
+            except RuntimeError:  # loop already closed
+                with self._lock:
+                    self._wakeups.pop(loop, None)
+        return seq
+
+    def _wake(self, loop: asyncio.AbstractEventLoop) -> None:
+        with self._lock:
+            ev = self._wakeups.pop(loop, None)
+        if ev is not None:
+            ev.set()
+
+    @staticmethod
+    def _resync_frame(seq: int) -> Tuple[int, bytes]:
+        # tells the listener to refetch /api/triages; live frames continue after id seq
+        return seq, f"id: {seq}\nevent: resync\ndata: {{}}\n\n".encode("utf-8")
+
+    def _frames_after(self, last_id: int) -> List[Tuple[int, bytes]]:
+        # Caller holds the lock
+        if self._frames and last_id < self._frames[0][0] - 1:
+            # Listener fell behind the ring buffer
+            return [self._resync_frame(self._frames[0][0] - 1)] + list(self._frames)
+        return [f for f in self._frames if f[0] > last_id]
+
+    async def wait_after(self, last_id: int) -> List[Tuple[int, bytes]]:
+        """ Frames with id > last_id, waiting until at least one exists. """
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self._seq > last_id:
+                    return self._frames_after(last_id)
+                ev = self._wakeups.get(loop)
+                if ev is None:
+                    ev = self._wakeups[loop] = asyncio.Event()
+            await ev.wait()
+
+    async def stream(self, last_event_id: Optional[str] = None, keepalive_s: float = 15.0):
+        """ Async generator of SSE frames for one listener. """
+        try:
+            last_id = int(last_event_id) if last_event_id else self._seq
+        except ValueError:
+            last_id = self._seq
+        with self._lock:
+            self.listeners += 1
+            # An id from before a server restart (ids start again at 0) would wait for _seq to
+            # pass it and stay silent: resync instead and go on from the current id
+            stale = last_id > self._seq
+            if stale:
+                last_id = self._seq
+        try:
+            yield b"retry: 3000\n\n"
+            if stale:
+                yield self._resync_frame(last_id)[1]
+            while True:
+                try:
+                    frames = await asyncio.wait_for(self.wait_after(last_id), keepalive_s)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                for seq, frame in frames:
+                    yield frame
+                    last_id = seq
+        finally:
+            with self._lock:
+                self.listeners -= 1
+
+triage_bus = TriageEventBus()
@@ -0,0 +1,124 @@
+''' Load check for /api/triages/stream: N SSE listeners, a burst of triage writes, fan-out latency + DB cost '''
+# Usage (repo root): python -m backend.queries.utils.bench_triage_stream --listeners 500 --writes 200 --rate 20
+import argparse
+import asyncio
+import atexit
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+
+_TMP_DIR = tempfile.mkdtemp(prefix="lunara_stream_")
+atexit.register(shutil.rmtree, _TMP_DIR, True)
+os.environ["LUNARA_DB_PATH"] = os.path.join(_TMP_DIR, "stream.db")
+os.environ.pop("LUNARA_EPIC_SINK", None)
+
+import uvicorn
+
+import app
+from backend import db
+from backend.queries import dashboard_query as dq
+from backend.queries import general_queries as gq
+from backend.queries import write_queue as wq
+from backend.queries.triage_events import triage_bus
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _count_statements(counter):
+    # Same trick as check_query_plans: trace every statement the query modules run
+    def _connect(with_archive=False):
+        conn = db.get_connection(with_archive)
+        conn.set_trace_callback(lambda _sql: counter.__setitem__(0, counter[0] + 1))
+        return conn
+    for m in (gq, dq, wq):
+        m.get_connection = _connect
+
+
+async def _listen(port, ready, received, expected):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"GET /api/triages/stream HTTP/1.1\r\nHost: 127.0.0.1\r\nAccept: text/event-stream\r\n\r\n".encode())
+    await writer.drain()
+    await reader.readuntil(b"\r\n\r\n")
+    ready.release()
+    seen = 0
+    while seen < expected:
+        line = await reader.readline()
+        if not line:
+            break
+        if line.startswith(b"id: "):
+            received.setdefault(int(line.split(b"id: ")[1]), []).append(time.perf_counter())
+            seen += 1
+    writer.close()
+
+
+def _writes(n, rate):
+    subs = [{"subspecialty_short": "OB/GYN", "subspecialty_name": "general OB/GYN", "percent_match": 0.5}]
+    client_id = gq.q_get_or_create_client("Jane", "Doe", "1990-01-02")
+    for i in range(n):
+        kind = i % 3
+        if kind == 0:
+            triage_id = gq.q_start_triage(101, client_id)
+        elif kind == 1:
+            gq.q_update_triage_from_inference(triage_id, subs, [], [])
+        else:
+            gq.q_end_triage(triage_id, "notes")
+        if rate:
+            time.sleep(1.0 / rate)
+
+
+async def main(listeners, writes, rate):
+    db.init_db()
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app.app, host="127.0.0.1", port=port, log_level="warning",
+                                           backlog=max(2048, listeners * 2)))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    published = {}
+    _publish = triage_bus.publish
+    def _timed_publish(event, data):
+        seq = _publish(event, data)
+        published[seq] = time.perf_counter()
+        return seq
+    triage_bus.publish = _timed_publish
+
+    ready = asyncio.Semaphore(0)
+    received = {}
+    tasks = [asyncio.create_task(_listen(port, ready, received, writes)) for _ in range(listeners)]
+    for _ in range(listeners):
+        await ready.acquire()
+    while triage_bus.listeners < listeners:
+        await asyncio.sleep(0.01)
+
+    statements = [0]
+    _count_statements(statements)
+    t0 = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(None, _writes, writes, rate)
+    await asyncio.wait_for(asyncio.gather(*tasks), 120)
+    wall = time.perf_counter() - t0
+
+    lat = sorted((max(ts) - published[seq]) * 1e3 for seq, ts in received.items() if seq in published)
+    delivered = sum(len(ts) for ts in received.values())
+    print(f"{listeners} listeners, {writes} writes -> {delivered:,} events delivered in {wall:.2f}s")
+    print(f"fan-out to all listeners: p50 {lat[len(lat) // 2]:.1f} ms, p95 {lat[int(len(lat) * .95)]:.1f} ms")
+    print(f"DB statements: {statements[0]} total, {statements[0] / writes:.1f} per write "
+          f"(listeners add 0; one poll round of /api/triages + /api/dashboard/stats by every "
+          f"listener would be {listeners * 5:,})")
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--listeners", type=int, default=500)
+    ap.add_argument("--writes", type=int, default=200)
+    ap.add_argument("--rate", type=float, default=20.0, help="writes per second; 0 = as fast as possible")
+    args = ap.parse_args()
+    asyncio.run(main(args.listeners, args.writes, args.rate))
@@ -0,0 +1,197 @@
+''' Query-plan regression check: run every general/dashboard query and EXPLAIN it; fail on full scans or N+1 pages '''
+# Usage (repo root): python -m backend.queries.utils.check_query_plans [--analyze]
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+# Point the app at a throwaway database before backend.db reads LUNARA_DB_PATH
+_TMP_DIR = tempfile.mkdtemp(prefix="lunara_plans_")
+atexit.register(shutil.rmtree, _TMP_DIR, True)
+os.environ["LUNARA_DB_PATH"] = os.path.join(_TMP_DIR, "plans.db")
+
+from backend import db
+from backend.queries import archive as aq
+from backend.queries import dashboard_query as dq
+from backend.queries import doctor_network as dn
+from backend.queries import general_queries as gq
+from backend.queries import write_queue as wq
+
+# (query label, table alias) pairs where a full scan is the intended plan
+ALLOWED_SCANS = {
+    # substring LIKE '%term%' over names/agent/case number can't use a b-tree index
+    ("q_search_triages(term)", "t"),
+    # newest-first page walks the rowid b-tree backwards and stops at LIMIT
+    ("q_search_triages", "t"),
+    ("q_search_triages(include=conversation)", "t"),
+    # include_archived: newest-first is a MERGE of per-partition walks that stops at LIMIT, but the
+    # page total has to count every live + archived row
+    ("q_search_triages(include_archived)", "main.triage"),
+    ("q_search_triages(include_archived)", "triage_2020_01"),
+    ("q_search_triages(include_archived)", "t"),
+    # reads the co-routine q, whose branches are both index searches on triage_id
+    ("q_triage_item(include_archived)", "q"),
+    # eligibility matrix is built from every network row, once per model bundle
+    ("q_doctor_networks", "di"),
+    ("q_doctor_networks", "d"),  # same join driven from doctor once sqlite_stat1 exists (--analyze)
+    # partition list from the archive catalog (a handful of rows)
+    ("q_archive_batch", "archive.sqlite_master"),
+}
+
+_MODULES = (gq, dq, aq, dn, wq)  # wq: writes run on the writer thread's connection
+
+
+def _traced_connection_factory(sink):
+    def _connect(with_archive=False):
+        conn = db.get_connection(with_archive)
+        conn.set_trace_callback(sink.append)
+        return conn
+    return _connect
+
+
+# Page sizes used to check that a page costs the same number of statements however big it is
+PAGE_SIZES = (1, 10, 50)
+
+
+def _seed():
+    client_id = gq.q_get_or_create_client("Jane", "Doe", "1990-01-02")
+    docs = [{"rank": i, "name": f"Dr. Ann Lee{i}"} for i in (1, 2, 3)]
+    for _ in range(max(PAGE_SIZES)):
+        tid = gq.q_start_triage(101, client_id)
+        gq.q_insert_triage_question(tid, "Q_INIT", "pelvic pain")
+        gq.q_insert_triage_question(tid, "Q1", "yes")
+        gq.q_update_triage_from_inference(tid, [], [], docs)
+    # one closed triage old enough to archive
+    old_id = gq.q_start_triage(101, client_id, "2020-01-15T10:00:00Z")
+    gq.q_insert_triage_question(old_id, "Q_INIT", "spotting")
+    gq.q_end_triage(old_id, "notes")
+    triage_id = gq.q_start_triage(101, client_id)
+    gq.q_insert_triage_question(triage_id, "Q_INIT", "heavy bleeding")
+    return client_id, triage_id
+
+
+def _calls(client_id, triage_id):
+    subs = [{"subspecialty_short": "OB/GYN", "subspecialty_name": "general OB/GYN", "percent_match": 0.5}]
+    docs = [{"rank": 1, "name": "Dr. Ann Lee"}]
+    return [
+        ("q_get_or_create_client", lambda: gq.q_get_or_create_client("jane ", "DOE", "1990-01-02")),
+        ("q_client_insurance", lambda: gq.q_client_insurance(client_id)),
+        ("q_doctor_networks", dn.q_doctor_networks),
+        ("q_find_similar_clients", lambda: gq.q_find_similar_clients("Jayne", "Doe", "1990-01-02")),
+        ("q_start_triage", lambda: gq.q_start_triage(101, client_id)),
+        ("q_insert_triage_question", lambda: gq.q_insert_triage_question(triage_id, "q", "a")),
+        ("q_insert_triage_question(turn)", lambda: gq.q_insert_triage_question(triage_id, "q", "a", 1)),
+        ("q_delete_triage_question", lambda: gq.q_delete_triage_question(triage_id, 99)),
+        ("q_get_or_create_doctor_by_name", lambda: gq.q_get_or_create_doctor_by_name("Dr. Ann Lee")),
+        ("q_doctor_names_by_ids", lambda: gq.q_doctor_names_by_ids([1])),
+        ("q_update_triage_from_inference", lambda: gq.q_update_triage_from_inference(triage_id, subs, [], docs)),
+        ("q_end_triage", lambda: gq.q_end_triage(triage_id, "notes")),
+        ("q_total_triages", dq.q_total_triages),
+        ("q_cases_today", dq.q_cases_today),
+        ("q_cases_this_week", dq.q_cases_this_week),
+        ("q_search_triages", lambda: dq.q_search_triages(None, 1, 20)),
+        ("q_search_triages(term)", lambda: dq.q_search_triages("doe", 1, 20)),
+        ("q_search_triages(include=conversation)", lambda: dq.q_search_triages(None, 1, 20, include_conversation=True)),
+        ("q_triage_item", lambda: dq.q_triage_item(triage_id, include_conversation=True)),
+        ("q_archive_batch", lambda: aq.q_archive_batch(aq.MIN_AGE_DAYS)),
+        ("q_search_triages(include_archived)", lambda: dq.q_search_triages(None, 1, 20, include_archived=True)),
+        ("q_triage_item(include_archived)", lambda: dq.q_triage_item(triage_id - 1, True, include_archived=True)),
+        ("q_total_triages(include_archived)", lambda: dq.q_total_triages(include_archived=True)),
+        ("q_mark_sent_to_epic", lambda: dq.q_mark_sent_to_epic(triage_id)),
+        ("q_delete_triage", lambda: dq.q_delete_triage(triage_id)),
+    ]
+
+
+def _is_full_scan(detail: str) -> bool:
+    # "SCAN t" / "SCAN triage" are full table scans; "SCAN ... USING (COVERING) INDEX" walks an index
+    return detail.startswith("SCAN ") and "INDEX" not in detail
+
+
+def _traced(call):
+    """ Run call() and return every SQL statement it executed. """
+    originals = {m: m.get_connection for m in _MODULES}
+    statements = []
+    try:
+        for m in _MODULES:
+            m.get_connection = _traced_connection_factory(statements)
+        call()
+    finally:
+        for m, fn in originals.items():
+            m.get_connection = fn
+    return statements
+
+
+def collect_plans(analyze: bool = False):
+    """ Returns [(label, sql, [plan detail, ...]), ...] for every statement the queries ran. """
+    db.init_db()
+    client_id, triage_id = _seed()
+    if analyze:
+        # plans as they'll be once the maintenance scheduler has written sqlite_stat1; filler rows
+        # first, or the stats say one client / three doctors and a scan is (rightly) cheapest
+        conn = db.get_connection()
+        conn.executemany("INSERT INTO client (client_fn, client_ln, client_dob) VALUES (?, ?, ?);",
+                         [(f"fn{i}", f"ln{i}", f"19{i % 90 + 10}-01-02") for i in range(5000)])
+        conn.execute("""
+        INSERT INTO client_phonetic (client_id, fn_code, ln_code, client_dob)
+        SELECT client_id, substr(client_fn, 1, 4), substr(client_ln, 1, 4), client_dob FROM client
+        WHERE client_id NOT IN (SELECT client_id FROM client_phonetic);
+        """)
+        conn.executemany("INSERT INTO doctor (doc_fn, doc_ln) VALUES (?, ?);", [(f"Doc{i}", f"Smith{i}") for i in range(500)])
+        conn.commit()
+        conn.close()
+        from backend.queries.maintenance import MaintenanceScheduler
+        MaintenanceScheduler().run_task("analyze", forced=True)
+
+    results = []
+    for label, call in _calls(client_id, triage_id):
+        for sql in _traced(call):
+            head = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ""
+            if head not in ("SELECT", "UPDATE", "DELETE", "INSERT", "WITH"):
+                continue
+            conn = db.get_connection(with_archive=True)
+            try:
+                plan = [r["detail"] for r in conn.execute(f"EXPLAIN QUERY PLAN {sql}")]
+            finally:
+                conn.close()
+            results.append((label, sql, plan))
+    return results
+
+
+def statement_counts():
+    """ {page_size: statements} for a conversation-including /api/triages page; must be constant. """
+    return {
+        n: len(_traced(lambda: dq.q_search_triages(None, 1, n, include_conversation=True)))
+        for n in PAGE_SIZES
+    }
+
+
+def find_regressions(results):
+    bad = []
+    for label, sql, plan in results:
+        for detail in plan:
+            if not _is_full_scan(detail):
+                continue
+            table = detail.split()[1]
+            if (label, table) not in ALLOWED_SCANS:
+                bad.append((label, detail, sql))
+    return bad
+
+
+if __name__ == "__main__":
+    verbose = "-v" in sys.argv
+    results = collect_plans(analyze="--analyze" in sys.argv)
+    if verbose:
+        for label, sql, plan in results:
+            print(f"[{label}] {' '.join(sql.split())[:100]}")
+            for detail in plan:
+                print(f"    {detail}")
+    bad = find_regressions(results)
+    for label, detail, sql in bad:
+        print(f"FULL SCAN in {label}: {detail}\n    {' '.join(sql.split())}")
+    print(f"{len(results)} statements checked, {len(bad)} full-scan regression(s)")
+    counts = statement_counts()
+    n_plus_one = len(set(counts.values())) != 1
+    print(f"statements per include=conversation page by page size: {counts}"
+          + (" <- grows with page size (N+1)" if n_plus_one else ""))
+    sys.exit(1 if bad or n_plus_one else 0)
@@ -1,8 +1,10 @@
 ''' Very large helper function to parse every possible date format, ultimate validation '''
 from __future__ import annotations
-from dataclasses import dataclass, asdict
-from typing import List, Dict, Any, Optional, Tuple
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Iterable, List, Dict, Any, Optional, Tuple
 from datetime import datetime, date, timezone
+import calendar
 import re
 
 try:
@@ -74,77 +76,167 @@ _EXPLICIT_FORMATS = [
     "%m/%d/%y", "%d/%m/%y", "%y-%m-%d", "%y/%m/%d",
 ]
 
-def parse_date_all(
-    s: str,
-    *,
-    context: str = "dob",               # 'dob' or 'generic'
-    prefer: str = "US",                 # tie-breaker if ambiguous: 'US' -> month/day, 'EU' -> day/month
-    two_digit_year_pivot: int = 69      # for explicit %y formats; 69 -> 1969/2069 behavior like strptime
-) -> Dict[str, Any]:
+# Literal separators / letters each explicit format needs. strptime can only match when the
+# input carries them, so checking first saves raising and catching a ValueError per format.
+def _format_requirements(fmt: str) -> Tuple[str, frozenset, bool]:
+    literals = frozenset(c for c in re.sub(r"%.", "", fmt) if not c.isspace())
+    needs_alpha = "%b" in fmt or "%B" in fmt
+    return fmt, literals, needs_alpha
+
+_EXPLICIT_PLAN = [_format_requirements(fmt) for fmt in _EXPLICIT_FORMATS]
+
+# Fast-path shapes: 4-digit year first (ISO-like) or last (US/EU-like), 2-digit year last,
+# or a month name; numeric shapes use one repeated separator.
+_ISO_SHAPE = re.compile(r"([1-9][0-9]{3})([-/.])([0-9]{1,2})\2([0-9]{1,2})", re.ASCII)
+_US_SHAPE = re.compile(r"([0-9]{1,2})([-/.])([0-9]{1,2})\2([1-9][0-9]{3})", re.ASCII)
+_US_SHORT_SHAPE = re.compile(r"([0-9]{1,2})([-/.])([0-9]{1,2})\2([0-9]{2})", re.ASCII)
+_MONTH_FIRST_SHAPE = re.compile(r"([A-Za-z]{3,9}) ([0-9]{1,2}) ([1-9][0-9]{3})", re.ASCII)
+_DAY_FIRST_SHAPE = re.compile(r"([0-9]{1,2}) ([A-Za-z]{3,9}) ([1-9][0-9]{3})", re.ASCII)
+_DATEUTIL_COMBOS = [(False, False), (False, True), (True, False), (True, True)]
+_DATEUTIL_INFO = parser.parserinfo()
+
+def _month_names() -> Dict[str, Tuple[int, str]]:
+    # name -> (month, strptime directive); only names strptime (current locale) and dateutil agree on
+    out: Dict[str, Tuple[int, str]] = {}
+    for directive, names in (("%b", calendar.month_abbr), ("%B", calendar.month_name)):
+        for m in range(1, 13):
+            name = names[m].lower()
+            if name and name not in out and _DATEUTIL_INFO.month(name) == m:
+                out[name] = (m, directive)
+    return out
+
+_MONTH_NAMES = _month_names()
+
+def _safe_date(y: int, m: int, d: int) -> Optional[date]:
+    try:
+        return date(y, m, d)
+    except ValueError:
+        return None
+
+def _fast_raw_candidates(raw: str) -> Optional[List[Tuple[Optional[date], str, Dict[str, Any]]]]:
     """
-    Return ALL plausible interpretations of 's' as dates, with validation info.
-    Does NOT mutate input; does NOT pick one unless unambiguous.
+    Reproduce what the explicit formats and dateutil would yield for the common shapes,
+    without calling either. Returns None if 'raw' is not one of them.
     """
-    raw = s.strip()
-    now = datetime.utcnow().date()
-    seen = set()  # (year,month,day)
-    candidates: List[Candidate] = []
+    m = _ISO_SHAPE.fullmatch(raw)
+    if m:
+        y, sep, a, b = int(m.group(1)), m.group(2), int(m.group(3)), int(m.group(4))
+        out = [(_safe_date(y, a, b), f"strftime:%Y{sep}%m{sep}%d", {})]
+        for dayfirst, yearfirst in _DATEUTIL_COMBOS:
+            # dateutil: year in slot 0 -> Y-M-D, or Y-D-M when dayfirst and the last part fits a month
+            d = _safe_date(y, b, a) if (dayfirst and b <= 12) else _safe_date(y, a, b)
+            out.append((d, "dateutil", {"dayfirst": dayfirst, "yearfirst": yearfirst}))
+        return out
+
+    m = _US_SHAPE.fullmatch(raw)
+    if m:
+        a, sep, b, y = int(m.group(1)), m.group(2), int(m.group(3)), int(m.group(4))
+        out = [
+            (_safe_date(y, a, b), f"strftime:%m{sep}%d{sep}%Y", {}),
+            (_safe_date(y, b, a), f"strftime:%d{sep}%m{sep}%Y", {}),
+        ]
+        for dayfirst, yearfirst in _DATEUTIL_COMBOS:
+            # dateutil: first part > 31 is read as a year (never valid here), > 12 or dayfirst -> D-M-Y
+            if a > 31:
+                d = None
+            elif a > 12 or (dayfirst and b <= 12):
+                d = _safe_date(y, b, a)
+            else:
+                d = _safe_date(y, a, b)
+            out.append((d, "dateutil", {"dayfirst": dayfirst, "yearfirst": yearfirst}))
+        return out
+
+    m = _US_SHORT_SHAPE.fullmatch(raw)
+    if m:
+        sa, sep, a, b, c = m.group(1), m.group(2), int(m.group(1)), int(m.group(3)), int(m.group(4))
+        yy = c + (2000 if c <= 68 else 1900)  # strptime %y
+        out = []
+        if sep == "/":
+            out.append((_safe_date(yy, a, b), "strftime:%m/%d/%y", {}))
+            out.append((_safe_date(yy, b, a), "strftime:%d/%m/%y", {}))
+        if sep in "-/" and len(sa) == 2:
+            ya = a + (2000 if a <= 68 else 1900)
+            out.append((_safe_date(ya, b, c), f"strftime:%y{sep}%m{sep}%d", {}))
+        for dayfirst, yearfirst in _DATEUTIL_COMBOS:
+            # dateutil's unlabeled three-number resolution, then its sliding 2-digit year window
+            if a > 31 or (yearfirst and b <= 12 and c <= 31):
+                y, mo, d = (a, c, b) if (dayfirst and c <= 12) else (a, b, c)
+            elif a > 12 or (dayfirst and b <= 12):
+                y, mo, d = c, b, a
+            else:
+                y, mo, d = c, a, b
+            out.append((_safe_date(_DATEUTIL_INFO.convertyear(y), mo, d), "dateutil",
+                        {"dayfirst": dayfirst, "yearfirst": yearfirst}))
+        return out
+
+    m = _MONTH_FIRST_SHAPE.fullmatch(raw)
+    if m:
+        name, d, y, fmt = m.group(1), int(m.group(2)), int(m.group(3)), "%s %%d %%Y"
+    else:
+        m = _DAY_FIRST_SHAPE.fullmatch(raw)
+        if not m:
+            return None
+        name, d, y, fmt = m.group(2), int(m.group(1)), int(m.group(3)), "%%d %s %%Y"
+    month = _MONTH_NAMES.get(name.lower())
+    parsed = _safe_date(y, month[0], d) if month else None
+    if parsed is None:
+        return None  # unknown name or impossible day: let the full path decide
+    # The month is labelled, so every dateutil combination agrees with strptime
+    return [(parsed, f"strftime:{fmt % month[1]}", {})]
+
+def _full_raw_candidates(raw: str) -> List[Tuple[Optional[date], str, Dict[str, Any]]]:
+    out: List[Tuple[Optional[date], str, Dict[str, Any]]] = []
 
     # 0) Epoch timestamps
-    d0 = _epoch_candidate(raw)
-    if d0:
-        ok, reasons = _validate(d0, context, now)
-        key = (d0.year, d0.month, d0.day)
-        if key not in seen:
-            seen.add(key)
-            candidates.append(Candidate(
-                iso=_to_iso(d0), year=d0.year, month=d0.month, day=d0.day,
-                source="epoch", assumptions={}, valid=ok, reasons=reasons
-            ))
-
-    # 1) Explicit strptime formats
-    # For %y behavior, we temporarily override default pivot by pre-normalizing when possible.
-    for fmt in _EXPLICIT_FORMATS:
-        d1 = _try_strptime(raw, fmt)
-        if d1:
-            ok, reasons = _validate(d1, context, now)
-            key = (d1.year, d1.month, d1.day)
-            if key not in seen:
-                seen.add(key)
-                candidates.append(Candidate(
-                    iso=_to_iso(d1), year=d1.year, month=d1.month, day=d1.day,
-                    source=f"strftime:{fmt}", assumptions={}, valid=ok, reasons=reasons
-                ))
+    out.append((_epoch_candidate(raw), "epoch", {}))
+
+    # 1) Explicit strptime formats (skipping ones whose literals can't be present)
+    has_alpha = any(ch.isalpha() for ch in raw)
+    chars = set(raw)
+    for fmt, literals, needs_alpha in _EXPLICIT_PLAN:
+        if needs_alpha != has_alpha or not literals <= chars:
+            continue
+        out.append((_try_strptime(raw, fmt), f"strftime:{fmt}", {}))
 
     # 2) Heuristic parser (dateutil) with combinations
-    for dayfirst in (False, True):
-        for yearfirst in (False, True):
-            try:
-                dt = parser.parse(raw, dayfirst=dayfirst, yearfirst=yearfirst, fuzzy=True)
-                d = dt.date()
-                ok, reasons = _validate(d, context, now)
-                key = (d.year, d.month, d.day)
-                if key not in seen:
-                    seen.add(key)
-                    candidates.append(Candidate(
-                        iso=_to_iso(d), year=d.year, month=d.month, day=d.day,
-                        source="dateutil", assumptions={"dayfirst": dayfirst, "yearfirst": yearfirst},
-                        valid=ok, reasons=reasons
-                    ))
-            except Exception:
-                pass
-
-    # 3) Sort: valid first, then by absolute distance from today (closer is better), then ISO
+    for dayfirst, yearfirst in _DATEUTIL_COMBOS:
+        try:
+            d = parser.parse(raw, dayfirst=dayfirst, yearfirst=yearfirst, fuzzy=True).date()
+        except Exception:
+            d = None
+        out.append((d, "dateutil", {"dayfirst": dayfirst, "yearfirst": yearfirst}))
+    return out
+
+def _rank_candidates(
+    raw_candidates: List[Tuple[Optional[date], str, Dict[str, Any]]],
+    context: str,
+    prefer: str,
+    now: date,
+) -> Tuple[bool, Optional[str], Tuple[Candidate, ...]]:
+    seen = set()  # (year,month,day)
+    candidates: List[Candidate] = []
+    for d, source, assumptions in raw_candidates:
+        if d is None:
+            continue
+        key = (d.year, d.month, d.day)
+        if key in seen:
+            continue
+        seen.add(key)
+        ok, reasons = _validate(d, context, now)
+        candidates.append(Candidate(
+            iso=_to_iso(d), year=d.year, month=d.month, day=d.day,
+            source=source, assumptions=assumptions, valid=ok, reasons=reasons
+        ))
+
+    # Sort: valid first, then by absolute distance from today (closer is better), then ISO
     def _score(c: Candidate) -> Tuple[int, int, str]:
-        d = date(c.year, c.month, c.day)
-        dist = abs((d - now).days)
+        dist = abs((date(c.year, c.month, c.day) - now).days)
         return (0 if c.valid else 1, dist, c.iso)
 
     candidates.sort(key=_score)
 
     # Ambiguity detection (e.g., "01/02/03")
-    unique_isos = [c.iso for c in candidates]
-    ambiguous = len(set(unique_isos)) > 1
+    ambiguous = len(candidates) > 1
 
     # Preferred choice if you need one
     best: Optional[str] = None
@@ -158,11 +250,124 @@ def parse_date_all(
             if prefereds:
                 best_c = prefereds[0]
         best = best_c.iso
+    return ambiguous, best, tuple(candidates)
+
+@lru_cache(maxsize=65536)
+def _parse_cached(raw: str, context: str, prefer: str, now: date) -> Tuple[bool, Optional[str], Tuple[Candidate, ...]]:
+    # 'now' is part of the key so validity ("future date", age bounds) never goes stale across days
+    raw_candidates = _fast_raw_candidates(raw)
+    if raw_candidates is None:
+        raw_candidates = _full_raw_candidates(raw)
+    return _rank_candidates(raw_candidates, context, prefer, now)
 
+def _candidate_dict(c: Candidate) -> Dict[str, Any]:
+    # Same keys/order as dataclasses.asdict, without its recursive deepcopy
+    return {
+        "iso": c.iso, "year": c.year, "month": c.month, "day": c.day,
+        "source": c.source, "assumptions": dict(c.assumptions),
+        "valid": c.valid, "reasons": list(c.reasons),
+    }
+
+def _result(raw: str, context: str, parsed: Tuple[bool, Optional[str], Tuple[Candidate, ...]]) -> Dict[str, Any]:
+    ambiguous, best, candidates = parsed
     return {
         "input": raw,
         "context": context,
         "ambiguous": ambiguous,
         "best": best,
-        "candidates": [asdict(c) for c in candidates],
+        "candidates": [_candidate_dict(c) for c in candidates],
     }
+
+def parse_date_all(
+    s: str,
+    *,
+    context: str = "dob",               # 'dob' or 'generic'
+    prefer: str = "US",                 # tie-breaker if ambiguous: 'US' -> month/day, 'EU' -> day/month
+    two_digit_year_pivot: int = 69      # for explicit %y formats; 69 -> 1969/2069 behavior like strptime
+) -> Dict[str, Any]:
+    """
+    Return ALL plausible interpretations of 's' as dates, with validation info.
+    Does NOT mutate input; does NOT pick one unless unambiguous.
+
+    Tiers: plain YYYY-MM-DD / MM/DD/YYYY shapes are resolved by regex without calling
+    strptime or dateutil; anything else goes through the explicit formats and dateutil.
+    Results are LRU-cached per (input, context, prefer, today).
+    """
+    raw = s.strip()
+    now = datetime.utcnow().date()
+    return _result(raw, context, _parse_cached(raw, context, prefer, now))
+
+def parse_many(
+    values: Iterable[str],
+    *,
+    context: str = "dob",
+    prefer: str = "US",
+    two_digit_year_pivot: int = 69
+) -> List[Dict[str, Any]]:
+    """ Bulk version of parse_date_all for imports; 'today' is fixed once for the whole batch. """
+    now = datetime.utcnow().date()
+    out: List[Dict[str, Any]] = []
+    for s in values:
+        raw = s.strip()
+        out.append(_result(raw, context, _parse_cached(raw, context, prefer, now)))
+    return out
+
+def _parse_date_all_uncached(s: str, *, context: str = "dob", prefer: str = "US") -> Dict[str, Any]:
+    """ Reference path (explicit formats + dateutil for every input); used by the benchmark and tests. """
+    raw = s.strip()
+    now = datetime.utcnow().date()
+    return _result(raw, context, _rank_candidates(_full_raw_candidates(raw), context, prefer, now))
+
+
+# ---------------- Benchmark ----------------
+
+def _make_corpus(n: int, seed: int = 7) -> List[str]:
+    import random
+    rng = random.Random(seed)
+    start = date(1925, 1, 1).toordinal()
+    end = date.today().toordinal()
+    shapes = [
+        (40, lambda d: f"{d.year:04d}-{d.month:02d}-{d.day:02d}"),
+        (25, lambda d: f"{d.month:02d}/{d.day:02d}/{d.year:04d}"),
+        (10, lambda d: f"{d.month}/{d.day}/{d.year}"),
+        (5,  lambda d: f"{d.day:02d}.{d.month:02d}.{d.year:04d}"),
+        (5,  lambda d: f"{d.year:04d}/{d.month}/{d.day}"),
+        (3,  lambda d: d.strftime("%b %d %Y")),
+        (2,  lambda d: d.strftime("%d %B %Y")),
+        (5,  lambda d: d.strftime("%m/%d/%y")),
+        (5,  lambda d: f" {d.month:02d}-{d.day:02d}-{d.year:04d} "),
+    ]
+    weights = [w for w, _ in shapes]
+    fmts = [f for _, f in shapes]
+    out = []
+    for _ in range(n):
+        d = date.fromordinal(rng.randint(start, end))
+        out.append(rng.choices(fmts, weights)[0](d))
+    return out
+
+if __name__ == "__main__":
+    import argparse, time
+    ap = argparse.ArgumentParser(description="Benchmark tiered DOB parsing against the full reference path.")
+    ap.add_argument("--n", type=int, default=1_000_000, help="corpus size for the tiered parser")
+    ap.add_argument("--verify", type=int, default=20_000, help="sample size compared against the reference path")
+    args = ap.parse_args()
+
+    corpus = _make_corpus(args.n)
+    sample = corpus[: args.verify]
+
+    t0 = time.perf_counter()
+    ref = [_parse_date_all_uncached(s) for s in sample]
+    t_ref = time.perf_counter() - t0
+
+    _parse_cached.cache_clear()
+    t0 = time.perf_counter()
+    new = parse_many(corpus)
+    t_new = time.perf_counter() - t0
+
+    mismatches = sum(1 for a, b in zip(ref, new) if a != b)
+    ref_rate = len(sample) / t_ref
+    new_rate = len(corpus) / t_new
+    print(f"reference : {len(sample):>9,} strings in {t_ref:7.2f}s  ({ref_rate:,.0f}/s, ~{args.n / ref_rate:,.0f}s for {args.n:,})")
+    print(f"tiered    : {len(corpus):>9,} strings in {t_new:7.2f}s  ({new_rate:,.0f}/s)")
+    print(f"speedup   : {new_rate / ref_rate:,.1f}x   cache: {_parse_cached.cache_info()}")
+    print(f"mismatches: {mismatches} / {len(sample):,}")
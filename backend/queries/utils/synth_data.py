@@ -0,0 +1,308 @@
+''' Scale-test data: millions of realistic client / triage / triage_question rows written straight into SQLite '''
+# Usage (repo root), ~10M rows:
+#   python -m backend.queries.utils.synth_data --db /tmp/lunara_10m.db --clients 1000000 --triages 1500000 --turns 5
+# Subspecialty confidences and top-3 doctors come from the live model bundle run over caller-like
+# utterances from training_dataset.csv; --confidences dirichlet skips the model (no .joblib needed).
+import argparse
+import os
+import sqlite3
+import time
+from datetime import date
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from backend import db
+from backend.queries import general_queries as gq
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data")
+CONF_COLS = ("re_conf", "mfm_conf", "uro_conf", "gob_conf", "mis_conf", "go_conf")
+BULK_PRAGMAS = (
+    "PRAGMA journal_mode = OFF;",
+    "PRAGMA synchronous = OFF;",
+    "PRAGMA locking_mode = EXCLUSIVE;",
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA cache_size = -262144;",  # 256 MB
+    "PRAGMA foreign_keys = OFF;",
+)
+LOADED_TABLES = ("client", "client_phonetic", "triage", "triage_question")
+
+FIRST_NAMES = (
+    "Aaliyah Abigail Adriana Aisha Alejandra Alexis Alicia Allison Amanda Amber Amy Ana Andrea Angela Anna "
+    "Ashley Ava Brianna Brittany Camila Carmen Caroline Catherine Chloe Christina Claire Courtney Crystal Daniela "
+    "Danielle Deborah Destiny Diana Elena Elizabeth Ella Emily Emma Erica Erin Esther Eva Fatima Gabriela Grace "
+    "Hannah Heather Isabella Jacqueline Jasmine Jennifer Jessica Joanna Julia Karen Katherine Kayla Kimberly "
+    "Laura Lauren Leah Linda Lisa Lucia Madison Maria Mariana Megan Melissa Mia Michelle Monica Nancy Natalie "
+    "Nicole Olivia Patricia Priya Rachel Rebecca Rosa Samantha Sara Sarah Shanice Sofia Stephanie Tamara "
+    "Tiffany Valentina Vanessa Victoria Yasmin Yesenia Zoe"
+).split()
+LAST_NAMES = (
+    "Adams Ahmed Alvarez Anderson Bailey Baker Brown Campbell Carter Castillo Chen Clark Collins Cook Cruz "
+    "Davis Diaz Edwards Evans Flores Garcia Gomez Gonzalez Green Gupta Hall Harris Hernandez Hill Jackson "
+    "James Johnson Jones Kaur Kelly Khan Kim King Lee Lewis Lopez Martin Martinez Miller Mitchell Moore Morales "
+    "Morgan Murphy Nelson Nguyen Ortiz Parker Patel Perez Peterson Phillips Ramirez Reyes Richardson Rivera "
+    "Roberts Robinson Rodriguez Rogers Ruiz Sanchez Scott Shah Singh Smith Stewart Sullivan Taylor Thomas "
+    "Thompson Torres Turner Walker Wang Ward Washington Watson White Williams Wilson Wright Wu Young Zhang"
+).split()
+
+# agent_notes vocabulary, in the style of the pop_db.py rows
+HIST_WITH_YEAR = ("hx of PCOS", "hx of fibroids", "prior C-section", "hx of endometriosis", "hx of preeclampsia",
+                  "hx of ovarian cyst", "LEEP", "hx of gestational diabetes", "hx of miscarriage", "hysteroscopy")
+HIST_PLAIN = ("family hx of endometrial cancer", "family hx of breast cancer", "family hx of ovarian cancer",
+              "no significant PMH", "G2P1", "G3P2", "G1P0", "on OCPs", "IUD in place", "postmenopausal")
+CURR_SYMPTOMS = ("pelvic pain", "heavy bleeding", "irregular periods", "nausea in pregnancy", "vaginal bulge",
+                 "urinary leakage", "spotting between periods", "painful intercourse", "missed period",
+                 "abnormal pap follow-up", "hot flashes", "foul discharge", "trouble conceiving", "breast tenderness")
+CURR_TRIGGERS = ("after exercise", "at night", "after intercourse", "when coughing", "during periods",
+                 "since last month", "for two weeks", "after starting new medication")
+CURR_FREQ = ("daily", "weekly", "intermittently", "most days", "twice a month")
+CURR_RELIEF = ("that improves with NSAIDs", "that worsens when standing", "that is not relieved by rest",
+               "that started after delivery")
+ANSWERS = ("yes - ", "no - ", "skip - ")
+ANSWER_TAILS = ("", "", "", "started last week", "a few months", "only sometimes", "getting worse", "not sure")
+
+# ---------------- Pools ----------------
+
+def _caller_texts(rng: np.random.Generator, n: int) -> List[str]:
+    """ Opening statements: 1-3 training utterances run together, the way callers ramble. """
+    texts = pd.read_csv(os.path.join(DATA_DIR, "training_dataset.csv"))["user_input"].astype(str).to_numpy()
+    k = rng.integers(1, 4, size=n)
+    picks = rng.integers(0, len(texts), size=(n, 3))
+    return [" ".join(texts[picks[i, :k[i]]]) for i in range(n)]
+
+def _sspec_columns(sspecs: np.ndarray) -> List[str]:
+    # the same name/short matching the app uses when it saves a triage
+    cols = []
+    for row in sspecs:
+        hit = gq._subs_to_conf_columns([{"subspecialty_name": row[1], "subspecialty_short": row[2], "percent_match": 100}])
+        cols.append(next(c for c, v in hit.items() if v))
+    return cols
+
+def model_pool(texts: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Run the live bundle over the pool texts once: per text the six confidence columns (0-100,
+    CONF_COLS order), the top-3 doctor columns, the top subspecialty (for picking questions),
+    plus the bundle's doctor table.
+    """
+    from backend.model_bundle import current_bundle
+    from backend.model_inference import topk_indices
+    bundle = current_bundle()
+    probs = bundle.predictor.predict_proba(texts)
+    n_sspec = len(bundle.sspecs)
+    sspec_sum = np.stack([np.bincount(bundle.sspec_map, weights=p, minlength=n_sspec) for p in probs])
+    calibrated = np.stack([bundle.calibration(s) for s in sspec_sum])
+    conf = np.zeros((len(texts), len(CONF_COLS)), dtype=np.int64)
+    for i, col in enumerate(_sspec_columns(bundle.sspecs)):
+        conf[:, CONF_COLS.index(col)] = np.rint(calibrated[:, i] * 100)
+    # same scoring as rank_turn, batched
+    doc_map = bundle.doc_map
+    doc_sum = np.log(probs[:, doc_map[:, 0].astype(np.int64)] @ doc_map[:, 1:].astype(np.float64) + 1)
+    return conf, topk_indices(doc_sum, 3), np.argmax(sspec_sum, axis=1), bundle.doc_names
+
+def dirichlet_pool(rng: np.random.Generator, n: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """ Model-free stand-in: peaked Dirichlet confidences and random distinct doctors. """
+    doc_names = pd.read_csv(os.path.join(DATA_DIR, "doc_sspec_map.csv")).values
+    sspecs = pd.read_csv(os.path.join(DATA_DIR, "sspec_key_map.csv")).values
+    p = rng.dirichlet(np.full(len(sspecs), 0.4), size=n)
+    conf = np.zeros((n, len(CONF_COLS)), dtype=np.int64)
+    for i, col in enumerate(_sspec_columns(sspecs)):
+        conf[:, CONF_COLS.index(col)] = np.rint(p[:, i] * 100)
+    docs = np.argsort(rng.random((n, len(doc_names))), axis=1)[:, :3]
+    return conf, docs, np.argmax(p, axis=1), doc_names
+
+# ---------------- Rows ----------------
+
+def _timestamps(rng: np.random.Generator, n: int, days: int) -> np.ndarray:
+    """ Business-hours call times over the last `days` days, as CURRENT_TIMESTAMP-style strings. """
+    today = np.datetime64(date.today().isoformat(), "s")
+    day = rng.integers(0, days, size=n)
+    secs = np.clip(rng.normal(13.5, 2.5, size=n), 8, 19.99) * 3600
+    t = np.minimum(today - day.astype("timedelta64[D]") + secs.astype("timedelta64[s]"), np.datetime64("now", "s"))
+    return np.char.replace(np.datetime_as_string(t, unit="s"), "T", " ")
+
+def _dobs(rng: np.random.Generator, n: int) -> np.ndarray:
+    # mostly reproductive age, with a tail of peri/postmenopausal callers
+    age = np.where(rng.random(n) < 0.8, rng.normal(32, 7, n), rng.normal(55, 10, n))
+    age_days = (np.clip(age, 15, 90) * 365.25).astype(np.int64)
+    return np.datetime64(date.today().isoformat(), "D") - age_days.astype("timedelta64[D]")
+
+def client_rows(rng: np.random.Generator, n: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """ n distinct (first, last, dob) identities as pool indices + DOB strings; unique like ux_client_identity. """
+    n_fn, n_ln = len(FIRST_NAMES), len(LAST_NAMES)
+    keys = np.zeros(0, dtype=np.int64)
+    while len(keys) < n:
+        want = int((n - len(keys)) * 1.05) + 16
+        dob = _dobs(rng, want).astype(np.int64)
+        fresh = (rng.integers(0, n_fn, want) * n_ln + rng.integers(0, n_ln, want)) * 200_000 + (dob + 100_000)
+        keys = np.unique(np.concatenate([keys, fresh]))
+    keys = rng.permutation(keys)[:n]
+    name, dob = np.divmod(keys, 200_000)
+    fn, ln = np.divmod(name, n_ln)
+    return fn, ln, np.datetime_as_string((dob - 100_000).astype("datetime64[D]"))
+
+def agent_notes(rng: np.random.Generator, n_turns: np.ndarray) -> List[str]:
+    n = len(n_turns)
+    h1 = rng.integers(0, len(HIST_WITH_YEAR), n)
+    year = rng.integers(2005, date.today().year, n)
+    h2 = rng.integers(0, len(HIST_PLAIN), n)
+    s1, s2 = rng.integers(0, len(CURR_SYMPTOMS), n), rng.integers(0, len(CURR_SYMPTOMS), n)
+    trig, freq, rel = rng.integers(0, len(CURR_TRIGGERS), n), rng.integers(0, len(CURR_FREQ), n), rng.integers(0, len(CURR_RELIEF), n)
+    style = rng.integers(0, 2, n)
+    out = []
+    for i in range(n):
+        hist = f"{HIST_WITH_YEAR[h1[i]]} in {year[i]}; {HIST_PLAIN[h2[i]]}"
+        if style[i]:
+            curr = f"concern for {CURR_SYMPTOMS[s1[i]]} {CURR_TRIGGERS[trig[i]]}; denies {CURR_SYMPTOMS[s2[i]]}, but endorses pelvic pain {CURR_FREQ[freq[i]]}"
+        else:
+            curr = f"concern for {CURR_SYMPTOMS[s1[i]]} {CURR_TRIGGERS[trig[i]]}; notes {CURR_SYMPTOMS[s2[i]]} {CURR_RELIEF[rel[i]]}"
+        out.append(f"HIST: {hist} | CURR: {curr} | Q/A steps: {n_turns[i]}")
+    return out
+
+# ---------------- Load ----------------
+
+def _bulk_connection(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None)
+    for p in BULK_PRAGMAS:
+        conn.execute(p)
+    return conn
+
+def _drop_secondary_indexes(conn) -> List[str]:
+    """ Drop the loaded tables' indexes (rebuilt once at the end, far cheaper than per row); returns their SQL. """
+    rows = conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+        f"AND tbl_name IN ({','.join('?' * len(LOADED_TABLES))});", LOADED_TABLES
+    ).fetchall()
+    for name, _sql in rows:
+        conn.execute(f"DROP INDEX {name};")
+    return [sql for _name, sql in rows]
+
+def _insert(conn, sql: str, rows) -> int:
+    conn.execute("BEGIN;")
+    cur = conn.executemany(sql, rows)
+    conn.execute("COMMIT;")
+    return cur.rowcount
+
+def synthesize(path: str, n_clients: int, n_triages: int, turns_mean: float, days: int, agents: int,
+               chunk: int, seed: int, confidences: str, pool_size: int) -> Dict[str, float]:
+    rng = np.random.default_rng(seed)
+    timings: Dict[str, float] = {}
+
+    db.DB_PATH = path
+    db.init_db()
+    conn = _bulk_connection(path)
+    if conn.execute("SELECT EXISTS (SELECT 1 FROM client);").fetchone()[0]:
+        conn.close()
+        raise SystemExit(f"{path} already has clients; synthesize into a fresh --db")
+    conn.close()
+
+    t0 = time.perf_counter()
+    texts = _caller_texts(rng, pool_size)
+    conf, docs, top_sspec, doc_names = model_pool(texts) if confidences == "model" else dirichlet_pool(rng, pool_size)
+    # doctor rows the way the app creates them, so doc_id1..3 resolve to names
+    doc_ids = np.asarray([gq.q_get_or_create_doctor_by_name(str(n)) for n in doc_names[:, 1]], dtype=np.int64)
+    sym = pd.read_csv(os.path.join(DATA_DIR, "symptoms_full.csv")).values
+    questions_by_sspec = [sym[sym[:, 1] == s, 8].astype(str) for s in range(int(sym[:, 1].max()) + 1)]
+    timings["pool"] = time.perf_counter() - t0
+
+    conn = _bulk_connection(path)
+    index_sql = _drop_secondary_indexes(conn)
+
+    # clients + client_phonetic
+    t0 = time.perf_counter()
+    fn, ln, dob = client_rows(rng, n_clients)
+    fn_code = np.asarray([gq._soundex(x) for x in FIRST_NAMES])
+    ln_code = np.asarray([gq._soundex(x) for x in LAST_NAMES])
+    first, last = np.asarray(FIRST_NAMES), np.asarray(LAST_NAMES)
+    for lo in range(0, n_clients, chunk):
+        hi = min(lo + chunk, n_clients)
+        ids = range(lo + 1, hi + 1)
+        _insert(conn, "INSERT INTO client (client_id, client_fn, client_ln, client_dob) VALUES (?, ?, ?, ?);",
+                zip(ids, first[fn[lo:hi]].tolist(), last[ln[lo:hi]].tolist(), dob[lo:hi].tolist()))
+        _insert(conn, "INSERT INTO client_phonetic (client_id, fn_code, ln_code, client_dob) VALUES (?, ?, ?, ?);",
+                zip(ids, fn_code[fn[lo:hi]].tolist(), ln_code[ln[lo:hi]].tolist(), dob[lo:hi].tolist()))
+    timings["client"] = time.perf_counter() - t0
+
+    # triages + their Q/A turns, chunk by chunk
+    t0 = time.perf_counter()
+    n_questions = 0
+    for lo in range(0, n_triages, chunk):
+        m = min(chunk, n_triages - lo)
+        ids = np.arange(lo + 1, lo + m + 1)
+        pool = rng.integers(0, pool_size, m)
+        when = _timestamps(rng, m, days)
+        turns = np.clip(1 + rng.poisson(max(turns_mean - 1, 0), m), 1, 15)
+        # older calls are closed out: notes written, most handed to Epic
+        closed = when < str(np.datetime64("now", "s") - np.timedelta64(2, "D")).replace("T", " ")
+        sent = closed & (rng.random(m) < 0.85)
+        notes = np.where(closed, np.asarray(agent_notes(rng, turns), dtype=object), None)
+        sent_at = np.where(sent, [w[:11] + "23:30:00" for w in when], None)
+        d = doc_ids[docs[pool]]
+        c = conf[pool]
+        _insert(
+            conn,
+            "INSERT INTO triage (triage_id, agent_id, client_id, date_time, re_conf, mfm_conf, uro_conf, gob_conf, "
+            "mis_conf, go_conf, doc_id1, doc_id2, doc_id3, agent_notes, sent_to_epic, epic_sent_date) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+            zip(ids.tolist(), (100 + rng.integers(1, agents + 1, m)).tolist(), rng.integers(1, n_clients + 1, m).tolist(),
+                when.tolist(), *(c[:, j].tolist() for j in range(len(CONF_COLS))),
+                d[:, 0].tolist(), d[:, 1].tolist(), d[:, 2].tolist(), notes.tolist(), sent.astype(int).tolist(), sent_at.tolist()),
+        )
+
+        # Q/A: turn 1 is the opening statement, then model questions from the leading subspecialty
+        total = int(turns.sum())
+        owner = np.repeat(np.arange(m), turns)
+        turn_no = np.arange(total) - np.repeat(np.cumsum(turns) - turns, turns) + 1
+        answer = rng.integers(0, len(ANSWERS), total)
+        tail = rng.integers(0, len(ANSWER_TAILS), total)
+        qpick = rng.integers(0, 1 << 30, total)
+        sspec_of = top_sspec[pool[owner]]
+
+        def _qa():
+            for k in range(total):
+                i = owner[k]
+                if turn_no[k] == 1:
+                    yield int(ids[i]), 1, "Q_INIT", texts[pool[i]][:1024]
+                else:
+                    qs = questions_by_sspec[sspec_of[k]]
+                    yield int(ids[i]), int(turn_no[k]), qs[qpick[k] % len(qs)][:256], ANSWERS[answer[k]] + ANSWER_TAILS[tail[k]]
+
+        _insert(conn, "INSERT INTO triage_question (triage_id, turn_number, triage_question, triage_answer) "
+                      "VALUES (?, ?, ?, ?);", _qa())
+        n_questions += total
+        print(f"  triages {lo + m:,}/{n_triages:,}, Q/A rows {n_questions:,}", flush=True)
+    timings["triage+triage_question"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for sql in index_sql:
+        conn.execute(sql)
+    conn.execute("ANALYZE;")
+    timings["indexes+analyze"] = time.perf_counter() - t0
+    conn.execute("PRAGMA journal_mode = DELETE;")
+    conn.close()
+    timings["rows"] = 2 * n_clients + n_triages + n_questions
+    return timings
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Write a scale-test dataset into a fresh SQLite database.")
+    ap.add_argument("--db", default=db.DB_PATH, help="target database (default: LUNARA_DB_PATH)")
+    ap.add_argument("--clients", type=int, default=200_000)
+    ap.add_argument("--triages", type=int, default=500_000)
+    ap.add_argument("--turns", type=float, default=5.0, help="mean Q/A turns per triage (incl. the opening statement)")
+    ap.add_argument("--days", type=int, default=730, help="spread triages over this many past days")
+    ap.add_argument("--agents", type=int, default=40)
+    ap.add_argument("--chunk", type=int, default=250_000, help="rows generated and committed per transaction")
+    ap.add_argument("--confidences", choices=("model", "dirichlet"), default="model")
+    ap.add_argument("--pool", type=int, default=4096, help="distinct caller utterances run through the model")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    t = synthesize(args.db, args.clients, args.triages, args.turns, args.days, args.agents,
+                   args.chunk, args.seed, args.confidences, args.pool)
+    wall = time.perf_counter() - t0
+    rows = t.pop("rows")
+    print(f"{rows:,.0f} rows in {wall:.1f}s ({rows / wall:,.0f} rows/s) -> {args.db} "
+          f"({os.path.getsize(args.db) / 2 ** 20:,.0f} MB)")
+    print("  " + ", ".join(f"{k} {v:.1f}s" for k, v in t.items()))
@@ -0,0 +1,255 @@
+# backend/queries/write_queue.py
+''' Single writer thread: concurrent writes share one SQLite transaction and one fsync (group commit) '''
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend.db import get_connection
+
+GROUP_WINDOW_S = float(os.getenv("LUNARA_WRITE_WINDOW_MS", "1")) / 1000.0  # wait this long for company after the first write
+MAX_GROUP = 256
+
+WriteResult = namedtuple("WriteResult", ["lastrowid", "rowcount"])
+
+class WriteQueue:
+    """
+    Request threads hand a write to run(fn) and block on a Future; fn(conn) gets the writer's
+    connection and must not commit. The writer thread takes everything queued within the group
+    window, runs it inside one BEGIN IMMEDIATE ... COMMIT with a SAVEPOINT per write (a failing
+    write rolls back alone and raises in its caller), and resolves the futures only after COMMIT,
+    so the caller's next read, on any connection, already sees its write.
+    """
+
+    def __init__(self, window_s: float = GROUP_WINDOW_S, max_group: int = MAX_GROUP, enabled: bool = True):
+        self.window_s = window_s
+        self.max_group = max_group
+        self.enabled = enabled
+        self._q: "queue.Queue[Optional[Tuple[Callable, Future]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._conn = None  # the open group's connection, for writes issued from inside a write
+        self.commits = 0
+        self.writes = 0
+        self.failed_writes = 0
+        self.max_depth = 0
+        self.busy_s = 0.0
+
+    # ---------------- Callers ----------------
+
+    def run(self, fn: Callable[[Any], Any], timeout: Optional[float] = None) -> Any:
+        """ fn(conn)'s return value once it is committed; re-raises what fn raised. """
+        if threading.current_thread() is self._thread:
+            return fn(self._conn)  # nested write: already inside the group's transaction
+        if not self.enabled:
+            conn = get_connection()
+            try:
+                out = fn(conn)
+                conn.commit()
+                return out
+            finally:
+                conn.close()
+        return self.submit(fn).result(timeout)
+
+    def submit(self, fn: Callable[[Any], Any]) -> Future:
+        fut: Future = Future()
+        self.start()
+        self._q.put((fn, fut))
+        depth = self._q.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return fut
+
+    def execute(self, sql: str, params: tuple = ()) -> WriteResult:
+        """ One statement; its lastrowid and rowcount. """
+        def _one(conn):
+            cur = conn.execute(sql, params)
+            return WriteResult(cur.lastrowid, cur.rowcount)
+        return self.run(_one)
+
+    # ---------------- Writer ----------------
+
+    def _take_group(self, first) -> Tuple[List, bool]:
+        group, stopping = [first], False
+        deadline = time.monotonic() + self.window_s
+        while len(group) < self.max_group:
+            try:
+                left = deadline - time.monotonic()
+                item = self._q.get(timeout=left) if left > 0 else self._q.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stopping = True
+                break
+            group.append(item)
+        return group, stopping
+
+    def _commit_group(self, group: List[Tuple[Callable, Future]]) -> None:
+        t0 = time.perf_counter()
+        done: List[Tuple[Future, Any, Optional[BaseException]]] = []
+        conn = None
+        try:
+            conn = get_connection()
+            self._conn = conn
+            conn.execute("BEGIN IMMEDIATE;")
+            for fn, fut in group:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT write_op;")
+                try:
+                    out = fn(conn)
+                    conn.execute("RELEASE write_op;")
+                    done.append((fut, out, None))
+                except BaseException as e:  # anything fn raises is its caller's, never the writer thread's
+                    conn.execute("ROLLBACK TO write_op;")
+                    conn.execute("RELEASE write_op;")
+                    done.append((fut, None, e))
+            conn.commit()
+        except BaseException as e:
+            # connect/BEGIN/COMMIT itself failed: nothing in the group is durable, and every
+            # caller still waiting (including those never set running) gets the error
+            print(f"Write group of {len(group)} failed: {e}")
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            done = [(fut, None, e) for fn, fut in group
+                    if fut.running() or (not fut.done() and fut.set_running_or_notify_cancel())]
+        finally:
+            self._conn = None
+            if conn is not None:
+                conn.close()
+
+        self.commits += 1
+        self.busy_s += time.perf_counter() - t0
+        for fut, out, err in done:
+            self.writes += 1
+            if err is None:
+                fut.set_result(out)
+            else:
+                self.failed_writes += 1
+                fut.set_exception(err)
+
+    def _loop(self):
+        while True:
+            first = self._q.get()
+            if first is None:
+                return
+            group, stopping = self._take_group(first)
+            try:
+                self._commit_group(group)
+            except BaseException as e:
+                # _commit_group resolves its futures itself; keep the single writer alive for later writes
+                print(f"Writer thread error: {e}")
+            if stopping:
+                return
+
+    def start(self) -> "WriteQueue":
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="sqlite-writer", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """ Commit whatever is queued, then end the writer thread. """
+        with self._lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                return
+            self._q.put(None)
+        thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "commits": self.commits,
+            "writes": self.writes,
+            "failed_writes": self.failed_writes,
+            "writes_per_commit": round(self.writes / self.commits, 2) if self.commits else 0.0,
+            "commits_per_s": round(self.commits / self.busy_s, 1) if self.busy_s else 0.0,
+            "queue_depth": self._q.qsize(),
+            "max_queue_depth": self.max_depth,
+        }
+
+# LUNARA_WRITE_QUEUE=0: every write opens its own connection and commits alone (the old behaviour)
+write_queue = WriteQueue(enabled=os.getenv("LUNARA_WRITE_QUEUE", "1") != "0")
+
+
+# ---------------- Concurrent-write check ----------------
+
+if __name__ == "__main__":
+    # python -m backend.queries.write_queue --agents 32 --turns 50
+    import argparse, tempfile
+    ap = argparse.ArgumentParser(description="Concurrent agents logging triage turns: one commit per write vs group commit.")
+    ap.add_argument("--agents", type=int, default=32, help="concurrent request threads")
+    ap.add_argument("--turns", type=int, default=50, help="Q/A turns each agent logs")
+    ap.add_argument("--window-ms", type=float, default=GROUP_WINDOW_S * 1000)
+    args = ap.parse_args()
+
+    from backend import db
+    from backend.queries import general_queries as gq
+    from backend.queries import dashboard_query as dq
+
+    def _bench(label: str, wq: WriteQueue) -> None:
+        tmp = tempfile.mkdtemp(prefix="lunara_writes_")
+        db.DB_PATH = os.path.join(tmp, "writes.db")
+        db.init_db()
+        gq.write_queue = dq.write_queue = wq
+        client_id = gq.q_get_or_create_client("Jane", "Doe", "1990-01-02")
+        errors, lat, stale = [], [], [0]
+        sampler_stop = threading.Event()
+        depths: List[int] = []
+
+        def _sample():
+            while not sampler_stop.wait(0.005):
+                depths.append(wq._q.qsize())
+
+        def _agent(n: int) -> None:
+            try:
+                tid = gq.q_start_triage(100 + n, client_id)
+                for turn in range(1, args.turns + 1):
+                    t0 = time.perf_counter()
+                    gq.q_insert_triage_question(tid, f"Q{turn}", "yes", turn)
+                    lat.append(time.perf_counter() - t0)
+                    # read-after-write: the turn just logged must already be visible
+                    row = gq._exec_fetchone(
+                        "SELECT COUNT(*) AS n FROM triage_question WHERE triage_id = ?;", (tid,))
+                    stale[0] += row["n"] != turn
+                gq.q_end_triage(tid, "done")
+            except Exception as e:
+                errors.append(e)
+
+        sampler = threading.Thread(target=_sample, daemon=True)
+        sampler.start()
+        threads = [threading.Thread(target=_agent, args=(n,)) for n in range(args.agents)]
+        t0 = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        wall = time.perf_counter() - t0
+        sampler_stop.set()
+        wq.stop()
+
+        import numpy as np
+        ms = np.asarray(lat) * 1e3 if lat else np.zeros(1)
+        s = wq.stats()
+        writes = args.agents * (args.turns + 2)
+        line = f"{label:>12}: {writes / wall:8.0f} writes/s, p50 {np.percentile(ms, 50):6.2f} ms, p99 {np.percentile(ms, 99):7.2f} ms"
+        if wq.enabled:
+            line += (f", {s['commits'] / wall:6.0f} commits/s, {s['writes_per_commit']:5.1f} writes/commit, "
+                     f"queue depth mean {np.mean(depths) if depths else 0:.1f} max {s['max_queue_depth']}")
+        print(line + f", stale reads {stale[0]}, errors {len(errors)}")
+        if errors:
+            print(f"  first error: {errors[0]!r}")
+
+    print(f"{args.agents} agents x {args.turns} turns")
+    _bench("per-write", WriteQueue(enabled=False))
+    _bench("group", WriteQueue(window_s=args.window_ms / 1000.0))
@@ -0,0 +1,421 @@
+# backend/request_capture.py
+''' Optional capture of triage API traffic to rotating NDJSON files, and a replay tool that re-issues it '''
+# Capture: LUNARA_CAPTURE_DIR=/tmp/lunara_capture bash runBackend.sh
+# Replay (repo root): python -m backend.request_capture /tmp/lunara_capture/*.ndjson --speed 10
+import heapq
+import json
+import os
+import queue
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import orjson
+    def _dumps(obj) -> bytes:
+        return orjson.dumps(obj)
+except ImportError:  # orjson is optional, as in app.py
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+CAPTURE_PREFIXES = ("/api/triage/", "/api/triages")
+SKIP_PATHS = ("/api/triages/stream",)  # SSE: the response never ends
+MAX_FILE_MB = 64.0
+KEEP_FILES = 20
+MAX_PENDING = 10_000  # records waiting for the writer; past this they are dropped, never waited on
+MAX_RESPONSE_BYTES = 256 * 1024
+_TRIAGE_PATH = re.compile(r"^/api/triages/(\d+)$")
+
+def capture_log_from_env() -> Optional["CaptureLog"]:
+    """ LUNARA_CAPTURE_DIR=<dir> (rotate at LUNARA_CAPTURE_MAX_MB); unset -> no capture middleware. """
+    spec = os.getenv("LUNARA_CAPTURE_DIR", "").strip()
+    if not spec:
+        return None
+    return CaptureLog(spec, float(os.getenv("LUNARA_CAPTURE_MAX_MB", str(MAX_FILE_MB))))
+
+def _decode(raw: bytes) -> Any:
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return raw.decode("utf-8", "replace")
+
+def _triage_id(path: str, body: Any, response: Any) -> Optional[int]:
+    m = _TRIAGE_PATH.match(path)
+    if m:
+        return int(m.group(1))
+    for obj in (body, response):  # /api/triage/start only has it in the response
+        if isinstance(obj, dict) and isinstance(obj.get("triage_id"), int):
+            return obj["triage_id"]
+    return None
+
+# ---------------- Capture ----------------
+
+class CaptureLog:
+    """
+    Append-only NDJSON, one line per request:
+      {"t", "method", "path", "query", "status", "ms", "triage_id", "body", "response"}
+    record() only puts raw bytes on a queue; the writer thread decodes, serializes, appends
+    and rotates (capture-<time>-<n>.ndjson past max_mb, keeping the newest `keep` files).
+    """
+
+    def __init__(self, directory: str, max_mb: float = MAX_FILE_MB, keep: int = KEEP_FILES):
+        self.dir = Path(directory)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.keep = keep
+        self._q: "queue.Queue[Optional[Tuple]]" = queue.Queue(MAX_PENDING)
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._f = None
+        self._size = 0
+        self._files = 0
+        self.path: Optional[Path] = None
+        self.recorded = 0
+        self.dropped = 0
+        self.rotations = 0
+
+    def record(self, wall: float, method: str, path: str, query: str, status: int, ms: float,
+               body: bytes, response: Optional[bytes]) -> None:
+        try:
+            self._q.put_nowait((wall, method, path, query, status, ms, body, response))
+        except queue.Full:
+            self.dropped += 1
+
+    # ---------------- Writer ----------------
+
+    def _open(self) -> None:
+        if self._f is not None:
+            self._f.close()
+            self.rotations += 1
+        self._files += 1
+        self.path = self.dir / f"capture-{time.strftime('%Y%m%d-%H%M%S')}-{self._files:04d}.ndjson"
+        self._f = open(self.path, "ab")
+        self._size = self._f.tell()
+        old = sorted(self.dir.glob("capture-*.ndjson"))[:-self.keep] if self.keep else []
+        for p in old:
+            try:
+                p.unlink()
+            except OSError as e:
+                print(f"Could not remove old capture file {p}: {e}")
+
+    def _line(self, item) -> bytes:
+        wall, method, path, query, status, ms, body, response = item
+        body, response = _decode(body), _decode(response) if response is not None else None
+        return _dumps({
+            "t": round(wall, 6), "method": method, "path": path, "query": query,
+            "status": status, "ms": round(ms, 3), "triage_id": _triage_id(path, body, response),
+            "body": body, "response": response,
+        }) + b"\n"
+
+    def _write(self, batch: List) -> None:
+        data = bytearray()
+        for item in batch:
+            try:
+                data += self._line(item)
+            except Exception as e:
+                print(f"Could not serialize captured {item[1]} {item[2]}: {e}")
+        if self._f is None or self._size >= self.max_bytes:
+            self._open()
+        self._f.write(data)
+        self._f.flush()
+        self._size += len(data)
+        self.recorded += len(batch)
+
+    def _loop(self):
+        while True:
+            first = self._q.get()
+            batch, stopping = ([] if first is None else [first]), first is None
+            while not stopping and len(batch) < 512:
+                try:
+                    item = self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    print(f"Error writing {len(batch)} captured requests: {e}")
+            if stopping:
+                if self._f is not None:
+                    self._f.close()
+                    self._f = None
+                return
+
+    def start(self) -> "CaptureLog":
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name="request-capture", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """ Write whatever is queued, then close the file. """
+        with self._lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                return
+        self._q.put(None)
+        thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "file": str(self.path) if self.path else None,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "pending": self._q.qsize(),
+            "rotations": self.rotations,
+        }
+
+class RequestCaptureMiddleware:
+    """
+    Plain ASGI middleware (no BaseHTTPMiddleware: it would buffer every response through a
+    second task). Tees the request body and the response as they pass through; timing runs
+    from the first byte in to the last byte out.
+    """
+
+    def __init__(self, app, log: CaptureLog):
+        self.app = app
+        self.log = log
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or not path.startswith(CAPTURE_PREFIXES) or path in SKIP_PATHS:
+            return await self.app(scope, receive, send)
+
+        wall, t0 = time.time(), time.perf_counter()
+        body, out, status = bytearray(), bytearray(), [500]
+
+        async def _receive():
+            msg = await receive()
+            if msg["type"] == "http.request":
+                body.extend(msg.get("body", b""))
+            return msg
+
+        async def _send(msg):
+            if msg["type"] == "http.response.start":
+                status[0] = msg["status"]
+            elif msg["type"] == "http.response.body" and len(out) <= MAX_RESPONSE_BYTES:
+                out.extend(msg.get("body", b""))
+            await send(msg)
+
+        try:
+            await self.app(scope, _receive, _send)
+        finally:
+            ms = (time.perf_counter() - t0) * 1e3
+            self.log.record(wall, scope["method"], path, scope.get("query_string", b"").decode("latin-1"),
+                            status[0], ms, bytes(body), bytes(out) if len(out) <= MAX_RESPONSE_BYTES else None)
+
+# ---------------- Replay ----------------
+
+IGNORE_KEYS = ("created_date", "epic_sent_date")  # wall-clock values that never replay the same
+
+def load_capture(paths: List[str]) -> List[Dict[str, Any]]:
+    records = []
+    for p in paths:
+        with open(p, "rb") as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda r: r["t"])
+    return records
+
+class _IdMap:
+    """ Captured triage/client ids <-> the ids the replayed app hands out for the same /api/triage/start. """
+
+    def __init__(self):
+        self.triage: Dict[int, int] = {}
+        self.client: Dict[int, int] = {}
+
+    def forward(self, rec: Dict[str, Any]) -> Tuple[str, Any]:
+        path, body = rec["path"], rec["body"]
+        m = _TRIAGE_PATH.match(path)
+        if m:
+            path = f"/api/triages/{self.triage.get(int(m.group(1)), m.group(1))}"
+        if isinstance(body, dict) and body.get("triage_id") in self.triage:
+            body = {**body, "triage_id": self.triage[body["triage_id"]]}
+        return path, body
+
+    def learn(self, rec: Dict[str, Any], got: Any) -> None:
+        want = rec.get("response")
+        if rec["path"] == "/api/triage/start" and isinstance(want, dict) and isinstance(got, dict):
+            for key, ids in (("triage_id", self.triage), ("client_id", self.client)):
+                if key in want and key in got:
+                    ids[want[key]] = got[key]
+
+    def backward(self, obj: Any, key: Optional[str] = None) -> Any:
+        """ A replayed response with its ids translated back to the captured ones. """
+        if isinstance(obj, dict):
+            return {k: self.backward(v, k) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [self.backward(v, key) for v in obj]
+        ids = self.triage if key in ("triage_id", "id") else self.client if key == "client_id" else None
+        if ids and isinstance(obj, int):
+            back = {v: k for k, v in ids.items()}
+            return back.get(obj, obj)
+        if ids and isinstance(obj, str) and obj.isdigit():
+            back = {str(v): str(k) for k, v in ids.items()}
+            return back.get(obj, obj)
+        return obj
+
+def _strip(obj: Any, ignore: Tuple[str, ...]) -> Any:
+    if isinstance(obj, dict):
+        return {k: _strip(v, ignore) for k, v in obj.items() if k not in ignore}
+    if isinstance(obj, list):
+        return [_strip(v, ignore) for v in obj]
+    return obj
+
+def _first_diff(a: Any, b: Any, where: str = "") -> str:
+    if isinstance(a, dict) and isinstance(b, dict):
+        for k in sorted(set(a) | set(b), key=str):
+            if a.get(k, "<missing>") != b.get(k, "<missing>"):
+                return _first_diff(a.get(k, "<missing>"), b.get(k, "<missing>"), f"{where}.{k}")
+    if isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            return f"{where or '.'}: {len(a)} items captured, {len(b)} replayed"
+        for i, (x, y) in enumerate(zip(a, b)):
+            if x != y:
+                return _first_diff(x, y, f"{where}[{i}]")
+    return f"{where or '.'}: captured {str(a)[:80]!r}, replayed {str(b)[:80]!r}"
+
+def replay(records: List[Dict[str, Any]], base_url: str, speed: float = 1.0,
+           ignore: Tuple[str, ...] = IGNORE_KEYS, workers: int = 32) -> List[Dict[str, Any]]:
+    """
+    Re-issue captured requests against base_url. speed=1 keeps the original gaps, speed=10 is
+    ten times faster, speed=0 drops them. Whatever the speed, a request is only sent once every
+    request that had already answered when it was captured has answered again: requests that
+    overlapped still overlap, the rest keep their order (the model state is one conversation
+    at a time, and later turns need the new triage_id). One result per record:
+    {"rec", "status", "ms", "same", "diff"}.
+    """
+    import http.client
+    from concurrent.futures import ThreadPoolExecutor
+    from urllib.parse import urlsplit
+
+    url = urlsplit(base_url)
+    ids = _IdMap()
+    local = threading.local()
+    results: List[Optional[Dict[str, Any]]] = [None] * len(records)
+
+    def _conn() -> "http.client.HTTPConnection":
+        if getattr(local, "conn", None) is None:
+            local.conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+        return local.conn
+
+    def _issue(rec) -> Tuple[int, float, bytes]:
+        path, body = ids.forward(rec)
+        target = path + (f"?{rec['query']}" if rec["query"] else "")
+        payload = json.dumps(body).encode() if isinstance(body, (dict, list)) else (body or "").encode()
+        headers = {"Content-Type": "application/json"} if payload else {}
+        for attempt in (0, 1):  # once more on a dropped keep-alive connection
+            try:
+                conn = _conn()
+                t0 = time.perf_counter()
+                conn.request(rec["method"], target, body=payload or None, headers=headers)
+                resp = conn.getresponse()
+                raw = resp.read()
+                return resp.status, (time.perf_counter() - t0) * 1e3, raw
+            except (http.client.HTTPException, ConnectionError):
+                local.conn = None
+                if attempt:
+                    raise
+
+    def _run(i: int, rec) -> None:
+        try:
+            status, ms, raw = _issue(rec)
+            got = _decode(raw)
+        except Exception as e:
+            results[i] = {"rec": rec, "status": 0, "ms": None, "same": False, "diff": f"request failed: {e}"}
+            return
+        ids.learn(rec, got)
+        want = _strip(rec.get("response"), ignore)
+        mine = _strip(ids.backward(got), ignore)
+        same = status == rec["status"] and (rec.get("response") is None or want == mine)
+        diff = None if same else (f"status {rec['status']} -> {status}" if status != rec["status"]
+                                  else _first_diff(want, mine))
+        results[i] = {"rec": rec, "status": status, "ms": ms, "same": same, "diff": diff}
+
+    in_flight: List[Tuple[float, int, Any]] = []  # heap of (captured end time, index, future)
+    t_first = records[0]["t"] if records else 0.0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="replay") as pool:
+        for i, rec in enumerate(records):
+            while in_flight and in_flight[0][0] <= rec["t"]:
+                heapq.heappop(in_flight)[2].result()
+            if speed > 0:
+                wait = (rec["t"] - t_first) / speed - (time.perf_counter() - start)
+                if wait > 0:
+                    time.sleep(wait)
+            heapq.heappush(in_flight, (rec["t"] + rec["ms"] / 1e3, i, pool.submit(_run, i, rec)))
+    return [r for r in results if r is not None]
+
+def report(results: List[Dict[str, Any]], show: int = 5) -> int:
+    """ Per-endpoint latency, captured vs replayed, and the responses that differ. Returns the mismatch count. """
+    import numpy as np
+
+    def _endpoint(rec) -> str:
+        return f"{rec['method']} {_TRIAGE_PATH.sub('/api/triages/{id}', rec['path'])}"
+
+    by: Dict[str, List] = {}
+    for r in results:
+        by.setdefault(_endpoint(r["rec"]), []).append(r)
+    print(f"{'endpoint':<34} {'n':>6} {'captured p50/p95 ms':>22} {'replayed p50/p95 ms':>22} {'differ':>7}")
+    for name, rs in sorted(by.items()):
+        was = [r["rec"]["ms"] for r in rs]
+        now = [r["ms"] for r in rs if r["ms"] is not None] or [float("nan")]
+        print(f"{name:<34} {len(rs):>6} {np.percentile(was, 50):>10.2f} / {np.percentile(was, 95):<9.2f} "
+              f"{np.percentile(now, 50):>10.2f} / {np.percentile(now, 95):<9.2f} {sum(not r['same'] for r in rs):>7}")
+    bad = [r for r in results if not r["same"]]
+    for r in bad[:show]:
+        print(f"  {_endpoint(r['rec'])} (triage {r['rec']['triage_id']}): {r['diff']}")
+    print(f"{len(results)} requests replayed, {len(bad)} responses differ")
+    return len(bad)
+
+
+if __name__ == "__main__":
+    import argparse
+    import atexit
+    import shutil
+    import socket
+    import tempfile
+
+    ap = argparse.ArgumentParser(description="Replay captured triage API traffic and compare latency + responses.")
+    ap.add_argument("files", nargs="+", help="capture-*.ndjson files (LUNARA_CAPTURE_DIR)")
+    ap.add_argument("--url", help="a running app; default: start one on a throwaway DB")
+    ap.add_argument("--speed", type=float, default=1.0, help="1 = original pace, 10 = ten times faster, 0 = no gaps")
+    ap.add_argument("--ignore", default=",".join(IGNORE_KEYS), help="response keys left out of the comparison")
+    ap.add_argument("--show", type=int, default=5, help="differing responses to print")
+    args = ap.parse_args()
+
+    records = load_capture(args.files)
+    if not records:
+        raise SystemExit("No captured requests")
+    url = args.url
+    if url is None:
+        # Fresh DB, so ids and dashboard pages line up with a capture that also started from empty
+        tmp = tempfile.mkdtemp(prefix="lunara_replay_")
+        atexit.register(shutil.rmtree, tmp, True)
+        os.environ["LUNARA_DB_PATH"] = os.path.join(tmp, "replay.db")
+        for var in ("LUNARA_EPIC_SINK", "LUNARA_ARCHIVE_AFTER_DAYS", "LUNARA_CAPTURE_DIR"):
+            os.environ.pop(var, None)
+        import uvicorn
+        import app
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        server = uvicorn.Server(uvicorn.Config(app.app, host="127.0.0.1", port=port, log_level="warning"))
+        threading.Thread(target=server.run, daemon=True).start()
+        while not server.started:
+            time.sleep(0.05)
+        url = f"http://127.0.0.1:{port}"
+
+    span = records[-1]["t"] - records[0]["t"]
+    print(f"{len(records)} captured requests over {span:.1f}s -> {url} at "
+          + (f"{args.speed:g}x" if args.speed > 0 else "full speed"))
+    ignore = tuple(k for k in args.ignore.split(",") if k)
+    raise SystemExit(1 if report(replay(records, url, args.speed, ignore), args.show) else 0)
@@ -0,0 +1,272 @@
+# backend/speculative.py
+''' Speculative next turn: precompute the yes / no / skip branches while the agent reads the question aloud '''
+# Parity: tests/test_speculative.py; parity + latency from the CLI (repo root, needs sgd_softmax_best.joblib): python -m backend.speculative
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from backend.model_bundle import current_bundle
+from backend.model_inference import apply_answer, default_state_dir, load_state, rank_turn, save_state
+
+ANSWERS = (1, 0, -1)  # yes, no, skip
+WAIT_S = 5.0  # an answer that lands mid-speculation waits this long for it instead of starting over
+LATENCY_WINDOW = 1000
+
+class _Speculation:
+    """ One conversation's precomputed next turn, valid only for the exact state it was built from. """
+
+    def __init__(self, state: Dict[str, Any], bundle):
+        self.state = state
+        self.bundle = bundle
+        self.cancelled = threading.Event()
+        self.counts = None  # predictor.counts([state['work_str']])
+        self.base = None  # predictor.linear_base(counts); None -> re-run the transform on a hit
+        self.out = None  # bundle.predict_counts(counts, ...), for explaining an exact hit
+        # answer -> (response, state after, next_qid) when the free text is empty
+        self.branches: Dict[int, Tuple[Dict[str, Any], Dict[str, Any], Optional[int]]] = {}
+        self.future = None
+
+class SpeculativeExecutor:
+    """
+    After each turn the pending question is known, so while it is read aloud one background
+    worker vectorizes the transcript (raw counts, kept) and ranks all three possible answers.
+    When /api/triage/answer arrives:
+      - no free text: the matching branch is the response (exact hit)
+      - free text: only a short tail is re-counted; for a linear model the changed columns are
+        merged into the kept raw scores (otherwise the merged counts go through the model once),
+        then the branch ranking (delta hit)
+      - state moved on, bundle swapped, or a tail that can't be merged safely: plain turn (miss)
+    Exact hits and misses return exactly what inference() would; delta hits agree up to float
+    rounding in the probabilities.
+    """
+
+    def __init__(self, workers: int = 1, enabled: bool = True):
+        self.enabled = enabled
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="speculate")
+        self._lock = threading.Lock()
+        self._pending: Dict[str, _Speculation] = {}
+        self.counts = dict(scheduled=0, cancelled=0, waited=0, exact=0, delta=0,
+                           miss_none=0, miss_stale=0, miss_unsafe=0)
+        self._ms = {"hit": deque(maxlen=LATENCY_WINDOW), "miss": deque(maxlen=LATENCY_WINDOW)}
+
+    @staticmethod
+    def _key(state_dir: Path) -> str:
+        return str(state_dir.resolve())
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    # ---------------- Background work ----------------
+
+    def _schedule(self, key: str, state: Dict[str, Any], bundle) -> None:
+        spec = _Speculation(state, bundle)
+        with self._lock:
+            old = self._pending.pop(key, None)
+            self._pending[key] = spec
+            self.counts["scheduled"] += 1
+        if old is not None:
+            old.cancelled.set()
+        spec.future = self._pool.submit(self._run, spec)
+
+    @staticmethod
+    def _run(spec: _Speculation) -> None:
+        if spec.cancelled.is_set():
+            return
+        text = spec.state["work_str"]
+        spec.counts = spec.bundle.predictor.counts([text])
+        spec.base = spec.bundle.predictor.linear_base(spec.counts)
+        out = spec.out = spec.bundle.predict_counts(spec.counts, text, k=6)
+        for ans in ANSWERS:
+            if spec.cancelled.is_set():
+                return
+            after = apply_answer(spec.state, ans)
+            ret, next_qid = rank_turn(spec.bundle, out, after)
+            spec.branches[ans] = (ret, after, next_qid)
+
+    def cancel(self, state_dir=None) -> bool:
+        """ Drop a conversation's speculation (session ended or restarted). """
+        key = self._key(Path(state_dir) if state_dir is not None else default_state_dir())
+        with self._lock:
+            spec = self._pending.pop(key, None)
+            if spec is not None:
+                self.counts["cancelled"] += 1
+        if spec is None:
+            return False
+        spec.cancelled.set()
+        if spec.future is not None:
+            spec.future.cancel()
+        return True
+
+    def wait(self, state_dir=None, timeout: float = WAIT_S) -> None:
+        """ Block until the conversation's speculation (if any) has finished. """
+        key = self._key(Path(state_dir) if state_dir is not None else default_state_dir())
+        with self._lock:
+            spec = self._pending.get(key)
+        if spec is not None and spec.future is not None:
+            spec.future.result(timeout)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            pending, self._pending = list(self._pending.values()), {}
+        for spec in pending:
+            spec.cancelled.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    # ---------------- Answer path ----------------
+
+    def _from_speculation(self, spec: _Speculation, state, bundle, user_text: str, last_ans, explain: bool = False):
+        if spec.future is not None and not spec.future.done():
+            self._count("waited")
+            try:
+                spec.future.result(WAIT_S)
+            except Exception as e:
+                print(f"Speculation failed: {e}")
+        if (spec.cancelled.is_set() or len(spec.branches) < len(ANSWERS)
+                or spec.bundle is not bundle or spec.state != state):
+            return "miss_stale", None
+        if user_text == "":
+            ret, after, next_qid = spec.branches[last_ans if last_ans in (0, 1) else -1]
+            if explain:
+                # same transcript as the speculation: its counts, re-weighted, are the scored row
+                X = bundle.predictor._tfidf(spec.counts)
+                ret = {**ret, "explanation": bundle.explain(X, spec.out["topk"])}
+            return "exact", (ret, after, next_qid)
+        delta = bundle.predictor.count_delta(state["work_str"], user_text)
+        if delta is None:
+            return "miss_unsafe", None
+        after = apply_answer(state, last_ans, user_text)
+        if spec.base is not None:
+            out = bundle.predict_delta(spec.base, delta, after["work_str"], k=6, explain=explain)
+        else:
+            counts = bundle.predictor.add_delta(spec.counts, delta)
+            out = bundle.predict_counts(counts, after["work_str"], k=6, explain=explain)
+        ret, next_qid = rank_turn(bundle, out, after)
+        return "delta", (ret, after, next_qid)
+
+    def answer(self, user_text: str = "", last_ans: int = -1, state_dir=None, explain: bool = False) -> Dict[str, Any]:
+        """ One answered turn: same response and state files as inference(user_text, last_ans=..., explain=...). """
+        t0 = time.perf_counter()
+        state_dir = Path(state_dir) if state_dir is not None else default_state_dir()
+        key = self._key(state_dir)
+        with self._lock:
+            spec = self._pending.pop(key, None)
+
+        bundle = current_bundle()
+        state = load_state(state_dir)
+        kind, turn = ("miss_none", None) if spec is None else self._from_speculation(
+            spec, state, bundle, user_text, last_ans, explain)
+        if turn is None:
+            after = apply_answer(state, last_ans, user_text)
+            ret, next_qid = rank_turn(bundle, bundle.predict(after["work_str"], k=6, explain=explain), after)
+        else:
+            ret, after, next_qid = turn
+        save_state(state_dir, after, next_qid)
+
+        if self.enabled and next_qid is not None and bundle.predictor is not None:
+            # exactly what load_state() will return on the next turn; best effort, since the turn is
+            # already saved and the caller must not see it as failed (e.g. pool shut down)
+            try:
+                self._schedule(key, {**after, "last_qid": next_qid}, bundle)
+            except Exception as e:
+                print(f"Speculation not scheduled: {e}")
+        with self._lock:
+            self.counts[kind] += 1
+            self._ms["miss" if kind.startswith("miss") else "hit"].append((time.perf_counter() - t0) * 1e3)
+        return ret
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            c = dict(self.counts)
+            hit_ms, miss_ms = list(self._ms["hit"]), list(self._ms["miss"])
+            pending = len(self._pending)
+        hits = c["exact"] + c["delta"]
+        answered = hits + c["miss_none"] + c["miss_stale"] + c["miss_unsafe"]
+        return {
+            "enabled": self.enabled,
+            **c,
+            "pending": pending,
+            "hit_rate": round(hits / answered, 4) if answered else None,
+            "answer_ms_p50_hit": round(float(np.percentile(hit_ms, 50)), 2) if hit_ms else None,
+            "answer_ms_p50_miss": round(float(np.percentile(miss_ms, 50)), 2) if miss_ms else None,
+        }
+
+# LUNARA_SPECULATE=0 turns the background work off (answers then always take the plain path)
+speculator = SpeculativeExecutor(enabled=os.getenv("LUNARA_SPECULATE", "1") != "0")
+
+
+if __name__ == "__main__":
+    import argparse
+    import contextlib
+    import io
+    import random
+    import shutil
+    import tempfile
+    import warnings
+
+    import pandas as pd
+    from joblib import load
+
+    from backend.model_inference import inference
+
+    warnings.filterwarnings("ignore", message="Trying to unpickle estimator")
+    ap = argparse.ArgumentParser(description="Check speculative turns against inference() and time both.")
+    ap.add_argument("--conversations", type=int, default=200)
+    ap.add_argument("--turns", type=int, default=8)
+    ap.add_argument("--ramble", type=int, default=4, help="training utterances joined into each opening statement")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--explain", action="store_true", help="ask both paths for explanations too")
+    args = ap.parse_args()
+
+    texts = pd.read_csv(Path(__file__).resolve().parent / "data" / "training_dataset.csv")["user_input"].tolist()
+    rng = random.Random(args.seed)
+    # what the agent UI sends (see AgentTriage.jsx) plus joins that stress the tail merge
+    free_texts = ["", "", "yes - ", "no - ", "skip - ", "yes - started last week", " ", "  \n",
+                  "ful", "-ish pain", "3 days", "pelvic  pain", "naïve", "\tspotting"]
+    root = tempfile.mkdtemp(prefix="lunara_spec_")
+    spec = SpeculativeExecutor()
+    plain_ms, spec_ms, mismatches, turns = [], [], 0, 0
+    try:
+        for n in range(args.conversations):
+            a, b = Path(root) / f"plain{n}", Path(root) / f"spec{n}"
+            a.mkdir(), b.mkdir()
+            opening = " ".join(rng.sample(texts, args.ramble))
+            with contextlib.redirect_stdout(io.StringIO()):
+                inference(first_call=True, state_dir=a)
+                inference(first_call=True, state_dir=b)
+                inference(user_text=opening, state_dir=a)
+                spec.answer(user_text=opening, state_dir=b)
+                for _ in range(args.turns):
+                    text, ans = rng.choice(free_texts), rng.choice(ANSWERS)
+                    spec.wait(b)  # the agent reading the question aloud
+                    t0 = time.perf_counter()
+                    want = inference(user_text=text, last_ans=ans, state_dir=a, explain=args.explain)
+                    t1 = time.perf_counter()
+                    got = spec.answer(user_text=text, last_ans=ans, state_dir=b, explain=args.explain)
+                    t2 = time.perf_counter()
+                    plain_ms.append((t1 - t0) * 1e3)
+                    spec_ms.append((t2 - t1) * 1e3)
+                    turns += 1
+                    same = got == want and all(load(a / f) == load(b / f) for f in
+                                               ("work.str", "null.idx", "sclr.idx", "dont.ask", "last.qid", "iter.cnt"))
+                    mismatches += not same
+                    if want["question"].startswith("Thank you"):
+                        break
+            spec.cancel(b)
+    finally:
+        spec.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+
+    s = spec.stats()
+    print(f"{turns} answered turns, {mismatches} differ from inference()")
+    print(f"exact {s['exact']}, delta {s['delta']}, misses: unsafe tail {s['miss_unsafe']}, "
+          f"stale {s['miss_stale']}, none {s['miss_none']} (opening statements) -> hit rate {s['hit_rate']}")
+    for name, ms in (("inference()", plain_ms), ("speculative", spec_ms)):
+        print(f"{name:>12}: p50 {np.percentile(ms, 50):.2f} ms, p95 {np.percentile(ms, 95):.2f} ms")
+    raise SystemExit(1 if mismatches else 0)
@@ -0,0 +1,124 @@
+# backend/stopping.py
+''' When to stop asking: posterior confidence, margin over the runner-up, or a turn budget '''
+# Sweep (repo root, needs sgd_softmax_best.joblib): python -m backend.stopping --max-turns 15
+import os
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+def _env_float(name: str) -> Optional[float]:
+    spec = os.getenv(name, "").strip()
+    return float(spec) if spec else None
+
+class StoppingPolicy:
+    """
+    Checked once per answered turn against the calibrated subspecialty posterior. Any one
+    configured rule ends the conversation:
+      confidence: top subspecialty >= confidence
+      margin:     top - runner-up >= margin
+      max_turns:  this many questions answered
+    confidence / margin only apply from min_turns on. Nothing configured -> ask until the
+    question bank runs out (the old behaviour).
+    """
+
+    def __init__(self, confidence: Optional[float] = None, margin: Optional[float] = None,
+                 max_turns: Optional[int] = None, min_turns: int = 0):
+        self.confidence = confidence
+        self.margin = margin
+        self.max_turns = max_turns
+        self.min_turns = min_turns
+
+    @classmethod
+    def from_env(cls) -> "StoppingPolicy":
+        """ LUNARA_STOP_CONFIDENCE, LUNARA_STOP_MARGIN, LUNARA_STOP_MAX_TURNS, LUNARA_STOP_MIN_TURNS; unset -> off. """
+        max_turns = _env_float("LUNARA_STOP_MAX_TURNS")
+        return cls(
+            confidence=_env_float("LUNARA_STOP_CONFIDENCE"),
+            margin=_env_float("LUNARA_STOP_MARGIN"),
+            max_turns=int(max_turns) if max_turns is not None else None,
+            min_turns=int(_env_float("LUNARA_STOP_MIN_TURNS") or 0),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.confidence is not None or self.margin is not None or self.max_turns is not None
+
+    def reason(self, posterior: np.ndarray, turns: int) -> Optional[str]:
+        """ Why the conversation is done after `turns` answered questions, or None to keep asking. """
+        if self.max_turns is not None and turns >= self.max_turns:
+            return "max_turns"
+        if turns < self.min_turns or (self.confidence is None and self.margin is None):
+            return None
+        top2 = np.sort(np.asarray(posterior, dtype=float))[::-1][:2]
+        if self.confidence is not None and top2[0] >= self.confidence:
+            return "confidence"
+        if self.margin is not None and len(top2) > 1 and top2[0] - top2[1] >= self.margin:
+            return "margin"
+        return None
+
+    def describe(self) -> str:
+        parts = [f"{name}={getattr(self, name)}" for name in ("confidence", "margin", "max_turns")
+                 if getattr(self, name) is not None]
+        if parts and self.min_turns:
+            parts.append(f"min_turns={self.min_turns}")
+        return ", ".join(parts) or "off"
+
+stopping_policy = StoppingPolicy.from_env()
+
+# ---------------- Offline sweep ----------------
+
+def stop_turn(policy: StoppingPolicy, top2_by_turn: List[List[float]]) -> int:
+    """ The turn a recorded conversation would have ended on under policy (its last one if never). """
+    for t, top2 in enumerate(top2_by_turn):
+        if policy.reason(np.asarray(top2), t) is not None:
+            return t
+    return len(top2_by_turn) - 1
+
+def evaluate(policy: StoppingPolicy, runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """ Questions asked and top-1 accuracy at the stop, over eval_triage runs recorded without stopping. """
+    stops = [stop_turn(policy, r["top2_by_turn"]) for r in runs]
+    hits = [r["top1_by_turn"][s] == r["target_subspecialty"] for r, s in zip(runs, stops)]
+    return {
+        "policy": policy.describe(),
+        "mean_turns": round(float(np.mean(stops)), 3),
+        "accuracy": round(float(np.mean(hits)), 4),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Replay training_dataset.csv once without stopping, then score stopping policies.")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--max-turns", type=int, default=15, help="horizon of the recorded conversations")
+    ap.add_argument("--limit", type=int, default=None, help="only the first N utterances")
+    ap.add_argument("--confidence", default="0.6,0.7,0.8,0.9,0.95")
+    ap.add_argument("--margin", default="0.3,0.5,0.7")
+    ap.add_argument("--turns", default="3,5,8")
+    ap.add_argument("--min-turns", type=int, default=0)
+    args = ap.parse_args()
+
+    # the recording must run to the horizon; workers inherit this environment
+    for var in ("LUNARA_STOP_CONFIDENCE", "LUNARA_STOP_MARGIN", "LUNARA_STOP_MAX_TURNS", "LUNARA_STOP_MIN_TURNS"):
+        os.environ.pop(var, None)
+
+    from backend.eval_triage import run
+    report = run(args.workers, args.max_turns, args.limit)
+    runs = report["runs"]
+    base = evaluate(StoppingPolicy(max_turns=args.max_turns), runs)
+
+    def _floats(spec: str) -> List[float]:
+        return [float(x) for x in spec.split(",") if x.strip()]
+
+    policies = [StoppingPolicy(confidence=c, min_turns=args.min_turns) for c in _floats(args.confidence)]
+    policies += [StoppingPolicy(margin=m, min_turns=args.min_turns) for m in _floats(args.margin)]
+    policies += [StoppingPolicy(max_turns=int(t)) for t in _floats(args.turns)]
+    policies += [StoppingPolicy(confidence=c, max_turns=int(t), min_turns=args.min_turns)
+                 for c in _floats(args.confidence)[-2:] for t in _floats(args.turns)[-1:]]
+
+    print(f"{len(runs)} conversations recorded to {args.max_turns} turns in {report['summary']['wall_s']}s")
+    print(f"{'policy':<40} {'turns':>7} {'saved':>7} {'top-1 acc':>10} {'vs full':>8}")
+    for res in [base] + [evaluate(p, runs) for p in policies]:
+        saved = 1 - res["mean_turns"] / base["mean_turns"] if base["mean_turns"] else 0.0
+        print(f"{res['policy']:<40} {res['mean_turns']:>7.2f} {saved:>7.1%} {res['accuracy']:>10.4f} "
+              f"{res['accuracy'] - base['accuracy']:>+8.4f}")
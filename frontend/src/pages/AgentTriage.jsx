@@ -139,6 +139,7 @@ export default function AgentTriage() {
           question: currentQuestion,
           answer: freeText || (typeof answer === 'string' ? answer : String(answer ?? '')),
           last_ans, // <-- CRITICAL
+          turn_number: questionHistory.length + 1, // same turn on retry -> server replays its answer
         }),
       });
       if (!res.ok) throw new Error(`answer ${res.status}`);
@@ -160,6 +161,9 @@ export default function AgentTriage() {
       );
 
       setDoctorMatches((data.doctor_results ?? []).map(d => ({ label: d.rank, name: d.name })));
+
+      // the backend has enough to recommend (or ran out of questions): go straight to wrap-up
+      if (data.done) handleEndConversation();
     } catch (e) {
       console.error(e);
       alert("Error processing answer. Please try again.");
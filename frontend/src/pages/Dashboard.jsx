@@ -27,7 +27,7 @@ export default function Dashboard() {
         // Use the Vite proxy (relative URL). If you insist on env, keep it but default to ''.
         // const API = import.meta.env.VITE_API_URL ?? '';
         // const response = await fetch(`${API}/api/triages?page=1&page_size=20`);
-        const response = await fetch(`/api/triages?page=1&page_size=20`);
+        const response = await fetch(`/api/triages?page=1&page_size=20&include=conversation`);
         if (!response.ok) throw new Error(`Failed to load cases (${response.status})`);
 
         const data = await response.json();
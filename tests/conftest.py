@@ -0,0 +1,8 @@
+# tests/conftest.py
+''' Make `backend` importable when pytest is run from anywhere, not just `python -m pytest` at the repo root '''
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
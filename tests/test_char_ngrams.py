@@ -0,0 +1,54 @@
+# tests/test_char_ngrams.py
+''' FastCharTfidf against the fitted tfidf_char.joblib it replaces: same indices, same values '''
+import warnings
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from backend.char_ngrams import FastCharTfidf
+
+BACKEND_DIR = Path(__file__).resolve().parents[1] / "backend"
+CHAR_PATH = BACKEND_DIR / "model" / "tfidf_char.joblib"
+
+pytestmark = pytest.mark.skipif(not CHAR_PATH.exists(), reason="tfidf_char.joblib not present")
+
+@pytest.fixture(scope="module")
+def vectorizers():
+    from joblib import load
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message="Trying to unpickle estimator")
+        v_char = load(CHAR_PATH)
+    fast = FastCharTfidf.from_vectorizer(v_char)
+    assert fast is not None, "tfidf_char.joblib uses options FastCharTfidf doesn't replay"
+    return v_char, fast
+
+@pytest.fixture(scope="module")
+def texts():
+    import pandas as pd
+    return pd.read_csv(BACKEND_DIR / "data" / "training_dataset.csv")["user_input"].astype(str).tolist()
+
+def assert_same(v_char, fast, batch):
+    want, got = v_char.transform(batch).tocsr(), fast.transform(batch)
+    want.sort_indices(), got.sort_indices()
+    assert np.array_equal(want.indptr, got.indptr)
+    assert np.array_equal(want.indices, got.indices)
+    if want.nnz:
+        assert np.abs(want.data - got.data).max() <= 1e-12
+
+def test_training_dataset_batched(vectorizers, texts):
+    assert_same(*vectorizers, texts)
+
+def test_training_dataset_one_utterance_at_a_time(vectorizers, texts):
+    # the request path transforms a single document per call
+    for text in texts:
+        assert_same(*vectorizers, [text])
+
+def test_long_transcripts(vectorizers, texts):
+    # inference() grows work_str turn after turn
+    assert_same(*vectorizers, [" ".join(texts[i:i + 40]) for i in range(0, len(texts), 40)])
+
+@pytest.mark.parametrize("text", ["", "ab", "abc", "A\t\tB  c\n\nd", "naïve café ✓ 𝄞𝄞𝄞", "?" * 7,
+                                  "Pap  SMEAR\u00a0\u00a0pain"])
+def test_edge_cases(vectorizers, text):
+    assert_same(*vectorizers, [text])
@@ -0,0 +1,26 @@
+# tests/test_convert_date.py
+''' Tiered, cached DOB parsing returns exactly what the explicit formats + dateutil path returns '''
+import pytest
+
+from backend.queries.utils import convert_date_overkill as cdo
+
+EDGE_CASES = [
+    "", "   ", "not a date", "01/02/2003", "13/01/1990", "2003-02-30", "Feb 29 2001", "Feb 29 2000",
+    "31 December 1999", "Sept 3 1990", "3 sept 1990", " 7/4/76 ", "07.04.1976", "1976.07.04",
+    "2030-01-01", "1899-12-31", "1700000000", "04/05/06", "1990/7/4", "July 4th 1976", "4-Jul-1976",
+]
+
+@pytest.mark.parametrize("prefer", ["US", "EU"])
+@pytest.mark.parametrize("context", ["dob", "generic"])
+def test_edge_cases_match_reference(context, prefer):
+    for s in EDGE_CASES:
+        want = cdo._parse_date_all_uncached(s, context=context, prefer=prefer)
+        assert cdo.parse_date_all(s, context=context, prefer=prefer) == want, s
+
+def test_mixed_corpus_matches_reference():
+    corpus = cdo._make_corpus(5000)
+    want = [cdo._parse_date_all_uncached(s) for s in corpus]
+    cdo._parse_cached.cache_clear()
+    assert cdo.parse_many(corpus) == want
+    # second pass is served from the cache and must not differ either
+    assert cdo.parse_many(corpus) == want
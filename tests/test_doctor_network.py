@@ -0,0 +1,76 @@
+# tests/test_doctor_network.py
+''' In-network doctor mask built from doctor_insurance, and ranking in-network doctors first '''
+import random
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend import db
+from backend.model_bundle import DATA_DIR
+from backend.model_inference import topk_indices
+from backend.queries.doctor_network import DoctorNetwork, _name_key, rank_in_network_first
+
+PLANS = 30
+
+class _Bundle:
+    bundle_id = "test"
+    doc_names = pd.read_csv(DATA_DIR / "doc_sspec_map.csv").values
+
+@pytest.fixture(scope="module")
+def networks(tmp_path_factory):
+    """ A throwaway database with random plan networks over the model's doctors; yields the expected mask. """
+    old = db.DB_PATH
+    db.DB_PATH = str(tmp_path_factory.mktemp("network") / "network.db")
+    try:
+        db.init_db()
+        rng = random.Random(0)
+        n_docs = len(_Bundle.doc_names)
+        conn = db.get_connection()
+        conn.executemany("INSERT INTO insurance (ins_pol) VALUES (?);", [(f"plan{i}",) for i in range(PLANS)])
+        for name in _Bundle.doc_names[:, 1]:
+            parts = _name_key(str(name)).split()
+            conn.execute("INSERT INTO doctor (doc_fn, doc_ln) VALUES (?, ?);", (" ".join(parts[:-1]), parts[-1]))
+        want = np.zeros((PLANS + 1, n_docs), dtype=bool)
+        for ins in range(1, PLANS + 1):
+            for col in rng.sample(range(n_docs), rng.randint(1, n_docs)):
+                conn.execute("INSERT INTO doctor_insurance (doc_id, ins_id) VALUES (?, ?);", (col + 1, ins))
+                want[ins, col] = True
+        conn.commit()
+        conn.close()
+        yield want
+    finally:
+        db.DB_PATH = old
+
+def test_mask_matches_doctor_insurance(networks):
+    net = DoctorNetwork()
+    for ins in range(1, PLANS + 1):
+        assert np.array_equal(net.eligible(_Bundle, ins), networks[ins]), ins
+    assert net.stats() == {"bundles": 1, "plans": PLANS, "in_network_pairs": int(networks.sum())}
+
+def test_no_plan_or_unknown_plan_ranks_everyone(networks):
+    net = DoctorNetwork()
+    assert net.eligible(_Bundle, None) is None
+    assert net.eligible(_Bundle, 10 ** 6) is None
+    doc_sum = np.arange(5.0)
+    assert rank_in_network_first(doc_sum, None) is doc_sum
+
+def test_in_network_doctors_come_first_in_model_order(networks):
+    net = DoctorNetwork()
+    rng = np.random.default_rng(0)
+    n_docs = networks.shape[1]
+    for ins in range(1, PLANS + 1):
+        elig = net.eligible(_Bundle, ins)
+        doc_sum = np.log(rng.random(n_docs) + 1)
+        top = topk_indices(rank_in_network_first(doc_sum, elig), 3)
+        in_net = [c for c in topk_indices(doc_sum, n_docs) if networks[ins, c]]
+        out_net = [c for c in topk_indices(doc_sum, n_docs) if not networks[ins, c]]
+        # a plan with < 3 in-network doctors still fills 3 slots, from the best of the rest
+        assert list(top) == (in_net + out_net)[:3], ins
+
+def test_refresh_rebuilds(networks):
+    net = DoctorNetwork()
+    net.eligible(_Bundle, 1)
+    net.refresh()
+    assert net.stats()["bundles"] == 0
+    assert np.array_equal(net.eligible(_Bundle, 1), networks[1])
@@ -0,0 +1,93 @@
+# tests/test_epic_outbox.py
+''' Epic hand-off: each ended triage is delivered once, failures go back on the backoff '''
+import json
+
+import pytest
+
+from backend import db
+from backend.queries import epic_outbox as eo
+
+@pytest.fixture
+def triages(tmp_path):
+    """ A fresh database with 5 ended triages and 1 still in progress; yields the ended ids. """
+    old = db.DB_PATH
+    db.DB_PATH = str(tmp_path / "epic.db")
+    try:
+        db.init_db()
+        conn = db.get_connection()
+        conn.executemany("INSERT INTO client (client_fn, client_ln, client_dob) VALUES (?, ?, ?);",
+                         [(f"fn{i}", f"ln{i}", "1990-01-02") for i in range(6)])
+        conn.executemany("INSERT INTO triage (agent_id, client_id, gob_conf, agent_notes) VALUES (?, ?, ?, ?);",
+                         [(101, i + 1, 50, "notes" if i < 5 else None) for i in range(6)])
+        conn.commit()
+        ended = [r["triage_id"] for r in conn.execute(
+            "SELECT triage_id FROM triage WHERE agent_notes IS NOT NULL ORDER BY triage_id;")]
+        conn.close()
+        yield ended
+    finally:
+        db.DB_PATH = old
+
+def _outbox():
+    conn = db.get_connection()
+    try:
+        return {r["triage_id"]: dict(r) for r in conn.execute("SELECT * FROM epic_outbox;")}
+    finally:
+        conn.close()
+
+def _sent_to_epic():
+    conn = db.get_connection()
+    try:
+        return {r["triage_id"] for r in conn.execute("SELECT triage_id FROM triage WHERE sent_to_epic = 1;")}
+    finally:
+        conn.close()
+
+class FailingSink:
+    def deliver(self, batch):
+        raise RuntimeError("Epic is down")
+
+def test_drain_delivers_each_ended_triage_once(triages, tmp_path):
+    out = tmp_path / "epic.ndjson"
+    assert eo.EpicDispatcher(eo.FileSink(str(out)), batch_size=2).drain() == len(triages)
+    assert eo.EpicDispatcher(eo.FileSink(str(out))).drain() == 0
+    lines = [json.loads(line) for line in out.read_text(encoding="utf-8").splitlines()]
+    assert sorted(line["idempotency_key"] for line in lines) == sorted(eo.idempotency_key(t) for t in triages)
+    assert _sent_to_epic() == set(triages)
+    assert eo.q_outbox_counts() == {"sent": len(triages)}
+
+def test_failed_batch_is_retried_not_marked_sent(triages, tmp_path):
+    dispatcher = eo.EpicDispatcher(FailingSink())
+    assert dispatcher.drain() == 0
+    assert dispatcher.failed_batches == 1
+    rows = _outbox()
+    assert set(rows) == set(triages)
+    for row in rows.values():
+        assert (row["status"], row["attempts"], row["last_error"]) == ("pending", 1, "Epic is down")
+    assert not _sent_to_epic()
+
+    # once the backoff is due, a working sink delivers them
+    conn = db.get_connection()
+    conn.execute("UPDATE epic_outbox SET next_attempt_at = 0;")
+    conn.commit()
+    conn.close()
+    assert eo.EpicDispatcher(eo.FileSink(str(tmp_path / "epic.ndjson"))).drain() == len(triages)
+
+def test_referral_without_payload_is_not_marked_sent(triages, tmp_path, monkeypatch):
+    gone = triages[0]
+    build = eo.build_referral_payloads
+    monkeypatch.setattr(eo, "build_referral_payloads", lambda ids: {k: v for k, v in build(ids).items() if k != gone})
+    assert eo.EpicDispatcher(eo.FileSink(str(tmp_path / "epic.ndjson"))).drain() == len(triages) - 1
+    row = _outbox()[gone]
+    assert (row["status"], row["attempts"], row["last_error"]) == ("pending", 1, "no referral payload")
+    assert _sent_to_epic() == set(triages[1:])
+
+def test_parked_after_max_attempts(triages):
+    eo.q_enqueue_unsent()
+    eo.q_mark_batch_failed([(triages[0], eo.idempotency_key(triages[0]), eo.MAX_ATTEMPTS - 1)], "boom")
+    assert _outbox()[triages[0]]["status"] == "failed"
+
+def test_batch_idempotency_key():
+    keys = [eo.idempotency_key(i) for i in range(200)]
+    assert eo.batch_idempotency_key(keys) == eo.batch_idempotency_key(keys[::-1])
+    # batches sharing a long common prefix still get different keys
+    assert eo.batch_idempotency_key(keys) != eo.batch_idempotency_key(keys[:-1])
+    assert len(eo.batch_idempotency_key(keys)) == 64
@@ -0,0 +1,41 @@
+# tests/test_explain.py
+''' explain=true: the reported contributions are the largest terms of the class score they explain '''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend.model_bundle import BUNDLE_ROOT, DATA_DIR, MODEL_DIR, BundleRegistry, current_id
+
+_bundle = current_id()
+_MODEL_PATH = (BUNDLE_ROOT / _bundle if _bundle else MODEL_DIR) / "sgd_softmax_best.joblib"
+
+pytestmark = pytest.mark.skipif(not _MODEL_PATH.exists(), reason="sgd_softmax_best.joblib not present")
+
+@pytest.fixture(scope="module")
+def bundle():
+    return BundleRegistry(keyword_fallback=False).get()
+
+@pytest.fixture(scope="module")
+def texts():
+    return pd.read_csv(DATA_DIR / "training_dataset.csv")["user_input"].tolist()[:300]
+
+def test_contributions_add_up_to_the_model_score(bundle, texts):
+    p = bundle.predictor
+    for text in texts:
+        X = p._vectorize([text])
+        scores = p.model.decision_function(X)[0]
+        out = bundle.predict(text)
+        classes = [bundle._class_of[c] for c, _p in out["topk"][:3]]
+        # all the terms plus the intercept are the class score; the reported ones are its largest
+        full = X.data[:, None] * p._coef_t[X.indices][:, classes]
+        assert np.allclose(full.sum(axis=0) + p.model.intercept_[classes], scores[classes]), text
+        for j, top in enumerate(p.contributions(X, classes, k=5)):
+            want = [v for v in sorted(full[:, j], reverse=True)[:5] if v > 0]
+            assert np.allclose([v for _k, _f, v in top], want), text
+
+def test_explain_does_not_change_the_prediction(bundle, texts):
+    for text in texts:
+        explained = bundle.predict(text, explain=True)
+        assert np.array_equal(explained["probs"], bundle.predict(text)["probs"]), text
+        assert explained["explanation"]
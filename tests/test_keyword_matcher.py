@@ -0,0 +1,39 @@
+# tests/test_keyword_matcher.py
+''' Keyword automaton against a brute-force scan of every pattern over every word window '''
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from backend.keyword_matcher import FLOOR, KeywordAutomaton, words
+
+DATA_DIR = Path(__file__).resolve().parents[1] / "backend" / "data"
+
+@pytest.fixture(scope="module")
+def automaton():
+    return KeywordAutomaton.from_keywords(pd.read_csv(DATA_DIR / "symptoms_full.csv")["keywords"].tolist())
+
+def _brute_force(ac, text):
+    ws = words(text)
+    grams = set(zip(ws)) | set(zip(ws, ws[1:]))
+    return {pid for pid, p in enumerate(ac.patterns) if p in grams}
+
+def test_training_dataset_matches_brute_force(automaton):
+    texts = pd.read_csv(DATA_DIR / "training_dataset.csv")["user_input"].tolist()
+    bad = [t for t in texts if set(automaton.matches(t)) != _brute_force(automaton, t)]
+    assert not bad, f"{len(bad)} of {len(texts)} utterances disagree, e.g. {bad[:3]}"
+
+@pytest.mark.parametrize("text", ["", "   ", "zzz qqq", "Heavy BLEEDING, heavy bleeding!!",
+                                  "bleeding after sex and pelvic pain", "follow-up 0-22 women's"])
+def test_edge_cases_match_brute_force(automaton, text):
+    found = automaton.matches(text)
+    assert len(found) == len(set(found))  # each distinct pattern once
+    assert set(found) == _brute_force(automaton, text)
+
+def test_hits_and_proba(automaton):
+    assert not automaton.hits("zzz qqq").any()
+    assert np.allclose(automaton.proba(automaton.hits("zzz qqq")), 1.0 / automaton.n_conditions)
+    p = automaton.proba(automaton.hits("heavy bleeding and pelvic pain"))
+    assert np.isclose(p.sum(), 1.0)
+    assert p.min() >= FLOOR / automaton.n_conditions  # no condition is ruled out
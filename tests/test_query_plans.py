@@ -0,0 +1,27 @@
+# tests/test_query_plans.py
+''' Query-plan regression gate: backend/queries/utils/check_query_plans.py as a test run '''
+import pytest
+
+from backend.queries.utils import check_query_plans as qp
+from backend import db
+
+@pytest.fixture(scope="module", params=[False, True], ids=["no-stats", "analyzed"])
+def plans(request, tmp_path_factory):
+    """ A freshly seeded throwaway database (with sqlite_stat1 for "analyzed") and its plans. """
+    old = db.DB_PATH
+    db.DB_PATH = str(tmp_path_factory.mktemp("plans") / "plans.db")
+    try:
+        yield qp.collect_plans(analyze=request.param)
+    finally:
+        db.DB_PATH = old
+
+def test_queries_were_traced(plans):
+    assert plans, "no statements traced; the query wrappers changed how they connect"
+
+def test_no_unplanned_full_scans(plans):
+    bad = qp.find_regressions(plans)
+    assert not bad, "\n".join(f"{label}: {detail}\n    {' '.join(sql.split())}" for label, detail, sql in bad)
+
+def test_conversation_page_has_no_n_plus_one(plans):
+    counts = qp.statement_counts()
+    assert len(set(counts.values())) == 1, f"statements per include=conversation page grow with page size: {counts}"
@@ -0,0 +1,63 @@
+# tests/test_speculative.py
+''' Speculative turns must answer exactly like inference() and leave the same conversation state '''
+import contextlib
+import io
+import random
+import warnings
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from backend.model_bundle import BUNDLE_ROOT, MODEL_DIR, current_id
+
+_bundle = current_id()
+_MODEL_PATH = (BUNDLE_ROOT / _bundle if _bundle else MODEL_DIR) / "sgd_softmax_best.joblib"
+
+pytestmark = pytest.mark.skipif(not _MODEL_PATH.exists(), reason="sgd_softmax_best.joblib not present")
+
+STATE_FILES = ("work.str", "null.idx", "sclr.idx", "dont.ask", "last.qid", "iter.cnt")
+# what the agent UI sends (see AgentTriage.jsx) plus joins that stress the tail merge
+FREE_TEXTS = ["", "", "yes - ", "no - ", "skip - ", "yes - started last week", " ", "  \n",
+              "ful", "-ish pain", "3 days", "pelvic  pain", "naïve", "\tspotting"]
+
+@pytest.mark.parametrize("explain", [False, True], ids=["plain", "explain"])
+def test_speculative_turns_match_inference(tmp_path, explain):
+    from joblib import load
+
+    from backend.model_inference import inference
+    from backend.speculative import ANSWERS, SpeculativeExecutor
+
+    texts = pd.read_csv(Path(__file__).resolve().parents[1] / "backend" / "data" / "training_dataset.csv")["user_input"].tolist()
+    rng = random.Random(0)
+    spec = SpeculativeExecutor()
+    differ, turns = [], 0
+    try:
+        for n in range(25):
+            a, b = tmp_path / f"plain{n}", tmp_path / f"spec{n}"
+            a.mkdir(), b.mkdir()
+            opening = " ".join(rng.sample(texts, 4))
+            with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+                warnings.filterwarnings("ignore", message="Trying to unpickle estimator")
+                inference(first_call=True, state_dir=a)
+                inference(first_call=True, state_dir=b)
+                inference(user_text=opening, state_dir=a)
+                spec.answer(user_text=opening, state_dir=b)
+                for _ in range(8):
+                    text, ans = rng.choice(FREE_TEXTS), rng.choice(ANSWERS)
+                    spec.wait(b)  # the agent reading the question aloud
+                    want = inference(user_text=text, last_ans=ans, state_dir=a, explain=explain)
+                    got = spec.answer(user_text=text, last_ans=ans, state_dir=b, explain=explain)
+                    turns += 1
+                    if got != want or any(load(a / f) != load(b / f) for f in STATE_FILES):
+                        differ.append((n, turns, text, ans))
+                    if want["question"].startswith("Thank you"):
+                        break
+            spec.cancel(b)
+    finally:
+        spec.shutdown()
+
+    stats = spec.stats()
+    assert not differ, f"{len(differ)} of {turns} turns differ from inference(): {differ[:5]}"
+    # both hit kinds were exercised, not just the fallback
+    assert stats["exact"] and stats["delta"], stats
@@ -0,0 +1,26 @@
+# tests/test_topk.py
+''' topk_indices returns exactly the head of a stable descending sort, ties lowest index first '''
+import numpy as np
+import pytest
+
+from backend.model_inference import TOPK_SORT_CUTOFF, topk_indices
+
+def _stable_topk(scores, k):
+    return np.argsort(-scores, axis=-1, kind="stable")[..., :k]
+
+# both sides of TOPK_SORT_CUTOFF: the single-row full sort and the argpartition path
+@pytest.mark.parametrize("n", [10, 140, TOPK_SORT_CUTOFF + 200])
+def test_ties_match_stable_sort(n):
+    rng = np.random.default_rng(n)
+    # rounded probabilities, all-zero doctor rows, a handful of distinct values
+    for tied in (np.round(rng.dirichlet(np.ones(n), size=50), 2), np.zeros((3, n)),
+                 rng.integers(0, 4, size=(5, n)).astype(float)):
+        for k in sorted({1, 6, n // 2, n}):
+            want = _stable_topk(tied, k)
+            assert np.array_equal(topk_indices(tied, k), want), (n, k)
+            assert np.array_equal(topk_indices(tied[0], k), want[0]), (n, k)
+
+@pytest.mark.parametrize("shape", [(140,), (1000, 140)])
+def test_distinct_scores_match_stable_sort(shape):
+    p = np.random.default_rng(0).dirichlet(np.ones(shape[-1]), size=shape[:-1] or None)
+    assert np.array_equal(topk_indices(p, 6), _stable_topk(p, 6))
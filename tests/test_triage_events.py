@@ -0,0 +1,46 @@
+# tests/test_triage_events.py
+''' Last-Event-ID resume on the /api/triages/stream event bus '''
+import asyncio
+
+from backend.queries.triage_events import TriageEventBus
+
+def _frames(bus: TriageEventBus, last_event_id, publish, n: int):
+    """ The first n frames a listener sees after the retry hint, publishing once it is attached. """
+    async def run():
+        gen = bus.stream(last_event_id, keepalive_s=5.0)
+        assert await gen.__anext__() == b"retry: 3000\n\n"
+        task = asyncio.ensure_future(gen.__anext__())
+        await asyncio.sleep(0)  # let the listener reach its wait before publishing
+        for event, data in publish:
+            bus.publish(event, data)
+        out = [await asyncio.wait_for(task, 1.0)]
+        while len(out) < n:
+            out.append(await asyncio.wait_for(gen.__anext__(), 1.0))
+        await gen.aclose()
+        return [f.decode() for f in out]
+    return asyncio.run(run())
+
+def test_resume_replays_missed_frames():
+    bus = TriageEventBus()
+    for i in range(3):
+        bus.publish("triage.created", {"id": str(i)})
+    frames = _frames(bus, "1", [], 2)
+    assert frames[0].startswith("id: 2\nevent: triage.created")
+    assert frames[1].startswith("id: 3\nevent: triage.created")
+
+def test_id_ahead_of_server_resyncs_then_streams_live():
+    # a server restart resets ids; an EventSource reconnecting with its old id must not go silent
+    bus = TriageEventBus()
+    bus.publish("triage.created", {"id": "1"})
+    bus.publish("triage.created", {"id": "2"})
+    frames = _frames(bus, "900", [("triage.updated", {"id": "3"})], 2)
+    assert frames[0] == "id: 2\nevent: resync\ndata: {}\n\n"
+    assert frames[1].startswith("id: 3\nevent: triage.updated")
+
+def test_fell_behind_ring_buffer_resyncs():
+    bus = TriageEventBus(history=4)
+    for i in range(10):
+        bus.publish("triage.created", {"id": str(i)})
+    frames = _frames(bus, "2", [], 2)
+    assert frames[0] == "id: 6\nevent: resync\ndata: {}\n\n"
+    assert frames[1].startswith("id: 7\n")
@@ -0,0 +1,92 @@
+# tests/test_write_queue.py
+''' Group commit: writes are durable and visible when run() returns, and failures stay with their caller '''
+import sqlite3
+import threading
+
+import pytest
+
+from backend import db
+from backend.queries import write_queue as wq_module
+from backend.queries.write_queue import WriteQueue
+
+@pytest.fixture
+def wq(tmp_path):
+    """ A running WriteQueue over a fresh database with one scratch table. """
+    old = db.DB_PATH
+    db.DB_PATH = str(tmp_path / "writes.db")
+    conn = db.get_connection()
+    conn.execute("CREATE TABLE note (id INTEGER PRIMARY KEY, body TEXT NOT NULL);")
+    conn.commit()
+    conn.close()
+    q = WriteQueue(window_s=0.005)
+    try:
+        yield q
+    finally:
+        q.stop()
+        db.DB_PATH = old
+
+def _count() -> int:
+    conn = db.get_connection()
+    try:
+        return conn.execute("SELECT COUNT(*) AS n FROM note;").fetchone()["n"]
+    finally:
+        conn.close()
+
+def test_concurrent_writes_share_commits_and_read_their_own_write(wq):
+    stale, errors = [], []
+
+    def _writer(n):
+        try:
+            for i in range(20):
+                rowid = wq.execute("INSERT INTO note (body) VALUES (?);", (f"{n}-{i}",)).lastrowid
+                conn = db.get_connection()
+                try:
+                    if conn.execute("SELECT id FROM note WHERE id = ?;", (rowid,)).fetchone() is None:
+                        stale.append(rowid)
+                finally:
+                    conn.close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=_writer, args=(n,)) for n in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors and not stale
+    assert _count() == 320
+    assert wq.writes == 320 and wq.commits < wq.writes
+
+def test_failing_write_rolls_back_alone(wq):
+    def _half_then_fail(conn):
+        conn.execute("INSERT INTO note (body) VALUES ('partial');")
+        conn.execute("INSERT INTO note (body) VALUES (NULL);")
+
+    futures = [wq.submit(lambda c: c.execute("INSERT INTO note (body) VALUES ('a');")),
+               wq.submit(_half_then_fail),
+               wq.submit(lambda c: c.execute("INSERT INTO note (body) VALUES ('b');"))]
+    futures[0].result(5)
+    with pytest.raises(sqlite3.IntegrityError):
+        futures[1].result(5)
+    futures[2].result(5)
+    assert _count() == 2
+    assert wq.failed_writes == 1
+
+def test_nested_write_joins_the_group(wq):
+    def _outer(conn):
+        conn.execute("INSERT INTO note (body) VALUES ('outer');")
+        return wq.execute("INSERT INTO note (body) VALUES ('inner');").rowcount
+
+    assert wq.run(_outer, timeout=5) == 1
+    assert _count() == 2
+
+def test_group_that_cannot_begin_fails_its_callers_and_the_writer_survives(wq, monkeypatch):
+    def _no_connection():
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(wq_module, "get_connection", _no_connection)
+    with pytest.raises(sqlite3.OperationalError):
+        wq.submit(lambda c: c.execute("INSERT INTO note (body) VALUES ('lost');")).result(5)
+    monkeypatch.undo()
+    wq.execute("INSERT INTO note (body) VALUES ('kept');")
+    assert _count() == 1